@@ -0,0 +1,359 @@
+import numpy
+
+
+def pack(inputs, n=None):
+    """
+    Pack time courses into a single contiguous array.
+
+    Parameters
+    ----------
+    inputs : iterable
+        Time courses, each of which is a list of [t, x1, x2, ...] at each time point.
+        A generator is also accepted.
+    n : int, optional
+        A number of time courses. If given, the array is allocated at once
+        when the first time course arrives, and filled in place.
+
+    Returns
+    -------
+    (t, block) : tuple
+        An array of time points, and a float64 array with the shape
+        (n_runs, n_times, n_species).
+
+    """
+    inputs = iter(inputs)
+    first = next(inputs, None)
+    if first is None:
+        raise ValueError("No input was given.")
+
+    first = numpy.asarray(first, numpy.float64)
+    t = first[:, 0].copy()
+
+    if n is None:
+        block = numpy.asarray([first] + list(inputs), numpy.float64)
+        if block.ndim != 3:
+            raise ValueError("Time courses must have the same shape.")
+        return (t, numpy.ascontiguousarray(block[:, :, 1: ]))
+
+    block = numpy.empty((n, ) + first[:, 1: ].shape, numpy.float64)
+    block[0] = first[:, 1: ]
+    k = 1
+    for data in inputs:
+        if k >= n:
+            raise ValueError("More than {:d} time courses were given.".format(n))
+        block[k] = numpy.asarray(data, numpy.float64)[:, 1: ]
+        k += 1
+    if k != n:
+        raise ValueError("Only {:d} time courses were given, but {:d} expected.".format(k, n))
+    return (t, block)
+
+class RunningStatistics(object):
+    """
+    Accumulate statistics over trajectories one by one without keeping them all.
+    Mean and variance are updated with Welford's online algorithm.
+
+    Examples
+    --------
+    >>> from ecell4.extra.ensemble import imap_multiprocessing, singlerun
+    >>> stats = RunningStatistics(minmax=True)
+    >>> for job_id, task_id, data in imap_multiprocessing(singlerun, jobs, n=1000):  # doctest: +SKIP
+    ...     stats.add(data)
+    >>> stats.mean()  # doctest: +SKIP
+
+    """
+
+    def __init__(self, minmax=False, reservoir=0, seed=None):
+        """
+        Parameters
+        ----------
+        minmax : bool, optional
+            Whether it keeps the minimum and maximum values, or not.
+            False for default.
+        reservoir : int, optional
+            A number of trajectories sampled uniformly at random
+            (reservoir sampling) to estimate quantiles.
+            0 for default, which means no quantile is available.
+        seed : int, optional
+            A seed for the reservoir sampling.
+
+        """
+        self.__count = 0
+        self.__t = None
+        self.__mean = None
+        self.__m2 = None
+        self.__minmax = minmax
+        self.__min = None
+        self.__max = None
+        self.__reservoir_size = reservoir
+        self.__reservoir = None
+        self.__rng = numpy.random.RandomState(seed)
+
+    def add(self, data):
+        """
+        Add a trajectory.
+
+        Parameters
+        ----------
+        data : list or array
+            A time course, which is a list of [t, x1, x2, ...] at each time point.
+            e.g.) a result of `run_simulation` with `return_type='array'`.
+
+        """
+        data = numpy.asarray(data, numpy.float64)
+        x = data[:, 1: ]
+
+        if self.__count == 0:
+            self.__t = data[:, 0].copy()
+            self.__mean = numpy.zeros_like(x)
+            self.__m2 = numpy.zeros_like(x)
+            if self.__minmax:
+                self.__min = x.copy()
+                self.__max = x.copy()
+            if self.__reservoir_size > 0:
+                self.__reservoir = numpy.empty((self.__reservoir_size, ) + x.shape, numpy.float64)
+        elif x.shape != self.__mean.shape:
+            raise ValueError(
+                "A trajectory with a wrong shape was given [{}]. {} is expected.".format(
+                    x.shape, self.__mean.shape))
+
+        self.__count += 1
+        delta = x - self.__mean
+        self.__mean += delta / self.__count
+        self.__m2 += delta * (x - self.__mean)
+
+        if self.__minmax:
+            numpy.minimum(self.__min, x, out=self.__min)
+            numpy.maximum(self.__max, x, out=self.__max)
+
+        if self.__reservoir_size > 0:
+            if self.__count <= self.__reservoir_size:
+                self.__reservoir[self.__count - 1] = x
+            else:
+                k = self.__rng.randint(self.__count)
+                if k < self.__reservoir_size:
+                    self.__reservoir[k] = x
+
+    def count(self):
+        return self.__count
+
+    def t(self):
+        return self.__t
+
+    def mean(self):
+        return self.__mean
+
+    def var(self):
+        """Return the (population) variance."""
+        return self.__m2 / self.__count
+
+    def std(self):
+        return numpy.sqrt(self.var())
+
+    def stderr(self):
+        """Return the standard error of the mean."""
+        return self.std() / numpy.sqrt(self.__count)
+
+    def relative_stderr(self, per_species=False):
+        """
+        Return the relative standard error of the mean, which is the norm of
+        standard errors over the norm of means along time points.
+        This is infinity until two trajectories are added.
+
+        Parameters
+        ----------
+        per_species : bool, optional
+            If True, return an array with a value for each species.
+            Otherwise, return a single value over all species.
+            False for default.
+
+        """
+        if self.__count < 2:
+            if per_species and self.__mean is not None:
+                return numpy.full(self.__mean.shape[1], numpy.inf)
+            return numpy.inf
+        axis = 0 if per_species else None
+        se = numpy.sqrt(numpy.sum(self.stderr() ** 2, axis=axis))
+        norm = numpy.sqrt(numpy.sum(self.__mean ** 2, axis=axis))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            value = numpy.where(norm > 0, se / norm, numpy.where(se > 0, numpy.inf, 0.0))
+        return value if per_species else float(value)
+
+    def min(self):
+        if not self.__minmax:
+            raise RuntimeError("The minimum is not available. Give 'minmax=True'.")
+        return self.__min
+
+    def max(self):
+        if not self.__minmax:
+            raise RuntimeError("The maximum is not available. Give 'minmax=True'.")
+        return self.__max
+
+    def quantile(self, q):
+        """
+        Return an estimate of the q-th quantile from the reservoir.
+
+        Parameters
+        ----------
+        q : float or list
+            Quantile(s) to compute, which must be between 0 and 1 inclusive.
+
+        """
+        if self.__reservoir_size == 0:
+            raise RuntimeError("No quantile is available. Give 'reservoir' a positive size.")
+        size = min(self.__count, self.__reservoir_size)
+        return numpy.quantile(self.__reservoir[: size], q, axis=0)
+
+def to_dataframe(t, block, species_list, wide=False):
+    """
+    Convert packed time courses into a single pandas.DataFrame.
+    This requires pandas.
+
+    Parameters
+    ----------
+    t : array
+        Time points.
+    block : array
+        A float64 array with the shape (n_runs, n_times, n_species).
+    species_list : list
+        A list of serials of Species corresponding to the last axis.
+    wide : bool, optional
+        If False, return a tidy frame with columns Run, Time, Species and Value,
+        where Run and Species are categorical.
+        If True, return a frame indexed by (Run, Time) with a column per Species.
+        False for default.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+
+    """
+    import pandas
+
+    (n_runs, n_times, n_species) = block.shape
+    runs = numpy.arange(1, n_runs + 1)
+
+    if wide:
+        index = pandas.MultiIndex.from_product([runs, t], names=['Run', 'Time'])
+        return pandas.DataFrame(
+            block.reshape(n_runs * n_times, n_species), index=index, columns=list(species_list))
+
+    return pandas.DataFrame(dict(
+        Run=pandas.Categorical.from_codes(
+            numpy.repeat(numpy.arange(n_runs), n_times * n_species), runs),
+        Time=numpy.tile(numpy.repeat(t, n_species), n_runs),
+        Species=pandas.Categorical.from_codes(
+            numpy.tile(numpy.arange(n_species), n_runs * n_times), list(species_list)),
+        Value=block.ravel()), columns=['Run', 'Time', 'Species', 'Value'])
+
+def to_xarray(t, block, species_list):
+    """
+    Convert packed time courses into a labelled 3-D array.
+    This requires xarray.
+
+    Parameters
+    ----------
+    t : array
+        Time points.
+    block : array
+        A float64 array with the shape (n_runs, n_times, n_species).
+    species_list : list
+        A list of serials of Species corresponding to the last axis.
+
+    Returns
+    -------
+    arr : xarray.DataArray
+        An array with dimensions ('run', 'time', 'species').
+
+    """
+    import xarray
+
+    return xarray.DataArray(
+        block, dims=('run', 'time', 'species'),
+        coords=dict(run=numpy.arange(1, block.shape[0] + 1), time=t, species=list(species_list)))
+
+def to_sweep_xarray(names, points, t, block, species_list, levels=None):
+    """
+    Convert time courses of a parameter sweep into a labelled array.
+    This requires xarray.
+
+    Parameters
+    ----------
+    names : list
+        A list of parameter names.
+    points : array
+        Parameter values with the shape (n_points, n_params).
+    t : array
+        Time points.
+    block : array
+        A float64 array with the shape (n_points, n_runs, n_times, n_species).
+    species_list : list
+        A list of serials of Species corresponding to the last axis.
+    levels : list, optional
+        Values of each parameter when points form a full grid,
+        in the order of `itertools.product`. If given, each parameter
+        becomes a dimension. Otherwise, points are laid on a dimension 'sample'
+        with each parameter as its coordinate.
+
+    Returns
+    -------
+    arr : xarray.DataArray
+        An array with dimensions (*names, 'run', 'time', 'species') for a grid,
+        or ('sample', 'run', 'time', 'species') otherwise.
+
+    """
+    import xarray
+
+    reserved = set(names) & set(('sample', 'run', 'time', 'species'))
+    if len(reserved) > 0:
+        raise ValueError("Parameter names conflict with dimensions [{}].".format(', '.join(sorted(reserved))))
+
+    coords = dict(run=numpy.arange(1, block.shape[1] + 1), time=t, species=list(species_list))
+    if levels is not None:
+        shape = tuple(len(values) for values in levels) + block.shape[1: ]
+        coords.update(zip(names, levels))
+        return xarray.DataArray(
+            block.reshape(shape), dims=tuple(names) + ('run', 'time', 'species'), coords=coords)
+
+    coords['sample'] = numpy.arange(1, block.shape[0] + 1)
+    coords.update((name, ('sample', points[:, i])) for i, name in enumerate(names))
+    return xarray.DataArray(block, dims=('sample', 'run', 'time', 'species'), coords=coords)
+
+def to_sweep_dataframe(names, points, t, block, species_list):
+    """
+    Convert time courses of a parameter sweep into a single tidy pandas.DataFrame
+    with a column for each parameter, followed by Run, Time, Species and Value.
+    This requires pandas.
+
+    Parameters
+    ----------
+    names : list
+        A list of parameter names.
+    points : array
+        Parameter values with the shape (n_points, n_params).
+    t : array
+        Time points.
+    block : array
+        A float64 array with the shape (n_points, n_runs, n_times, n_species).
+    species_list : list
+        A list of serials of Species corresponding to the last axis.
+
+    Returns
+    -------
+    df : pandas.DataFrame
+
+    """
+    import pandas
+
+    (n_points, n_runs, n_times, n_species) = block.shape
+    size = n_runs * n_times * n_species
+    runs = numpy.arange(1, n_runs + 1)
+
+    columns = [(name, numpy.repeat(points[:, i], size)) for i, name in enumerate(names)]
+    columns.extend((
+        ('Run', pandas.Categorical.from_codes(
+            numpy.tile(numpy.repeat(numpy.arange(n_runs), n_times * n_species), n_points), runs)),
+        ('Time', numpy.tile(numpy.repeat(t, n_species), n_points * n_runs)),
+        ('Species', pandas.Categorical.from_codes(
+            numpy.tile(numpy.arange(n_species), n_points * n_runs * n_times), list(species_list))),
+        ('Value', block.ravel())))
+    return pandas.DataFrame(dict(columns), columns=[name for name, _ in columns])
@@ -0,0 +1,225 @@
+"""
+Asynchronous variants of the runners in `ecell4.extra.ensemble` for asyncio.
+
+Each call is driven by a thread of its own, and results are handed over to the
+event loop as they finish. Thus, the event loop is never blocked while waiting
+for workers or a scheduler. When the awaiting task is cancelled, or the iteration
+stops halfway, the call is cancelled: workers are terminated for 'multiprocessing',
+and jobs still running are deleted with `qdel` or `scancel` for 'sge' and 'slurm'.
+
+Examples
+--------
+>>> from ecell4.extra import aio
+>>> async def study(target, jobs):
+...     async for job_id, task_id, res in aio.aimap_sge(target, jobs, n=10):
+...         print(job_id, task_id, res)
+...
+>>> asyncio.run(study(target, jobs))  # doctest: +SKIP
+
+"""
+import asyncio
+import threading
+import functools
+import inspect
+import concurrent.futures
+import logging
+
+from . import ensemble
+
+
+def get_logger():
+    return logging.getLogger('aio')
+
+def _resolve(future, retval, err):
+    if future.done():
+        return
+    elif err is None:
+        future.set_result(retval)
+    else:
+        future.set_exception(err)
+
+def _thread(loop, func):
+    """Call the function in a new thread, and return a future of the return value."""
+    future = loop.create_future()
+
+    def run():
+        try:
+            retval, err = func(), None
+        except Exception as exc:
+            retval, err = None, exc
+        try:
+            loop.call_soon_threadsafe(_resolve, future, retval, err)
+        except RuntimeError:
+            pass  # The event loop is already closed
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+async def _join(finished, cancel):
+    # Let the thread stop and clean up (e.g. qdel), and wait for it.
+    cancel.set()
+    try:
+        await finished
+    except concurrent.futures.CancelledError:
+        pass
+    except Exception as err:
+        get_logger().warning("An error occurred while cancelling: {}".format(str(err)))
+
+async def aimap(imap, target, jobs, n=1, **kwargs):
+    """
+    Evaluate the given function with each set of arguments through `imap`
+    in a thread, and yield results asynchronously in the order of completion.
+
+    Parameters
+    ----------
+    imap : function
+        One of `imap_serial`, `imap_multiprocessing`, `imap_sge` and `imap_slurm`
+        in `ecell4.extra.ensemble`. It must accept `cancel`, a threading.Event.
+    target : function
+        A function to be evaluated.
+    jobs : list
+        A list of arguments passed to the function.
+    n : int, optional
+        A number of tasks. Repeat the evaluation `n` times for each job.
+        1 for default.
+    **kwargs : dict, optional
+        Optional keyword arguments are passed through to `imap`.
+
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
+
+    """
+    loop = asyncio.get_event_loop()
+    results = asyncio.Queue()
+    cancel = threading.Event()
+    done = object()
+
+    def produce():
+        for retval in imap(target, jobs, n, cancel=cancel, **kwargs):
+            loop.call_soon_threadsafe(results.put_nowait, retval)
+
+    finished = _thread(loop, produce)
+    finished.add_done_callback(lambda _: results.put_nowait(done))
+    try:
+        while True:
+            retval = await results.get()
+            if retval is done:
+                finished.result()  # Raise an exception in the thread if any
+                return
+            yield retval
+    finally:
+        if not finished.done():
+            await _join(finished, cancel)
+
+async def _agather(iterator, num_jobs, n, callback=None):
+    retval = [[None] * n for _ in range(num_jobs)]
+    async for job_id, task_id, res in iterator:
+        retval[job_id - 1][task_id - 1] = res
+        if callback is not None:
+            callback(job_id, task_id, res)
+    return retval
+
+def aimap_multiprocessing(target, jobs, n=1, **kwargs):
+    """
+    An asynchronous variant of `imap_multiprocessing`.
+    Workers are terminated when cancelled, unless `pool` is given.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.imap_multiprocessing
+
+    """
+    return aimap(ensemble.imap_multiprocessing, target, jobs, n, **kwargs)
+
+def aimap_sge(target, jobs, n=1, **kwargs):
+    """
+    An asynchronous variant of `imap_sge`.
+    Jobs still running are deleted with `qdel` when cancelled.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.imap_sge
+
+    """
+    return aimap(ensemble.imap_sge, target, jobs, n, **kwargs)
+
+def aimap_slurm(target, jobs, n=1, **kwargs):
+    """
+    An asynchronous variant of `imap_slurm`.
+    Jobs still running are deleted with `scancel` when cancelled.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.imap_slurm
+
+    """
+    return aimap(ensemble.imap_slurm, target, jobs, n, **kwargs)
+
+async def arun_multiprocessing(target, jobs, n=1, callback=None, **kwargs):
+    """
+    An asynchronous variant of `run_multiprocessing`.
+    `callback` is called in the event loop as each task finishes.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.run_multiprocessing
+
+    """
+    jobs = list(jobs)
+    return await _agather(aimap_multiprocessing(target, jobs, n, **kwargs), len(jobs), n, callback)
+
+async def arun_sge(target, jobs, n=1, callback=None, **kwargs):
+    """
+    An asynchronous variant of `run_sge`.
+    `callback` is called in the event loop as each task finishes.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.run_sge
+
+    """
+    jobs = list(jobs)
+    return await _agather(aimap_sge(target, jobs, n, **kwargs), len(jobs), n, callback)
+
+async def arun_slurm(target, jobs, n=1, callback=None, **kwargs):
+    """
+    An asynchronous variant of `run_slurm`.
+    `callback` is called in the event loop as each task finishes.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.run_slurm
+
+    """
+    jobs = list(jobs)
+    return await _agather(aimap_slurm(target, jobs, n, **kwargs), len(jobs), n, callback)
+
+async def aensemble_simulations(*args, **kwargs):
+    """
+    An asynchronous variant of `ensemble_simulations`.
+    Arguments are same with `ensemble_simulations`.
+    Plotting is not available here, because the simulations are driven
+    by a thread other than the main thread. Use `return_type` other than
+    'matplotlib' and 'nyaplot'.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.ensemble_simulations
+
+    """
+    arguments = inspect.signature(ensemble.ensemble_simulations).bind(*args, **kwargs).arguments
+    return_type = kwargs.get('r', arguments.get('return_type', 'matplotlib'))
+    if return_type in ('matplotlib', 'm', 'nyaplot', 'n'):
+        raise ValueError("Plotting is not available in aensemble_simulations. Give 'return_type'.")
+
+    loop = asyncio.get_event_loop()
+    cancel = threading.Event()
+    finished = _thread(
+        loop, functools.partial(ensemble.ensemble_simulations, *args, cancel=cancel, **kwargs))
+    try:
+        return await asyncio.shield(finished)
+    except asyncio.CancelledError:
+        await _join(finished, cancel)
+        raise
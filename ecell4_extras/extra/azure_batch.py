@@ -13,23 +13,41 @@ import sys
 import time
 import binascii
 import pickle
-import textwrap
-import inspect
 import itertools
-import re
 import io
+import re
+import zipfile
+import concurrent.futures
 from logging import getLogger
 _log = getLogger(__name__)
 
-import azure.storage.blob as azureblob
-import azure.batch.batch_service_client as batch
-import azure.batch.batch_auth as batchauth
-import azure.batch.models as batchmodels
+try:
+    import azure.storage.blob as azureblob
+    import azure.batch.batch_service_client as batch
+    import azure.batch.batch_auth as batchauth
+    import azure.batch.models as batchmodels
+except ImportError:
+    # Replaced by `ecell4.extra.azurelocal.AzureLocal` to run offline.
+    azureblob = batch = batchauth = batchmodels = None
+
+from . import worker
 
 _STANDARD_OUT_FILE_NAME = 'stdout.txt'
 _STANDARD_ERROR_FILE_NAME = 'stderr.txt'
 _SAMPLES_CONFIG_FILE_NAME = 'configuration.cfg'
 
+# The number of vCPUs of VM sizes, whose name doesn't tell it.
+# For the other sizes, e.g. Standard_D4s_v3 and Standard_F8s_v2,
+# the number in the name is the number of vCPUs.
+_VM_CORES = {
+    'standard_a0': 1, 'standard_a1': 1, 'standard_a2': 2, 'standard_a3': 4, 'standard_a4': 8,
+    'standard_a5': 2, 'standard_a6': 4, 'standard_a7': 8,
+    'standard_a8': 8, 'standard_a9': 16, 'standard_a10': 8, 'standard_a11': 16,
+    'standard_d11': 2, 'standard_d12': 4, 'standard_d13': 8, 'standard_d14': 16,
+    'standard_d1_v2': 1, 'standard_d2_v2': 2, 'standard_d3_v2': 4, 'standard_d4_v2': 8,
+    'standard_d5_v2': 16, 'standard_d11_v2': 2, 'standard_d12_v2': 4, 'standard_d13_v2': 8,
+    'standard_d14_v2': 16, 'standard_d15_v2': 20}
+
 try:
     import configparser
 except ImportError:
@@ -53,6 +71,19 @@ def print_batch_exception(batch_exception):
                 _log.error('{}:\t{}'.format(mesg.key, mesg.value))
     _log.error('-------------------------------------------')
 
+def vm_cores(vm_size):
+    """Returns the number of vCPUs of the given VM size.
+
+    :param str vm_size: A type of vm, e.g. 'Standard_D11_v2'.
+    :rtype: int
+    :return: The number of vCPUs, or None if unknown.
+    """
+    key = re.sub(r'^standard_ds', 'standard_d', vm_size.lower().replace('_promo', ''))
+    if key in _VM_CORES:
+        return _VM_CORES[key]
+    mobj = re.match(r'^standard_[a-z]+(\d+)', key)
+    return int(mobj.group(1)) if mobj is not None else None
+
 def upload_file_to_container(block_blob_client, container_name, file_path):
     """Uploads a local file to an Azure Blob storage container.
 
@@ -85,6 +116,26 @@ def upload_file_to_container(block_blob_client, container_name, file_path):
     return batchmodels.ResourceFile(file_path=blob_name,
                                     blob_source=sas_url)
 
+def upload_files_to_container(block_blob_client, container_name, file_paths, max_workers=1):
+    """Uploads local files to an Azure Blob storage container concurrently.
+
+    :param block_blob_client: A blob service client.
+    :type block_blob_client: `azure.storage.blob.BlockBlobService`
+    :param str container_name: The name of the Azure Blob storage container.
+    :param list file_paths: A list of local paths to the files.
+    :param int max_workers: The number of files transferred at once. 1 as default.
+    :rtype: list
+    :return: A list of ResourceFiles corresponding to `file_paths`.
+    """
+    if max_workers <= 1 or len(file_paths) <= 1:
+        return [upload_file_to_container(block_blob_client, container_name, file_path)
+                for file_path in file_paths]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(
+            lambda file_path: upload_file_to_container(block_blob_client, container_name, file_path),
+            file_paths))
+
 def get_container_sas_token(block_blob_client,
                             container_name, blob_permissions):
     """Obtains a shared access signature granting the specified permissions to the
@@ -153,9 +204,62 @@ def wrap_commands_in_shell(ostype, commands):
     else:
         raise ValueError('unknown ostype: {}'.format(ostype))
 
+def node_requirements():
+    """Returns pip requirements installed on nodes, which pin cloudpickle
+    and E-Cell 4 to the versions used by this client.
+
+    :rtype: list
+    :return: A list of requirements.
+    """
+    requirements = []
+    try:
+        import cloudpickle
+        requirements.append('cloudpickle=={}'.format(cloudpickle.__version__))
+    except ImportError:
+        requirements.append('cloudpickle')
+    try:
+        import ecell4
+        requirements.append('ecell=={}'.format(ecell4.__version__))
+    except (ImportError, AttributeError):
+        requirements.append('ecell')
+    return requirements
+
+def start_task_commands(python, requirements):
+    """Returns commands preparing a node to run tasks with the given Python.
+
+    :param str python: A name of the Python interpreter, e.g. 'python3.8'.
+    :param list requirements: A list of pip requirements.
+    :rtype: list
+    :return: A list of commands.
+    """
+    return [
+        # Install the same version of Python as the client
+        'add-apt-repository -y ppa:deadsnakes/ppa',
+        'apt-get update',
+        'apt-get install -y {0} {0}-venv'.format(python),
+        '{} -m ensurepip'.format(python),
+        # Install the azure-storage module so that the task script can access
+        # Azure Blob storage, pre-cryptography version, and cloudpickle and
+        # E-Cell 4 of the same versions as the client. The package of this module
+        # is shipped with each task, and used in place of the one installed.
+        '{} -m pip install azure-storage==0.32.0 {}'.format(python, ' '.join(requirements))]
+
+def archive_package(file_path):
+    """Writes this package, e.g. `ecell4.extra`, into a zip archive to be
+    shipped with tasks, so that nodes import the same code as the client.
+
+    :param str file_path: The local path to the archive.
+    """
+    root = os.path.dirname(os.path.realpath(__file__))
+    prefix = __name__.rpartition('.')[0].replace('.', '/')
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as zout:
+        for filename in sorted(os.listdir(root)):
+            if filename.endswith('.py'):
+                zout.write(os.path.join(root, filename), '{}/{}'.format(prefix, filename))
+
 def create_pool(batch_service_client, pool_id,
                 resource_files, publisher, offer, sku,
-                task_file, vm_size, node_count):
+                vm_size, node_count, python='python', requirements=()):
     """Creates a pool of compute nodes with the specified OS settings.
 
     :param batch_service_client: A Batch service client.
@@ -166,9 +270,10 @@ def create_pool(batch_service_client, pool_id,
     :param str publisher: Marketplace image publisher
     :param str offer: Marketplace image offer
     :param str sku: Marketplace image sku
-    :param str task_file: A file name of the script
     :param str vm_size: A type of vm
     :param str node_count: The number of nodes
+    :param str python: A name of the Python interpreter installed on nodes.
+    :param list requirements: A list of pip requirements installed on nodes.
     """
     _log.info('Creating pool [{}]...'.format(pool_id))
 
@@ -180,20 +285,9 @@ def create_pool(batch_service_client, pool_id,
     # Specify the commands for the pool's start task. The start task is run
     # on each node as it joins the pool, and when it's rebooted or re-imaged.
     # We use the start task to prep the node for running our task script.
-    task_commands = [
-        # Copy the python_tutorial_task.py script to the "shared" directory
-        # that all tasks that run on the node have access to. Note that
-        # we are using the -p flag with cp to preserve the file uid/gid,
-        # otherwise since this start task is run as an admin, it would not
-        # be accessible by tasks run as a non-admin user.
-        'cp -p {} $AZ_BATCH_NODE_SHARED_DIR'.format(os.path.basename(task_file)),
-        # Install pip
-        'curl -fSsL https://bootstrap.pypa.io/get-pip.py | python',
-        # Install the azure-storage module so that the task script can access
-        # Azure Blob storage, pre-cryptography version
-        'pip install azure-storage==0.32.0',
-        # Install E-Cell 4
-        'pip install https://1028-6348303-gh.circle-artifacts.com/0/root/circle/wheelhouse/ecell-4.1.2-cp27-cp27mu-manylinux1_x86_64.whl']
+    # The script itself is given to each task as a resource file, so that
+    # a pool kept alive across calls always runs the current one.
+    task_commands = start_task_commands(python, requirements)
 
     # Get the node agent SKU and image reference for the virtual machine
     # configuration.
@@ -248,45 +342,64 @@ def create_job(batch_service_client, job_id, pool_id):
 
 def add_tasks(batch_service_client, job_id, loads,
               output_container_name, output_container_sas_token,
-              task_file, acount_name):
-    """Adds a task for each input file in the collection to the specified job.
+              task_file, acount_name, target_file, processes=1,
+              package_file=None, python='python'):
+    """Adds a task for each load in the collection to the specified job.
 
     :param batch_service_client: A Batch service client.
     :type batch_service_client: `azure.batch.BatchServiceClient`
     :param str job_id: The ID of the job to which to add the tasks.
-    :param list input_files: A collection of input files. One task will be
-     created for each input file.
+    :param list loads: A collection of loads. One task will be created for each
+     load, which is a tuple of a list of input files, an output file name, and
+     a list of pairs of a job and task id corresponding to the input files.
     :param output_container_name: The ID of an Azure Blob storage container to
     which the tasks will upload their results.
     :param output_container_sas_token: A SAS token granting write access to
     the specified Azure Blob storage container.
-    :param str task_file: A file name of the script
+    :param task_file: A resource file of the script
     :param str account_name: A storage account
+    :param target_file: A resource file of the pickled spec of the target.
+    :param int processes: The number of processes evaluating a load on a node.
+    :param package_file: A resource file of the archived package used on nodes.
+    :param str python: A name of the Python interpreter on nodes.
     """
 
     _log.info('Adding {} tasks to job [{}]...'.format(len(loads), job_id))
-    # _log.info('Adding {} tasks to job [{}]...'.format(len(input_files), job_id))
 
     tasks = list()
 
-    for (input_file, output_file, i, j) in loads:
-        command = ['python $AZ_BATCH_NODE_SHARED_DIR/{} '
-                   '--filepath {} --output {} --storageaccount {} '
-                   '--task_id {} --job_id {} '
+    for k, (input_files, output_file, pairs) in enumerate(loads):
+        command = ['{} {} azure '
+                   '--target {} --filepath {} --output {} --storageaccount {} '
+                   '--job_id {} --task_id {} --processes {} '
                    '--storagecontainer {} --sastoken "{}"'.format(
-                       os.path.basename(task_file),
-                       input_file.file_path,
+                       python,
+                       task_file.file_path,
+                       target_file.file_path,
+                       ' '.join(input_file.file_path for input_file in input_files),
                        output_file,
                        acount_name,
-                       i, j,
+                       ' '.join(str(i) for i, _ in pairs),
+                       ' '.join(str(j) for _, j in pairs),
+                       processes,
                        output_container_name,
                        output_container_sas_token)]
+        if package_file is not None:
+            command[0] += ' --package {}'.format(package_file.file_path)
         _log.debug('CMD : "{}"'.format(command[0]))
 
+        # Each input file is downloaded once even if shared by tasks.
+        resource_files = [task_file, target_file]
+        if package_file is not None:
+            resource_files.append(package_file)
+        for input_file in input_files:
+            if all(input_file is not resource_file for resource_file in resource_files):
+                resource_files.append(input_file)
+
         tasks.append(batch.models.TaskAddParameter(
-                'topNtask{}-{}'.format(i, j),
+                'topNtask{}'.format(k + 1),
                 wrap_commands_in_shell('linux', command),
-                resource_files=[input_file]
+                resource_files=resource_files
                 )
         )
 
@@ -333,7 +446,7 @@ def wait_for_tasks_to_complete(batch_service_client, job_ids, timeout):
 
 def download_blobs_from_container(block_blob_client,
                                   container_name, directory_path,
-                                  prefix=None):
+                                  prefix=None, max_workers=1):
     """Downloads all blobs from the specified Azure Blob storage container.
 
     :param block_blob_client: A blob service client.
@@ -342,24 +455,34 @@ def download_blobs_from_container(block_blob_client,
      download files.
     :param directory_path: The local directory to which to download the files.
     :param str prefix: A name prefix to filter blobs. None as its default
+    :param int max_workers: The number of blobs transferred at once. 1 as default.
     """
     _log.info('Downloading all files from container [{}]...'.format(container_name))
 
-    container_blobs = block_blob_client.list_blobs(container_name, prefix=None)
-    _log.info('{} blobs are found [{}]'.format(len(tuple(container_blobs)), ', '.join(blob.name for blob in container_blobs.items)))
+    container_blobs = block_blob_client.list_blobs(container_name, prefix=prefix)
+    blob_names = [blob.name for blob in container_blobs.items]
+    _log.info('{} blobs are found [{}]'.format(len(blob_names), ', '.join(blob_names)))
 
-    for blob in container_blobs.items:
-        destination_file_path = os.path.join(directory_path, blob.name)
+    def download(blob_name):
+        destination_file_path = os.path.join(directory_path, blob_name)
 
         block_blob_client.get_blob_to_path(container_name,
-                                           blob.name,
+                                           blob_name,
                                            destination_file_path)
 
         _log.info('  Downloaded blob [{}] from container [{}] to {}'.format(
-            blob.name,
+            blob_name,
             container_name,
             destination_file_path))
 
+    if max_workers <= 1:
+        for blob_name in blob_names:
+            download(blob_name)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            for _ in executor.map(download, blob_names):
+                pass
+
     _log.info('  Download complete!')
 
 def _read_stream_as_string(stream, encoding):
@@ -433,7 +556,7 @@ def print_task_output(batch_client, job_id, task_ids, encoding=None):
             task_id))
         print(file_text)
 
-def run_azure(target, jobs, n=1, path='.', delete=True, config=None):
+def run_azure(target, jobs, n=1, path='.', delete=True, config=None, tasks=None, nproc=None):
     """Execute a function for multiple sets of arguments on Microsoft Azure,
     and return the results as a list.
 
@@ -442,6 +565,10 @@ def run_azure(target, jobs, n=1, path='.', delete=True, config=None):
     :param int n: The number of repeats running the target. 1 as default.
     :param str path: A path to save temp files. The current path as default.
     :param bool delete: Delete temp files after finishing jobs, or not. True as default.
+    :param list tasks: A list of pairs of a job and task id (1-origin) to be evaluated.
+        Results of the other tasks are left None. All the tasks as default.
+    :param int nproc: The maximum number of tasks evaluated at once.
+        All the cores of the pool as default.
     :param config: str or configparser.ConfigParser. A config file. An example is the following:
 
     ```
@@ -454,16 +581,44 @@ def run_azure(target, jobs, n=1, path='.', delete=True, config=None):
     pool.nodecount = 2
     # pool.id = MyPool
     # pool.vmsize = Standard_D11_v2
+    # pool.keep = false
+    # pool.cores = 2
     # os.publisher = Canonical
     # os.offer = UbuntuServer
     # os.sku = 16
+    # node.python = python3.8
+    # node.requirements = cloudpickle==1.6.0 ecell==4.2.0
     # job.id = MyJob
+    # transfer.threads = 8
     ```
 
+    With `pool.keep = true`, the pool named `pool.id` is reused if it exists,
+    with its own vm size and number of nodes, and is left alive after the call
+    for the next one. Otherwise, a new pool is
+    created and deleted for each call. `transfer.threads` is the number of
+    files uploaded or downloaded at once.
+
+    Nodes install `node.python`, which is the same version of Python as the
+    client for default, and `node.requirements`, which pins cloudpickle and
+    E-Cell 4 to the versions of the client for default. This package itself is
+    shipped with each task, and imported in place of the one installed on nodes.
+    Thus, targets and jobs pickled by the client, including lambdas, closures
+    and objects of this package, are restored on nodes.
+
+    Tasks are packed into as many Batch tasks as nodes running at once, and each
+    Batch task evaluates its tasks with a process pool on the node. The number of
+    processes is the number of vCPUs of `pool.vmsize`, which can be overridden by
+    `pool.cores`, and both are limited so that at most `nproc` tasks run at once.
+
     :return: A list of results corresponding the `jobs` list.
     :rtype: list
     """
 
+    if batch is None:
+        raise ImportError(
+            'azure-batch and azure-storage are required. '
+            'Use ecell4.extra.azurelocal.AzureLocal to run without them.')
+
     if config is None:
         raise ValueError('Argument \'config\' must be given.')
     elif isinstance(config, str):
@@ -495,82 +650,29 @@ def run_azure(target, jobs, n=1, path='.', delete=True, config=None):
     _POOL_NODE_COUNT      = config['azure']['pool.nodecount']
     _POOL_ID              = config['azure'].get('pool.id', 'MyPool')
     _POOL_VM_SIZE         = config['azure'].get('pool.vmsize', 'Standard_D11_v2')
+    _POOL_KEEP            = config['azure'].getboolean('pool.keep', False)
+    _POOL_CORES           = config['azure'].get('pool.cores', None)
     _NODE_OS_PUBLISHER    = config['azure'].get('os.publisher', 'Canonical')
     _NODE_OS_OFFER        = config['azure'].get('os.offer', 'UbuntuServer')
     _NODE_OS_SKU          = config['azure'].get('os.sku', '16')
+    _NODE_PYTHON          = config['azure'].get('node.python', 'python{}.{}'.format(*sys.version_info[: 2]))
+    _NODE_REQUIREMENTS    = config['azure'].get('node.requirements', ' '.join(node_requirements())).split()
     _JOB_ID               = config['azure'].get('job.id', 'MyJob')
+    _TRANSFER_THREADS     = config['azure'].getint('transfer.threads', 8)
 
     if not _POOL_NODE_COUNT.isdigit():
         raise ValueError('The wrong pool node count was given [{}]. This must be an integer'.format(_POOL_NODE_COUNT))
 
-    proc_per_node = 2  #XXX: Does this depend on pool vm?
-    nproc = int(_POOL_NODE_COUNT) * proc_per_node
-
-    code_header = """
-from __future__ import print_function
-import argparse
-import os
-import string
-import azure.storage.blob as azureblob
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--filepath', required=True,
-                    help='The path to the text file to process. The path'
-                         'may include a compute node\\'s environment'
-                         'variables, such as'
-                         '$AZ_BATCH_NODE_SHARED_DIR/filename.txt')
-parser.add_argument('--output', required=True,
-                    help='The path to the output.')
-parser.add_argument('--job_id', type=int, required=True)
-parser.add_argument('--task_id', type=int, required=True)
-parser.add_argument('--storageaccount', required=True,
-                    help='The name the Azure Storage account that owns the'
-                         'blob storage container to which to upload'
-                         'results.')
-parser.add_argument('--storagecontainer', required=True,
-                    help='The Azure Blob storage container to which to'
-                         'upload results.')
-parser.add_argument('--sastoken', required=True,
-                    help='The SAS token providing write access to the'
-                         'Storage container.')
-args = parser.parse_args()
-
-input_file = os.path.realpath(args.filepath)
-output_file = args.output
+    if nproc is not None and nproc < 1:
+        raise ValueError('nproc must be a positive integer [{}].'.format(nproc))
 
-import pickle
-with open(input_file, mode='rb') as fin:
-    inputs = pickle.load(fin)
-
-"""
-    code_footer = """
-
-with open(output_file, mode='wb') as fout:
-    pickle.dump(res, fout, protocol=2)
-
-# Create the blob client using the container's SAS token.
-# This allows us to create a client that provides write
-# access only to the container.
-blob_client = azureblob.BlockBlobService(account_name=args.storageaccount,
-                                         sas_token=args.sastoken)
-output_file_path = os.path.realpath(output_file)
-blob_client.create_blob_from_path(args.storagecontainer,
-                                  output_file,
-                                  output_file_path)
-"""
-
-    src = textwrap.dedent(inspect.getsource(target)).replace(r'"', r'\"')
-    if re.match('[\s\t]+', src.split('\n')[0]) is not None:
-        raise RuntimeError(
-            "Wrong indentation was found in the source translated")
-
-    code = code_header
-    code += src
-    code += 'res = {}(inputs, args.task_id, args.job_id)'.format(target.__name__)
-    code += code_footer
-    target = code
+    # Tasks are evaluated by the worker module, which is copied to nodes as it is
+    # together with an archive of this package.
+    # The target is given as a spec, i.e. its name or a blob pickled with cloudpickle.
+    spec = worker.dumps_target(target)
 
     suffix = binascii.hexlify(os.urandom(4)).decode()
+    pool_id = _POOL_ID if _POOL_KEEP else _POOL_ID + '-' + suffix
 
     start_time = datetime.datetime.now().replace(microsecond=0)
     _log.info('Sample start: {}'.format(start_time))
@@ -578,62 +680,117 @@ blob_client.create_blob_from_path(args.storagecontainer,
     if not os.path.isdir(path):
         os.mkdir(path)
 
-    # task_file = target
-    # task_file = 'task-{}.py'.format(suffix)
-    task_file = '{}/task-{}.py'.format(path, suffix)
-    with open(task_file, 'w') as fout:
-        fout.write(target)
+    task_file = os.path.realpath(worker.__file__)
+    package_file = os.path.realpath('{}/package-{}.zip'.format(path, suffix))
+    archive_package(package_file)
 
     # Prepare input pickle files
+    target_file_name = '{}/target-{}.pickle'.format(path, suffix)
+    with open(target_file_name, mode='wb') as fout:
+        pickle.dump(spec, fout, protocol=2)
+
     input_file_names = []
-    output_file_names = []
     for i, job in enumerate(jobs):
         filename = '{}/input-{}_{}.pickle'.format(path, suffix, i)
         input_file_names.append(filename)
-        for j in range(n):
-            output_file_names.append('output-{}_{}.{}.pickle'.format(suffix, i, j + 1))
         with open(filename, mode='wb') as fout:
             pickle.dump(job, fout, protocol=2)
 
+    # The collection of data files that are to be processed by the tasks.
+    input_file_paths = [os.path.realpath(filename) for filename in input_file_names]
+    target_file_path = os.path.realpath(target_file_name)
+
     # Create the blob client, for use in obtaining references to
     # blob storage containers and uploading files to containers.
     blob_client = azureblob.BlockBlobService(
         account_name=_STORAGE_ACCOUNT_NAME,
         account_key=_STORAGE_ACCOUNT_KEY)
 
-    n_jobs = -(-(len(jobs) * n) // nproc)  # ceil for int
-    _log.info('{} jobs will be created.'.format(n_jobs))
+    # Create a Batch service client. We'll now be interacting with the Batch
+    # service in addition to Storage
+    credentials = batchauth.SharedKeyCredentials(_BATCH_ACCOUNT_NAME,
+                                                 _BATCH_ACCOUNT_KEY)
+
+    batch_client = batch.BatchServiceClient(
+        credentials,
+        base_url=_BATCH_ACCOUNT_URL)
+
+    if tasks is None:
+        tasks = [(i + 1, j + 1) for i in range(len(jobs)) for j in range(n)]
+    else:
+        tasks = sorted(tasks)
+
+    output_file_names = []
     res = None
 
+    # Containers are owned by each call, even when the pool is shared.
+    app_container_name = 'application-{}'.format(suffix)
+    input_container_name = 'input-{}'.format(suffix)
+    output_container_name = 'output-{}'.format(suffix)
+    pool_created = False
+    pool = None
+    job_names = []
+
     try:
+        # Create the pool that will contain the compute nodes that will execute the
+        # tasks. Nodes are allocated in the background while files are uploaded.
+        # The pool is reused if kept alive by a previous call.
+        if _POOL_KEEP and batch_client.pool.exists(pool_id):
+            _log.info('Reusing pool [{}]...'.format(pool_id))
+            pool = batch_client.pool.get(pool_id)
+            start_task = pool.start_task
+            if (start_task is not None and start_task.command_line
+                    != wrap_commands_in_shell('linux', start_task_commands(_NODE_PYTHON, _NODE_REQUIREMENTS))):
+                _log.warning('The pool [{}] was prepared with another Python or requirements. Delete it to update.'.format(pool_id))
+        else:
+            create_pool(batch_client,
+                        pool_id,
+                        [],
+                        _NODE_OS_PUBLISHER,
+                        _NODE_OS_OFFER,
+                        _NODE_OS_SKU,
+                        _POOL_VM_SIZE, _POOL_NODE_COUNT,
+                        _NODE_PYTHON, _NODE_REQUIREMENTS)
+            pool_created = True
+
+        # Decide the number of processes on each node, and the number of Batch tasks,
+        # each of which runs on a node. A pool kept alive may have another vm size
+        # and number of nodes than the config.
+        if pool is None:
+            (vm_size, node_count) = (_POOL_VM_SIZE, int(_POOL_NODE_COUNT))
+        else:
+            vm_size = pool.vm_size
+            node_count = int(pool.target_dedicated_nodes or 0) + int(pool.target_low_priority_nodes or 0)
+            if node_count != int(_POOL_NODE_COUNT):
+                _log.info('The pool [{}] has {} nodes, not {} in the config.'.format(pool_id, node_count, _POOL_NODE_COUNT))
+        cores = int(_POOL_CORES) if _POOL_CORES is not None else vm_cores(vm_size)
+        if cores is None:
+            _log.warning('The number of cores of [{}] is unknown. Give \'pool.cores\'.'.format(vm_size))
+            cores = 1
+        processes = min(cores, nproc or cores)
+        num_loads = min(node_count, (nproc or processes * node_count) // processes)
+        num_loads = max(1, min(num_loads, len(tasks)))
+        _log.info('{} tasks are packed into {} Batch tasks with {} processes each.'.format(
+            len(tasks), num_loads, processes))
+
         # Use the blob client to create the containers in Azure Storage if they
         # don't yet exist.
-        app_container_name = 'application'
-        input_container_name = 'input'
-        output_container_name = 'output'
         blob_client.create_container(app_container_name, fail_on_exist=False)
         blob_client.create_container(input_container_name, fail_on_exist=False)
         blob_client.create_container(output_container_name, fail_on_exist=False)
 
-        # Paths to the task script. This script will be executed by the tasks that
-        # run on the compute nodes.
-        application_file_paths = [os.path.realpath(task_file)]
-
-        # The collection of data files that are to be processed by the tasks.
-        input_file_paths = [os.path.realpath(filename) for filename in input_file_names]
-
         # Upload the application script to Azure Storage. This is the script that
         # will process the data files, and is executed by each of the tasks on the
         # compute nodes.
-        application_files = [
-            upload_file_to_container(blob_client, app_container_name, file_path)
-            for file_path in application_file_paths]
+        (application_file, package) = upload_files_to_container(
+            blob_client, app_container_name, [task_file, package_file], _TRANSFER_THREADS)
 
         # Upload the data files. This is the data that will be processed by each of
         # the tasks executed on the compute nodes in the pool.
-        input_files = [
-            upload_file_to_container(blob_client, input_container_name, file_path)
-            for file_path in input_file_paths]
+        input_files = upload_files_to_container(
+            blob_client, input_container_name, input_file_paths + [target_file_path],
+            _TRANSFER_THREADS)
+        target_file = input_files.pop()
 
         # Obtain a shared access signature that provides write access to the output
         # container to which the tasks will upload their output.
@@ -642,53 +799,34 @@ blob_client.create_blob_from_path(args.storagecontainer,
             output_container_name,
             azureblob.BlobPermissions.WRITE)
 
-        # Create a Batch service client. We'll now be interacting with the Batch
-        # service in addition to Storage
-        credentials = batchauth.SharedKeyCredentials(_BATCH_ACCOUNT_NAME,
-                                                     _BATCH_ACCOUNT_KEY)
-
-        batch_client = batch.BatchServiceClient(
-            credentials,
-            base_url=_BATCH_ACCOUNT_URL)
-
-        # Create the pool that will contain the compute nodes that will execute the
-        # tasks. The resource files we pass in are used for configuring the pool's
-        # start task, which is executed each time a node first joins the pool (or
-        # is rebooted or re-imaged).
-        create_pool(batch_client,
-                    _POOL_ID + '-' + suffix,
-                    application_files,
-                    _NODE_OS_PUBLISHER,
-                    _NODE_OS_OFFER,
-                    _NODE_OS_SKU,
-                    task_file,
-                    _POOL_VM_SIZE, _POOL_NODE_COUNT)
+        # Pack the tasks into loads of almost the same size. Tasks of a job are
+        # kept together not to download the same input file to many nodes.
+        loads = []
+        for k in range(num_loads):
+            pairs = tasks[k * len(tasks) // num_loads: (k + 1) * len(tasks) // num_loads]
+            output_file_names.append('output-{}_{}.pickle'.format(suffix, k + 1))
+            loads.append(([input_files[i - 1] for i, _ in pairs], output_file_names[-1], pairs))
 
         # Create the job that will run the tasks.
-        loads = []
-        for i, input_file in enumerate(input_files):
-            for j, output_file in enumerate(output_file_names[i * n: (i + 1) * n]):
-                loads.append((input_file, output_file, i + 1, j + 1))
-
-        assert n_jobs == -(-len(loads) // nproc)  # ceil for int
-        job_names = []
-        for i in range(n_jobs):
-            job_name = '{}-{}-{}'.format(_JOB_ID, suffix, i + 1)
-
-            create_job(batch_client, job_name, _POOL_ID + '-' + suffix)
-
-            # Add the tasks to the job. We need to supply a container shared access
-            # signature (SAS) token for the tasks so that they can upload their output
-            # to Azure Storage.
-            task_ids = add_tasks(batch_client,
-                                 job_name,
-                                 loads[i * nproc: (i + 1) * nproc],
-                                 output_container_name,
-                                 output_container_sas_token,
-                                 task_file,
-                                 _STORAGE_ACCOUNT_NAME)
-
-            job_names.append((job_name, task_ids))
+        job_name = '{}-{}'.format(_JOB_ID, suffix)
+        create_job(batch_client, job_name, pool_id)
+        job_names.append((job_name, []))
+
+        # Add the tasks to the job. We need to supply a container shared access
+        # signature (SAS) token for the tasks so that they can upload their output
+        # to Azure Storage.
+        task_ids = add_tasks(batch_client,
+                             job_name,
+                             loads,
+                             output_container_name,
+                             output_container_sas_token,
+                             application_file,
+                             _STORAGE_ACCOUNT_NAME,
+                             target_file,
+                             processes,
+                             package,
+                             _NODE_PYTHON)
+        job_names[-1] = (job_name, task_ids)
 
         # Pause execution until tasks reach Completed state.
         wait_for_tasks_to_complete(batch_client,
@@ -702,7 +840,9 @@ blob_client.create_blob_from_path(args.storagecontainer,
         # files directly from the compute nodes themselves.
         download_blobs_from_container(blob_client,
                                       output_container_name,
-                                      os.path.abspath(path))
+                                      os.path.abspath(path),
+                                      'output-{}_'.format(suffix),
+                                      _TRANSFER_THREADS)
 
         for job_id, task_ids in job_names:
             print_task_output(batch_client, job_id, task_ids)
@@ -712,11 +852,11 @@ blob_client.create_blob_from_path(args.storagecontainer,
         _log.info('Sample end: {}'.format(end_time))
         _log.info('Elapsed time: {}'.format(end_time - start_time))
 
-        res = []
-        for output_file in output_file_names:
+        res = [[None] * n for _ in range(len(jobs))]
+        for _, output_file, pairs in loads:
             with open(os.path.join(path, output_file), mode='rb') as fin:
-                res.append(pickle.load(fin))
-        res = [res[i * n: (i + 1) * n] for i in range(len(jobs))]
+                for (i, j), value in zip(pairs, pickle.load(fin)):
+                    res[i - 1][j - 1] = value
     finally:
         # Clean up storage resources
         _log.info('Deleting containers...')
@@ -725,13 +865,13 @@ blob_client.create_blob_from_path(args.storagecontainer,
         blob_client.delete_container(output_container_name)
 
         # Clean up Batch resources (if the user so chooses).
-        for i in range(n_jobs):
-            job_name = '{}-{}-{}'.format(_JOB_ID, suffix, i + 1)
+        for job_name, _ in job_names:
             _log.info('Deleting job [{}] ...'.format(job_name))
             batch_client.job.delete(job_name)
 
-        _log.info('Deleting pool...')
-        batch_client.pool.delete(_POOL_ID + '-' + suffix)
+        if not _POOL_KEEP and pool_created:
+            _log.info('Deleting pool...')
+            batch_client.pool.delete(pool_id)
 
         if delete:
             _log.info('Deleting temporary files...')
@@ -739,7 +879,8 @@ blob_client.create_blob_from_path(args.storagecontainer,
                 filename = os.path.join(path, filename)
                 if os.path.isfile(filename):
                     os.remove(filename)
-            for filename in itertools.chain(input_file_paths, application_file_paths):
+            # The application file is the worker module itself, and is never removed.
+            for filename in itertools.chain(input_file_paths, (target_file_path, package_file)):
                 if os.path.isfile(filename):
                     os.remove(filename)
 
@@ -0,0 +1,450 @@
+"""
+A local stand-in for Azure Batch and Azure Blob storage.
+
+Fake clients of `azure.batch` and `azure.storage.blob` are given to
+`ecell4.extra.azure_batch` in place of the real ones. Containers are directories,
+and each storage request costs an optional latency plus the time to transfer
+the file at a given bandwidth. Batch tasks are run by a local shell on a thread
+pool as large as the pool of nodes, after a provisioning delay for a new pool.
+This allows to exercise and benchmark `run_azure` offline, without the Azure SDK.
+An isolated emulator runs tasks with the same interpreter, but without
+site-packages, this package, or anything on `sys.path` except for given modules,
+like a node where only the start task has installed anything.
+
+Examples
+--------
+>>> from ecell4.extra.azurelocal import AzureLocal
+>>> with AzureLocal(latency=0.05, bandwidth=10e6, provision=5.0) as emulator:  # doctest: +SKIP
+...     run_azure(target, jobs, n=10, path='.tmp', config=emulator.config(nodecount=2))
+...     print(emulator.stats())
+
+"""
+import os
+import os.path
+import sys
+import time
+import types
+import shutil
+import tempfile
+import importlib
+import threading
+import subprocess
+import logging
+import concurrent.futures
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+
+def get_logger():
+    return logging.getLogger('azurelocal')
+
+_CURRENT = None  # An emulator in use in this process
+
+class AzureLocal(object):
+    """
+    A local emulator of Azure Batch and Blob storage.
+    Used as a context manager, `ecell4.extra.azure_batch` talks to it.
+
+    """
+
+    def __init__(self, path=None, latency=0.0, bandwidth=None, provision=0.0, overhead=0.0,
+                 isolated=False, modules=('cloudpickle', )):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            A directory to keep containers and files of tasks.
+            If nothing is given, a temporary directory is created and
+            removed when closed.
+        latency : float, optional
+            Seconds each storage request takes. 0 for default.
+        bandwidth : float, optional
+            Bytes per second transferred by each storage request.
+            If nothing is given, no limit.
+        provision : float, optional
+            Seconds to allocate nodes of a new pool. 0 for default.
+        overhead : float, optional
+            Seconds to schedule each Batch task. 0 for default.
+        isolated : bool, optional
+            Run tasks without site-packages and `sys.path` of this process.
+            False for default.
+        modules : list, optional
+            Names of modules importable in isolated tasks, e.g. those installed
+            by the start task. ('cloudpickle', ) for default.
+
+        """
+        self.__temporary = path is None
+        self.__path = tempfile.mkdtemp(prefix='azurelocal-') if path is None else path
+        self.__config = dict(
+            latency=latency, bandwidth=bandwidth, provision=provision, overhead=overhead)
+        self.__isolated = isolated
+        self.__modules = tuple(modules)
+        self.__lock = threading.Lock()
+        self.__stats = dict(requests=0, uploaded=0, downloaded=0, pools=0, tasks=0)
+        self.__pools = {}
+        self.__saved = None
+        self.install()
+
+    def __enter__(self):
+        global _CURRENT
+        from . import azure_batch  # Not at the top, which is imported by tasks
+        names = ('azureblob', 'batch', 'batchauth', 'batchmodels')
+        self.__saved = (_CURRENT, dict((name, getattr(azure_batch, name)) for name in names))
+        _CURRENT = self
+        azure_batch.azureblob = types.SimpleNamespace(
+            BlockBlobService=BlockBlobService, BlobPermissions=BlobPermissions)
+        azure_batch.batch = types.SimpleNamespace(
+            BatchServiceClient=BatchServiceClient, models=models)
+        azure_batch.batchauth = types.SimpleNamespace(SharedKeyCredentials=SharedKeyCredentials)
+        azure_batch.batchmodels = models
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _CURRENT
+        from . import azure_batch
+        (_CURRENT, modules) = self.__saved
+        for name, value in modules.items():
+            setattr(azure_batch, name, value)
+        self.close()
+        return False
+
+    def path(self):
+        return self.__path
+
+    def environ(self):
+        """Return environment variables for the fake storage in tasks."""
+        environ = dict(
+            AZURELOCAL_PATH=os.path.abspath(self.__path),
+            AZURELOCAL_LATENCY=str(self.__config['latency']),
+            AZURELOCAL_BANDWIDTH=str(self.__config['bandwidth'] or ''))
+        environ['PATH'] = os.pathsep.join((os.path.join(self.__path, 'bin'), os.environ.get('PATH', '')))
+        if self.__isolated:
+            environ['PYTHONPATH'] = os.path.join(self.__path, 'site')
+        else:
+            environ['PYTHONPATH'] = os.pathsep.join(
+                [os.path.join(self.__path, 'site')] + [p for p in sys.path if p != ''])
+        return environ
+
+    def config(self, nodecount=1, **kwargs):
+        """
+        Return a config for `run_azure` with dummy credentials.
+        Other keyword arguments are added to the 'azure' section with '_' replaced
+        by '.', and prefixed by 'pool.' if no '.' is left, e.g. `keep=True` for
+        'pool.keep' and `transfer_threads=1` for 'transfer.threads'.
+
+        """
+        config = configparser.ConfigParser()
+        config['azure'] = {
+            'batch.name': 'local', 'batch.key': 'local', 'batch.url': 'local',
+            'storage.name': 'local', 'storage.key': 'local', 'pool.nodecount': str(nodecount)}
+        for key, value in kwargs.items():
+            key = key.replace('_', '.')
+            config['azure'][key if '.' in key else 'pool.' + key] = str(value)
+        return config
+
+    def stats(self):
+        """Return the numbers of storage requests, bytes transferred, pools created and tasks run."""
+        with self.__lock:
+            return dict(self.__stats)
+
+    def install(self):
+        """
+        Write the fake `azure.storage.blob` module and `python` for tasks.
+        `python` is also named after its version, e.g. `python3.8`.
+        The fake module is a copy of this module, which doesn't depend on the package.
+
+        """
+        for dirname in ('bin', 'storage', 'nodes', os.path.join('site', 'azure', 'storage')):
+            if not os.path.isdir(os.path.join(self.__path, dirname)):
+                os.makedirs(os.path.join(self.__path, dirname))
+        for dirname in ('azure', os.path.join('azure', 'storage')):
+            open(os.path.join(self.__path, 'site', dirname, '__init__.py'), 'w').close()
+        shutil.copyfile(os.path.splitext(__file__)[0] + '.py', os.path.join(self.__path, 'site', '_azurelocal.py'))
+        with open(os.path.join(self.__path, 'site', 'azure', 'storage', 'blob.py'), 'w') as fout:
+            fout.write('from _azurelocal import BlockBlobService, BlobPermissions\n')
+
+        for name in ('python', 'python{}.{}'.format(*sys.version_info[: 2])):
+            python = os.path.join(self.__path, 'bin', name)
+            if os.path.lexists(python):
+                os.remove(python)
+            if not self.__isolated:
+                os.symlink(sys.executable, python)
+                continue
+            # Without site-packages. PYTHONPATH is still given by `environ`.
+            with open(python, 'w') as fout:
+                fout.write('#!/bin/sh\nexec "{}" -S "$@"\n'.format(sys.executable))
+            os.chmod(python, 0o755)
+
+        if self.__isolated:
+            for name in self.__modules:
+                _link_module(name, os.path.join(self.__path, 'site'))
+
+    def close(self):
+        """Stop all the pools, and remove the directory if temporary."""
+        for pool in list(self.__pools.values()):
+            pool['executor'].shutdown(wait=True)
+        self.__pools.clear()
+        if self.__temporary:
+            shutil.rmtree(self.__path, ignore_errors=True)
+
+    def _count(self, **kwargs):
+        with self.__lock:
+            for key, value in kwargs.items():
+                self.__stats[key] += value
+
+    def _settings(self):
+        return dict(self.__config, path=self.__path)
+
+    def _pools(self):
+        return self.__pools
+
+def _link_module(name, dirname):
+    """Make a module (or package) importable from the directory by a symbolic link."""
+    filename = importlib.import_module(name).__file__
+    if os.path.basename(filename).startswith('__init__.'):
+        (src, dst) = (os.path.dirname(filename), os.path.join(dirname, name))
+    else:
+        (src, dst) = (filename, os.path.join(dirname, os.path.basename(filename)))
+    if not os.path.lexists(dst):
+        os.symlink(src, dst)
+
+def _settings():
+    if _CURRENT is not None:
+        return _CURRENT._settings()
+    # In a task run by the emulator
+    return dict(
+        path=os.environ['AZURELOCAL_PATH'],
+        latency=float(os.environ.get('AZURELOCAL_LATENCY') or 0.0),
+        bandwidth=float(os.environ.get('AZURELOCAL_BANDWIDTH') or 0.0) or None)
+
+def _transfer(src, dst, **kwargs):
+    settings = _settings()
+    size = os.path.getsize(src)
+    time.sleep(settings['latency'] + (size / settings['bandwidth'] if settings['bandwidth'] else 0.0))
+    shutil.copyfile(src, dst)
+    if _CURRENT is not None:
+        _CURRENT._count(requests=1, **dict((key, size) for key in kwargs))
+
+class _Model(object):
+    _fields = ()
+
+    def __init__(self, *args, **kwargs):
+        for key in self._fields:
+            setattr(self, key, None)
+        for key, value in zip(self._fields, args):
+            setattr(self, key, value)
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+def _model(name, *fields):
+    return type(name, (_Model, ), {'_fields': fields})
+
+class BatchErrorException(Exception):
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.error = _Model(code=code, message=_Model(value=message), values=[])
+
+models = types.SimpleNamespace(
+    PoolAddParameter=_model('PoolAddParameter', 'id'),
+    StartTask=_model('StartTask', 'command_line'),
+    JobAddParameter=_model('JobAddParameter', 'id', 'pool_info'),
+    PoolInformation=_model('PoolInformation', 'pool_id'),
+    TaskAddParameter=_model('TaskAddParameter', 'id', 'command_line'),
+    ResourceFile=_model('ResourceFile', 'blob_source', 'file_path'),
+    AutoUserSpecification=_model('AutoUserSpecification'),
+    UserIdentity=_model('UserIdentity'),
+    VirtualMachineConfiguration=_model('VirtualMachineConfiguration'),
+    ImageReference=_model('ImageReference', 'publisher', 'offer', 'sku'),
+    NodeAgentSku=_model('NodeAgentSku', 'id', 'verified_image_references'),
+    AutoUserScope=types.SimpleNamespace(pool='pool', task='task'),
+    ElevationLevel=types.SimpleNamespace(admin='admin', non_admin='nonadmin'),
+    TaskState=types.SimpleNamespace(
+        active='active', preparing='preparing', running='running', completed='completed'),
+    batch_error=types.SimpleNamespace(BatchErrorException=BatchErrorException))
+
+class BlobPermissions(object):
+    READ = 'r'
+    WRITE = 'w'
+
+class BlockBlobService(object):
+    """A fake blob service client keeping containers as directories."""
+
+    def __init__(self, account_name=None, account_key=None, sas_token=None):
+        self.__root = os.path.join(_settings()['path'], 'storage')
+
+    def __container(self, container_name):
+        return os.path.join(self.__root, container_name)
+
+    def create_container(self, container_name, fail_on_exist=False):
+        if os.path.isdir(self.__container(container_name)):
+            if fail_on_exist:
+                raise RuntimeError('The container [{}] already exists.'.format(container_name))
+            return False
+        os.makedirs(self.__container(container_name))
+        return True
+
+    def delete_container(self, container_name):
+        if not os.path.isdir(self.__container(container_name)):
+            return False
+        shutil.rmtree(self.__container(container_name))
+        return True
+
+    def create_blob_from_path(self, container_name, blob_name, file_path):
+        _transfer(file_path, os.path.join(self.__container(container_name), blob_name), uploaded=True)
+
+    def get_blob_to_path(self, container_name, blob_name, file_path):
+        _transfer(os.path.join(self.__container(container_name), blob_name), file_path, downloaded=True)
+
+    def list_blobs(self, container_name, prefix=None):
+        names = sorted(os.listdir(self.__container(container_name)))
+        return _BlobList(
+            _model('Blob', 'name')(name) for name in names if prefix is None or name.startswith(prefix))
+
+    def generate_blob_shared_access_signature(self, container_name, blob_name, permission=None, expiry=None):
+        return 'sp={}'.format(permission)
+
+    def generate_container_shared_access_signature(self, container_name, permission=None, expiry=None):
+        return 'sp={}'.format(permission)
+
+    def make_blob_url(self, container_name, blob_name, sas_token=None):
+        url = 'file://' + os.path.abspath(os.path.join(self.__container(container_name), blob_name))
+        return url if sas_token is None else '{}?{}'.format(url, sas_token)
+
+class _BlobList(list):
+
+    @property
+    def items(self):
+        return self
+
+class SharedKeyCredentials(object):
+
+    def __init__(self, account_name, key):
+        self.account_name = account_name
+
+class BatchServiceClient(object):
+    """A fake Batch service client running tasks on the local machine."""
+
+    def __init__(self, credentials, base_url=None):
+        if _CURRENT is None:
+            raise RuntimeError('BatchServiceClient is only available in an AzureLocal context.')
+        self.account = _AccountOperations()
+        self.pool = _PoolOperations(_CURRENT)
+        self.job = _JobOperations(_CURRENT)
+        self.task = _TaskOperations(_CURRENT, self.job)
+        self.file = _FileOperations(self.job)
+
+class _AccountOperations(object):
+
+    def list_node_agent_skus(self):
+        image = models.ImageReference('Canonical', 'UbuntuServer', '16.04-LTS')
+        return [models.NodeAgentSku('batch.node.ubuntu 16.04', [image])]
+
+class _PoolOperations(object):
+
+    def __init__(self, emulator):
+        self.__emulator = emulator
+        self.__pools = emulator._pools()
+
+    def add(self, pool):
+        if pool.id in self.__pools:
+            raise BatchErrorException('PoolExists', 'The specified pool already exists.')
+        node_count = int(pool.target_dedicated_nodes or 0) + int(pool.target_low_priority_nodes or 0)
+        slots = node_count * int(getattr(pool, 'max_tasks_per_node', None) or 1)
+        get_logger().info('Provisioning pool [{}] of {} nodes...'.format(pool.id, node_count))
+        time.sleep(self.__emulator._settings()['provision'])
+        self.__pools[pool.id] = dict(
+            parameter=pool, executor=concurrent.futures.ThreadPoolExecutor(max(1, slots)))
+        self.__emulator._count(pools=1)
+
+    def exists(self, pool_id):
+        return pool_id in self.__pools
+
+    def get(self, pool_id):
+        if pool_id not in self.__pools:
+            raise BatchErrorException('PoolNotFound', 'The specified pool does not exist.')
+        return self.__pools[pool_id]['parameter']
+
+    def delete(self, pool_id):
+        pool = self.__pools.pop(pool_id, None)
+        if pool is None:
+            raise BatchErrorException('PoolNotFound', 'The specified pool does not exist.')
+        pool['executor'].shutdown(wait=False)
+
+class _JobOperations(object):
+
+    def __init__(self, emulator):
+        self.__emulator = emulator
+        self.jobs = {}
+
+    def add(self, job):
+        if job.id in self.jobs:
+            raise BatchErrorException('JobExists', 'The specified job already exists.')
+        if job.pool_info.pool_id not in self.__emulator._pools():
+            raise BatchErrorException('PoolNotFound', 'The specified pool does not exist.')
+        self.jobs[job.id] = dict(pool_id=job.pool_info.pool_id, tasks={})
+
+    def delete(self, job_id):
+        if self.jobs.pop(job_id, None) is None:
+            raise BatchErrorException('JobNotFound', 'The specified job does not exist.')
+
+class _TaskOperations(object):
+
+    def __init__(self, emulator, jobs):
+        self.__emulator = emulator
+        self.__jobs = jobs
+
+    def add_collection(self, job_id, tasks):
+        job = self.__jobs.jobs[job_id]
+        pool = self.__emulator._pools()[job['pool_id']]
+        for task in tasks:
+            taskdir = os.path.join(self.__emulator.path(), 'nodes', job['pool_id'], job_id, task.id)
+            state = _model('CloudTask', 'id', 'state', 'exit_code')(task.id, models.TaskState.active)
+            state.directory = taskdir
+            job['tasks'][task.id] = state
+            pool['executor'].submit(self.__run, task, state, taskdir, job['pool_id'])
+
+    def __run(self, task, state, taskdir, pool_id):
+        settings = self.__emulator._settings()
+        time.sleep(settings['overhead'])
+        state.state = models.TaskState.running
+        shared = os.path.join(self.__emulator.path(), 'nodes', pool_id, 'shared')
+        for dirname in (taskdir, shared):
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        try:
+            for resource in task.resource_files or ():
+                _transfer(resource.blob_source[len('file://'): ].split('?', 1)[0],
+                          os.path.join(taskdir, resource.file_path))
+            environ = dict(os.environ)
+            environ.update(self.__emulator.environ())
+            environ['AZ_BATCH_NODE_SHARED_DIR'] = shared
+            environ['AZ_BATCH_TASK_WORKING_DIR'] = taskdir
+            with open(os.path.join(taskdir, 'stdout.txt'), 'wb') as stdout, \
+                    open(os.path.join(taskdir, 'stderr.txt'), 'wb') as stderr:
+                state.exit_code = subprocess.call(
+                    task.command_line, shell=True, cwd=taskdir, env=environ, stdout=stdout, stderr=stderr)
+        except Exception as err:
+            get_logger().error('Task [{}] failed: {}'.format(task.id, str(err)))
+            state.exit_code = -1
+        finally:
+            state.state = models.TaskState.completed
+            self.__emulator._count(tasks=1)
+
+    def list(self, job_id):
+        return list(self.__jobs.jobs[job_id]['tasks'].values())
+
+class _FileOperations(object):
+
+    def __init__(self, jobs):
+        self.__jobs = jobs
+
+    def get_from_task(self, job_id, task_id, file_name):
+        filename = os.path.join(self.__jobs.jobs[job_id]['tasks'][task_id].directory, file_name)
+        if not os.path.isfile(filename):
+            return iter(())
+        with open(filename, 'rb') as fin:
+            return iter((fin.read(), ))
@@ -0,0 +1,345 @@
+"""
+A registry of backends running ensembles for `ecell4.extra.ensemble`.
+
+A backend evaluates a target function for each pair of a job and task id,
+and streams results in the order of completion. `ensemble_simulations` and
+`sweep_simulations` look up their `method` here. The built-in backends are
+'serial', 'threads', 'multiprocessing', 'sge', 'slurm' and 'azure'.
+Others are added with `register_backend`, or by other packages through
+the entry point group 'ecell4.extra.backends', whose object is a `Backend`
+(class or instance) or a function with the same interface as `Backend.imap`:
+
+    [options.entry_points]
+    ecell4.extra.backends =
+        dask = mypackage.backends:DaskBackend
+
+Examples
+--------
+>>> from ecell4.extra import backends
+>>> @backends.register_backend('mine')  # doctest: +SKIP
+... def imap_mine(target, jobs, n=1, nproc=None, tasks=None, cancel=None, **kwargs):
+...     ...
+>>> ensemble_simulations(10.0, {'C': 60}, n=100, method='mine')  # doctest: +SKIP
+
+"""
+import time
+import threading
+import importlib
+import logging
+
+from .telemetry import Measured, Recorder, unwrap
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    entry_points = None
+
+
+def get_logger():
+    return logging.getLogger('backends')
+
+ENTRY_POINT_GROUP = 'ecell4.extra.backends'
+
+# Built-in backends, imported on demand not to import ensemble here.
+_BUILTINS = {
+    'serial': 'ecell4.extra.ensemble:imap_serial',
+    'threads': 'ecell4.extra.ensemble:imap_threads',
+    'multiprocessing': 'ecell4.extra.ensemble:imap_multiprocessing',
+    'sge': 'ecell4.extra.ensemble:imap_sge',
+    'slurm': 'ecell4.extra.ensemble:imap_slurm',
+    'azure': 'ecell4.extra.ensemble:_imap_azure'}
+_CAPABILITIES = {
+    'multiprocessing': dict(supports_shared_memory=True)}
+
+_BACKENDS = {}
+_LOCK = threading.RLock()  # Entry points may register backends when loaded
+
+class Backend(object):
+    """
+    A base class of backends. Subclasses implement `imap`.
+    `submit` starts a `Submission`, which streams results,
+    can be cancelled, and counts tasks for `stats`.
+
+    Attributes
+    ----------
+    name : str
+        A name of the backend.
+    supports_shared_memory : bool
+        True if `imap` accepts `share`, `out` and `pool` in the same way as
+        `ecell4.extra.ensemble.imap_multiprocessing`, i.e. shares models among
+        local worker processes, writes results into a `procpool.SharedArray`,
+        and runs on a given `procpool.Pool`. Then, `ensemble_simulations`
+        passes models and results through shared memory. False for default.
+
+    """
+
+    name = None
+    supports_shared_memory = False
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__stats = dict(submissions=0, tasks=0, finished=0, cancelled=0, elapsed=0.0)
+
+    def imap(self, target, jobs, n=1, tasks=None, cancel=None, **kwargs):
+        """
+        Evaluate the given function with each set of arguments,
+        and yield results in the order of completion.
+
+        Parameters
+        ----------
+        target : function
+            A function to be evaluated with a job and a job and task id (int, 1-origin).
+        jobs : list
+            A list of arguments passed to the function.
+        n : int, optional
+            A number of tasks. Repeat the evaluation `n` times for each job.
+            1 for default.
+        tasks : list, optional
+            A list of pairs of a job and task id (1-origin) to be evaluated.
+            All the tasks for default.
+        cancel : threading.Event, optional
+            When set, tasks not finished yet should be cancelled,
+            and `concurrent.futures.CancelledError` raised.
+        **kwargs : dict, optional
+            Options of the backend, e.g. `nproc`.
+
+        Yields
+        ------
+        (job_id, task_id, result) : tuple
+            A job and task id (int, 1-origin), and its result.
+
+        """
+        raise NotImplementedError()
+
+    def submit(self, target, jobs, n=1, tasks=None, **kwargs):
+        """
+        Return a `Submission` of the tasks. Tasks are evaluated while iterating it.
+        With `telemetry`, True or a `ecell4.extra.telemetry.Recorder`,
+        each task is measured. Other keyword arguments are passed to `imap`.
+
+        """
+        return Submission(self, target, jobs, n, tasks, **kwargs)
+
+    def run(self, target, jobs, n=1, tasks=None, **kwargs):
+        """
+        Evaluate the tasks, and return a list of results for each job.
+        Results of tasks not in `tasks` are left None.
+
+        """
+        jobs = list(jobs)
+        retval = [[None] * n for _ in range(len(jobs))]
+        for job_id, task_id, res in self.submit(target, jobs, n, tasks, **kwargs):
+            retval[job_id - 1][task_id - 1] = res
+        return retval
+
+    def stats(self):
+        """
+        Return numbers of submissions, tasks submitted, finished and cancelled,
+        and seconds elapsed through all the submissions.
+
+        """
+        with self.__lock:
+            return dict(self.__stats)
+
+    def _count(self, **kwargs):
+        with self.__lock:
+            for key, value in kwargs.items():
+                self.__stats[key] += value
+
+    def __repr__(self):
+        return '<{}: {}>'.format(self.__class__.__name__, self.name)
+
+class FunctionBackend(Backend):
+    """
+    A backend wrapping a function with the same interface as `Backend.imap`,
+    e.g. `ecell4.extra.ensemble.imap_multiprocessing`.
+
+    """
+
+    def __init__(self, imap, name=None, supports_shared_memory=None):
+        Backend.__init__(self)
+        self.imap = imap
+        self.name = name or getattr(imap, '__name__', None)
+        if supports_shared_memory is not None:
+            self.supports_shared_memory = supports_shared_memory
+
+class Submission(object):
+    """
+    Tasks submitted to a backend. Iterate it to evaluate the tasks and
+    get results in the order of completion, or call `cancel` to stop them.
+    If measured, the target is wrapped by `ecell4.extra.telemetry.Measured`,
+    and records of tasks are added to the recorder as results arrive.
+
+    """
+
+    def __init__(self, backend, target, jobs, n=1, tasks=None, telemetry=None, **kwargs):
+        jobs = list(jobs)
+        self.__backend = backend
+        self.__recorder = _recorder(telemetry)
+        if self.__recorder is not None:
+            target = Measured(target)
+        self.__cancel = kwargs.pop('cancel', None) or threading.Event()
+        self.__num_tasks = len(jobs) * n if tasks is None else len(tasks)
+        self.__finished = 0
+        self.__start = None
+        self.__end = None
+        self.__iterator = backend.imap(target, jobs, n, tasks=tasks, cancel=self.__cancel, **kwargs)
+
+    def __iter__(self):
+        self.__start = time.time()
+        self.__backend._count(submissions=1, tasks=self.__num_tasks)
+        try:
+            for retval in self.__iterator:
+                self.__finished += 1
+                self.__backend._count(finished=1)
+                if self.__recorder is not None:
+                    (res, record) = unwrap(retval[2], self.__start)
+                    if record is not None:
+                        self.__recorder.add(record)
+                    retval = retval[: 2] + (res, )
+                yield retval
+        finally:
+            self.__end = time.time()
+            self.__backend._count(elapsed=self.__end - self.__start)
+            if self.__finished < self.__num_tasks:
+                self.__backend._count(cancelled=self.__num_tasks - self.__finished)
+
+    def recorder(self):
+        """Return the `ecell4.extra.telemetry.Recorder` of the tasks, or None if not measured."""
+        return self.__recorder
+
+    def cancel(self):
+        """Cancel tasks not finished yet."""
+        self.__cancel.set()
+
+    def cancelled(self):
+        return self.__cancel.is_set()
+
+    def stats(self):
+        """
+        Return numbers of tasks submitted and finished, seconds elapsed,
+        and the throughput in tasks per second.
+
+        """
+        if self.__start is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.__end or time.time()) - self.__start
+        return dict(
+            tasks=self.__num_tasks, finished=self.__finished, elapsed=elapsed,
+            throughput=(self.__finished / elapsed if elapsed > 0 else 0.0))
+
+def _recorder(value):
+    if value is None or value is False:
+        return None
+    elif value is True:
+        return Recorder()
+    return value
+
+def _load(value, name):
+    if isinstance(value, str):
+        (module, attr) = value.split(':', 1)
+        value = importlib.import_module(module)
+        for key in attr.split('.'):
+            value = getattr(value, key)
+    if isinstance(value, type) and issubclass(value, Backend):
+        value = value()
+    if not isinstance(value, Backend):
+        if not callable(value):
+            raise TypeError("A backend [{}] must be a Backend or a function. [{}] was given.".format(name, repr(value)))
+        value = FunctionBackend(value, name)
+    if value.name is None:
+        value.name = name
+    return value
+
+def _entry_points():
+    if entry_points is None:
+        return []
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=ENTRY_POINT_GROUP))
+    return list(eps.get(ENTRY_POINT_GROUP, ()))  # Python < 3.10
+
+def register_backend(name, backend=None, override=False):
+    """
+    Register a backend with the name. Usable as a decorator without `backend`.
+
+    Parameters
+    ----------
+    name : str
+        A name of the backend given as `method`. Case insensitive.
+    backend : Backend, type or function, optional
+        A Backend instance, a subclass of Backend, or a function with the same
+        interface as `Backend.imap`.
+    override : bool, optional
+        Replace a backend already registered with the name, or raise ValueError.
+        False for default.
+
+    Returns
+    -------
+    backend : Backend, type or function
+        The given backend as it is.
+
+    """
+    if backend is None:
+        return lambda obj: register_backend(name, obj, override)
+
+    key = name.lower()
+    with _LOCK:
+        if not override and (key in _BACKENDS or key in _BUILTINS):
+            raise ValueError("A backend [{}] is already registered.".format(name))
+        _BACKENDS[key] = _load(backend, key)
+    return backend
+
+def unregister_backend(name):
+    with _LOCK:
+        _BACKENDS.pop(name.lower(), None)
+
+def get_backend(name):
+    """
+    Return a backend registered with the name. Built-in backends and
+    entry points are loaded on first use.
+
+    Parameters
+    ----------
+    name : str, Backend or None
+        A name of the backend. None means 'serial'. A Backend is returned as it is.
+
+    Returns
+    -------
+    backend : Backend
+
+    """
+    if isinstance(name, Backend):
+        return name
+
+    key = 'serial' if name is None else name.lower()
+    with _LOCK:
+        if key in _BACKENDS:
+            return _BACKENDS[key]
+
+        if key in _BUILTINS:
+            _BACKENDS[key] = _load(_BUILTINS[key], key)
+            for attr, value in _CAPABILITIES.get(key, {}).items():
+                setattr(_BACKENDS[key], attr, value)
+            return _BACKENDS[key]
+
+        for ep in _entry_points():
+            if ep.name.lower() != key:
+                continue
+            try:
+                _BACKENDS[key] = _load(ep.load(), key)
+            except Exception as err:
+                get_logger().error("Failed to load a backend [{}] from [{}]: {}".format(ep.name, ep.value, str(err)))
+                raise
+            return _BACKENDS[key]
+
+    raise ValueError(
+        'Argument "method" must be one of {}. [{}] was given.'.format(
+            ', '.join('"{}"'.format(x) for x in list_backends()), name))
+
+def list_backends():
+    """Return a sorted list of names of backends available."""
+    names = set(_BUILTINS.keys()) | set(_BACKENDS.keys())
+    names.update(ep.name.lower() for ep in _entry_points())
+    return sorted(names)
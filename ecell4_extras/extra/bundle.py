@@ -0,0 +1,112 @@
+import os
+import struct
+import pickle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_FOOTER = struct.Struct('<Q')
+_HEADER = struct.Struct('<qQ')
+
+def write_inputs(filename, inputs):
+    """
+    Save objects into a single indexed archive.
+    Each object is pickled one by one, and an index of their offsets
+    is appended at the end of the file. Thus, an object can be loaded
+    without reading the others.
+
+    Parameters
+    ----------
+    filename : str
+        A filename of the archive.
+    inputs : list
+        A list of picklable objects.
+
+    """
+    offsets = []
+    with open(filename, 'wb') as fout:
+        for obj in inputs:
+            offsets.append(fout.tell())
+            pickle.dump(obj, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        index = fout.tell()
+        pickle.dump(offsets, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        fout.write(_FOOTER.pack(index))
+
+def read_input(filename, i):
+    """
+    Load the i-th object (0-origin) from an archive written by `write_inputs`.
+
+    """
+    with open(filename, 'rb') as fin:
+        fin.seek(-_FOOTER.size, os.SEEK_END)
+        (index, ) = _FOOTER.unpack(fin.read(_FOOTER.size))
+        fin.seek(index)
+        offsets = pickle.load(fin)
+        fin.seek(offsets[i])
+        return pickle.load(fin)
+
+def append_result(filename, key, value):
+    """
+    Append a pair of an integer key and a picklable value to the results store.
+    A record is written at once with O_APPEND under an advisory lock,
+    and thus multiple processes can share the same store.
+
+    """
+    payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    record = _HEADER.pack(key, len(payload)) + payload
+
+    fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+            except (IOError, OSError):
+                pass  # No lock is available on some file systems
+        written = 0
+        while written < len(record):
+            written += os.write(fd, record[written: ])
+        os.fsync(fd)
+    finally:
+        os.close(fd)  # This also releases the lock
+
+class ResultReader(object):
+    """
+    Read records appended to a results store incrementally.
+
+    """
+
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__offset = 0
+
+    def filename(self):
+        return self.__filename
+
+    def read(self):
+        """
+        Return a list of pairs of a key and value, which are completely
+        written after the last call.
+
+        """
+        try:
+            fin = open(self.__filename, 'rb')
+        except IOError:
+            return []  # Not created yet
+
+        retval = []
+        with fin:
+            fin.seek(self.__offset)
+            data = fin.read()
+
+        pos = 0
+        while len(data) - pos >= _HEADER.size:
+            (key, size) = _HEADER.unpack_from(data, pos)
+            if len(data) - pos - _HEADER.size < size:
+                break  # Being written
+            start = pos + _HEADER.size
+            retval.append((key, pickle.loads(data[start: start + size])))
+            pos = start + size
+        self.__offset += pos
+        return retval
@@ -0,0 +1,135 @@
+import os
+import os.path
+import time
+import json
+import shutil
+import pickle
+import hashlib
+import inspect
+import logging
+
+from . import bundle
+
+
+def get_logger():
+    return logging.getLogger('cache')
+
+def fingerprint(target, jobs):
+    """
+    Return a hash of a request, which is the source of the target function
+    and the jobs. Seeds are a part of the jobs.
+    The number of tasks is not included. A result of a task is
+    same for any number of tasks as long as its seed is same.
+
+    Parameters
+    ----------
+    target : function
+        A function to be evaluated.
+    jobs : list
+        A list of arguments passed to the function. All must be picklable.
+
+    Returns
+    -------
+    key : str
+        A hex digest.
+
+    """
+    try:
+        src = inspect.getsource(target)
+    except (IOError, OSError, TypeError):
+        # No source is available (e.g. defined in an interactive session)
+        src = '{}.{}'.format(
+            getattr(target, '__module__', ''), getattr(target, '__qualname__', target.__name__))
+
+    h = hashlib.sha1()
+    h.update(src.encode('utf-8'))
+    h.update(pickle.dumps(list(jobs), protocol=2))
+    return h.hexdigest()
+
+class RunCache(object):
+    """
+    A persistent run directory keeping results of an ensemble.
+    The directory is named by the fingerprint of the request,
+    and results are appended one by one as tasks finish.
+    Thus, a run stopped halfway can be resumed by evaluating only missing tasks,
+    and an identical request is served from the directory without any evaluation.
+    Results are kept by a job and task id, and thus a request with a larger
+    number of tasks reuses the results of a smaller one.
+
+    Examples
+    --------
+    >>> c = RunCache('.cache', target, jobs, n=10)  # doctest: +SKIP
+    >>> for job_id, task_id in c.missing():  # doctest: +SKIP
+    ...     c.store(job_id, task_id, target(jobs[job_id - 1], job_id, task_id))
+
+    """
+
+    def __init__(self, root, target, jobs, n=1):
+        """
+        Open a run directory for the request, or create it if not exists.
+
+        Parameters
+        ----------
+        root : str
+            A directory where run directories are created.
+        target : function
+            A function to be evaluated.
+        jobs : list
+            A list of arguments passed to the function. All must be picklable.
+        n : int, optional
+            A number of tasks for each job. 1 for default.
+
+        """
+        jobs = list(jobs)
+        self.__key = fingerprint(target, jobs)
+        self.__path = os.path.join(root, self.__key)
+        self.__num_jobs = len(jobs)
+        self.__n = n
+        self.__storefile = os.path.join(self.__path, 'results')
+
+        if not os.path.isdir(self.__path):
+            os.makedirs(self.__path)
+            with open(os.path.join(self.__path, 'request.json'), 'w') as fout:
+                json.dump(dict(
+                    target=getattr(target, '__name__', str(target)), num_jobs=len(jobs),
+                    created=time.strftime('%Y-%m-%dT%H:%M:%S')), fout)
+            get_logger().info("A new run directory [{}] was created.".format(self.__path))
+
+        self.__reader = bundle.ResultReader(self.__storefile)
+        self.__results = {}
+        self.__update()
+
+    def __update(self):
+        for key, res in self.__reader.read():
+            (job_id, task_id) = divmod(key, 2 ** 32)
+            if task_id <= self.__n:
+                self.__results[(job_id, task_id)] = res
+
+    def key(self):
+        return self.__key
+
+    def path(self):
+        return self.__path
+
+    def done(self):
+        """Return a set of pairs of a job and task id (1-origin) already evaluated."""
+        return set(self.__results.keys())
+
+    def missing(self):
+        """Return a list of pairs of a job and task id (1-origin) not evaluated yet."""
+        return [(i + 1, j + 1) for i in range(self.__num_jobs) for j in range(self.__n)
+                if (i + 1, j + 1) not in self.__results]
+
+    def items(self):
+        """Return a list of (job_id, task_id, result) already evaluated."""
+        return [(job_id, task_id, res) for (job_id, task_id), res in sorted(self.__results.items())]
+
+    def store(self, job_id, task_id, result):
+        """Record a result of the task."""
+        bundle.append_result(self.__storefile, job_id * (2 ** 32) + task_id, result)
+        self.__results[(job_id, task_id)] = result
+
+    def clear(self):
+        """Remove the run directory."""
+        shutil.rmtree(self.__path, ignore_errors=True)
+        self.__results = {}
@@ -4,22 +4,94 @@ import os
 import os.path
 import logging
 import tempfile
-import pickle
-import inspect
-import textwrap
 import re
-import types
 import itertools
+import functools
 import binascii
+import time
 import multiprocessing
 import copy
-import csv
+import numbers
+import concurrent.futures
 
 import ecell4.extra.sge as sge
 import ecell4.extra.slurm as slurm
+import ecell4.extra.procpool as procpool
+import ecell4.extra.watcher as watcher
+import ecell4.extra.bundle as bundle
+import ecell4.extra.cache as cache
+import ecell4.extra.worker as worker
+import ecell4.extra.backends as backends
+import ecell4.extra.telemetry as telemetry
+from ecell4.extra.seeds import SeedSequence
+
+
+def get_logger():
+    return logging.getLogger('ensemble')
+
+def _gather(iterator, num_jobs, n, callback=None):
+    retval = [[None] * n for _ in range(num_jobs)]
+    for job_id, task_id, res in iterator:
+        retval[job_id - 1][task_id - 1] = res
+        if callback is not None:
+            callback(job_id, task_id, res)
+    return retval
+
+def _tasks(num_jobs, n, tasks=None):
+    if tasks is None:
+        return [(i + 1, j + 1) for i in range(num_jobs) for j in range(n)]
+    return sorted(tasks)
 
+def imap_serial(target, jobs, n=1, tasks=None, cancel=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments,
+    and yield results one by one.
+    This function does in series.
+
+    Parameters
+    ----------
+    target : function
+        A function to be evaluated. The function must accepts three arguments,
+        which are a list of arguments given as `jobs`, a job and task id (int).
+    jobs : list
+        A list of arguments passed to the function.
+    n : int, optional
+        A number of tasks. Repeat the evaluation `n` times for each job.
+        1 for default.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be evaluated.
+        If nothing is given, all the tasks are evaluated.
+    cancel : threading.Event, optional
+        An event to stop the evaluation halfway. When it is set,
+        `concurrent.futures.CancelledError` is raised before the next task.
+
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
+
+    Examples
+    --------
+    >>> jobs = ((1, 'spam'), (2, 'ham'))
+    >>> target = lambda args, job_id, task_id: (args[1] * args[0])
+    >>> list(imap_serial(target, jobs))
+    [(1, 1, 'spam'), (2, 1, 'hamham')]
+
+    See Also
+    --------
+    ecell4.extra.ensemble.run_serial
+    ecell4.extra.ensemble.imap_multiprocessing
+    ecell4.extra.ensemble.imap_sge
+    ecell4.extra.ensemble.imap_slurm
+
+    """
+    jobs = list(jobs)
+    for job_id, task_id in _tasks(len(jobs), n, tasks):
+        if cancel is not None and cancel.is_set():
+            raise concurrent.futures.CancelledError()
+        yield (job_id, task_id, target(copy.copy(jobs[job_id - 1]), job_id, task_id))
 
-def run_serial(target, jobs, n=1, **kwargs):
+def run_serial(target, jobs, n=1, tasks=None, callback=None, **kwargs):
     """
     Evaluate the given function with each set of arguments, and return a list of results.
     This function does in series.
@@ -34,6 +106,13 @@ def run_serial(target, jobs, n=1, **kwargs):
     n : int, optional
         A number of tasks. Repeat the evaluation `n` times for each job.
         1 for default.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be evaluated.
+        Results of the other tasks are left None.
+        If nothing is given, all the tasks are evaluated.
+    callback : function, optional
+        A function called with a job and task id (int, 1-origin), and its result,
+        as soon as each task is done.
 
     Returns
     -------
@@ -68,9 +147,126 @@ def run_serial(target, jobs, n=1, **kwargs):
     ecell4.extra.ensemble.run_azure
 
     """
-    return [[target(copy.copy(job), i + 1, j + 1) for j in range(n)] for i, job in enumerate(jobs)]
+    jobs = list(jobs)
+    return _gather(imap_serial(target, jobs, n, tasks, **kwargs), len(jobs), n, callback)
 
-def run_multiprocessing(target, jobs, n=1, nproc=None, **kwargs):
+def imap_multiprocessing(target, jobs, n=1, nproc=None, pool=None, chunksize=None, tasks=None, balance=False, out=None, share=False, cancel=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments,
+    and yield results in the order of completion.
+    This function does in parallel by using `multiprocessing`.
+    Only a couple of tasks per worker are in flight at once.
+
+    Parameters
+    ----------
+    target : function
+        A function to be evaluated. The function must accepts three arguments,
+        which are a list of arguments given as `jobs`, a job and task id (int).
+    jobs : list
+        A list of arguments passed to the function.
+        All the argument must be picklable.
+    n : int, optional
+        A number of tasks. Repeat the evaluation `n` times for each job.
+        1 for default.
+    nproc : int, optional
+        A number of cores available once.
+        If nothing is given, all available cores are used.
+        Ignored when `pool` is given.
+    pool : ecell4.extra.procpool.Pool, optional
+        A pool of worker processes reused over calls.
+        The target must be picklable in this case.
+    context : str, optional
+        A start method of workers, e.g. 'spawn', when `pool` is not given.
+        The default start method of `multiprocessing` for default.
+    chunksize : int, optional
+        A number of tasks sent to a worker at once.
+        If nothing is given, the pool's default is used.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be evaluated.
+        If nothing is given, all the tasks are evaluated.
+    balance : bool, optional
+        Whether it balances the load adaptively, or not.
+        If True, the runtime of each job is measured as its tasks finish,
+        the remaining tasks are handed out in the descending order of
+        the expected runtime of their job, and chunks shrink towards the end so that no worker is left
+        with a long backlog. `chunksize` gives the maximum size of chunks then.
+        A summary of the utilisation of each worker is logged at the end.
+        False for default.
+    out : ecell4.extra.procpool.SharedArray, optional
+        An array on shared memory with a row for each task, in the order of
+        job and task id. If given, workers write results into it directly
+        instead of sending them back, and a view of the row is yielded.
+        Results must be convertible into the shape of a row.
+        The name of the memory is removed at the end.
+    share : bool, optional
+        Whether each job is sent to workers only once, or not.
+        If True, each job is pickled once and only a reference is sent with each task.
+        Each worker loads the job at the first use and keeps it,
+        and the target receives a shallow copy of it.
+        This saves the cost to pickle large jobs, e.g. with a model, for every task.
+        False for default.
+    cancel : threading.Event, optional
+        An event to stop the evaluation halfway. When it is set,
+        `concurrent.futures.CancelledError` is raised and workers are terminated.
+        Workers of the given `pool` are not terminated, but left evaluating
+        the tasks already sent.
+
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
+
+    Examples
+    --------
+    >>> jobs = ((1, 'spam'), (2, 'ham'))
+    >>> target = lambda args, job_id, task_id: (args[1] * args[0])
+    >>> sorted(imap_multiprocessing(target, jobs, nproc=2))
+    [(1, 1, 'spam'), (2, 1, 'hamham')]
+
+    See Also
+    --------
+    ecell4.extra.ensemble.run_multiprocessing
+    ecell4.extra.ensemble.imap_serial
+    ecell4.extra.ensemble.imap_sge
+    ecell4.extra.ensemble.imap_slurm
+
+    """
+    jobs = list(jobs)
+    tasks = _tasks(len(jobs), n, tasks)
+    if share:
+        refs = [procpool.Shared(job) for job in jobs]
+        X = ((refs[job_id - 1], job_id, task_id) for job_id, task_id in tasks)
+    else:
+        refs = []
+        X = ((copy.copy(jobs[job_id - 1]), job_id, task_id) for job_id, task_id in tasks)
+
+    if out is not None and out.array().shape[0] < len(tasks):
+        raise ValueError(
+            "The shared array has only {:d} rows for {:d} tasks.".format(out.array().shape[0], len(tasks)))
+
+    try:
+        if pool is None:
+            with procpool.Pool(nproc, target=target, context=kwargs.get('context')) as pool:
+                for retval in _imap_pool(pool, target, X, tasks, chunksize, balance, out, cancel):
+                    yield retval
+        else:
+            for retval in _imap_pool(pool, target, X, tasks, chunksize, balance, out, cancel):
+                yield retval
+    finally:
+        if out is not None:
+            out.unlink()
+        for ref in refs:
+            ref.remove()
+
+def _imap_pool(pool, target, X, tasks, chunksize=None, balance=False, out=None, cancel=None):
+    if balance:
+        X = procpool.LongestFirst(X, lambda x: x[1], pool.processes(), chunksize)
+    for k, res in pool.imap_unordered(target, X, chunksize, out, cancel):
+        yield tasks[k] + (res, )
+    if balance:
+        get_logger().info("Utilisation of workers:\n{}".format(pool.summary()))
+
+def run_multiprocessing(target, jobs, n=1, nproc=None, pool=None, chunksize=None, tasks=None, balance=False, callback=None, **kwargs):
     """
     Evaluate the given function with each set of arguments, and return a list of results.
     This function does in parallel by using `multiprocessing`.
@@ -89,6 +285,29 @@ def run_multiprocessing(target, jobs, n=1, nproc=None, **kwargs):
     nproc : int, optional
         A number of cores available once.
         If nothing is given, all available cores are used.
+        Ignored when `pool` is given.
+    pool : ecell4.extra.procpool.Pool, optional
+        A pool of worker processes reused over calls.
+        The target must be picklable in this case.
+        If nothing is given, a new pool is created and closed in this function.
+    chunksize : int, optional
+        A number of tasks sent to a worker at once.
+        If nothing is given, the pool's default is used.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be evaluated.
+        Results of the other tasks are left None.
+        If nothing is given, all the tasks are evaluated.
+    balance : bool, optional
+        Whether it balances the load adaptively, or not.
+        If True, the runtime of each job is measured as its tasks finish,
+        the remaining tasks are handed out in the descending order of
+        the expected runtime of their job, and chunks shrink towards the end so that no worker is left
+        with a long backlog. `chunksize` gives the maximum size of chunks then.
+        A summary of the utilisation of each worker is logged at the end.
+        False for default.
+    callback : function, optional
+        A function called with a job and task id (int, 1-origin), and its result,
+        as soon as each task is done.
 
     Returns
     -------
@@ -107,6 +326,14 @@ def run_multiprocessing(target, jobs, n=1, nproc=None, **kwargs):
     >>> run_multiprocessing(target, jobs, n=2, nproc=2)
     [['1 spam', '2 spam'], ['1 hamham', '2 hamham'], ['1 eggseggseggs', '2 eggseggseggs']]
 
+    >>> from ecell4.extra.procpool import Pool
+    >>> def target(args, job_id, task_id):
+    ...     return (args[1] * args[0])
+    ...
+    >>> with Pool(2) as pool:  # doctest: +SKIP
+    ...     run_multiprocessing(target, jobs, pool=pool, chunksize=2)
+    [['spam'], ['hamham'], ['eggseggseggs']]
+
     See Also
     --------
     ecell4.extra.ensemble.run_serial
@@ -114,39 +341,338 @@ def run_multiprocessing(target, jobs, n=1, nproc=None, **kwargs):
     ecell4.extra.ensemble.run_slurm
     ecell4.extra.ensemble.run_multiprocessing
     ecell4.extra.ensemble.run_azure
+    ecell4.extra.procpool.Pool
+
+    """
+    jobs = list(jobs)
+    return _gather(
+        imap_multiprocessing(target, jobs, n, nproc, pool, chunksize, tasks, balance, **kwargs), len(jobs), n, callback)
+
+def imap_threads(target, jobs, n=1, nproc=None, tasks=None, cancel=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments,
+    and yield results in the order of completion.
+    This function does in parallel with threads in this process.
+
+    Nothing is pickled or copied to other processes, and all the tasks share
+    the same objects in `jobs`, e.g. a model (each task gets a shallow copy of its job).
+    This is faster than `imap_multiprocessing` only when the target releases
+    the GIL for the most of the time, e.g. a solver running in C++.
+
+    Parameters
+    ----------
+    target : function
+        A function to be evaluated. The function must accepts three arguments,
+        which are a list of arguments given as `jobs`, a job and task id (int).
+        It must be thread-safe.
+    jobs : list
+        A list of arguments passed to the function.
+    n : int, optional
+        A number of tasks. Repeat the evaluation `n` times for each job.
+        1 for default.
+    nproc : int, optional
+        A number of threads. If nothing is given, the number of cores is used.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be evaluated.
+        If nothing is given, all the tasks are evaluated.
+    cancel : threading.Event, optional
+        An event to stop the evaluation halfway. When it is set, tasks not started
+        yet are cancelled, and `concurrent.futures.CancelledError` is raised.
+
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.run_threads
+    ecell4.extra.ensemble.imap_serial
+    ecell4.extra.ensemble.imap_multiprocessing
+
+    """
+    jobs = list(jobs)
+    nproc = nproc or multiprocessing.cpu_count()
+    pending = iter(_tasks(len(jobs), n, tasks))
+    running = {}
+
+    def submit(executor):
+        for job_id, task_id in itertools.islice(pending, 2 * nproc - len(running)):
+            future = executor.submit(target, copy.copy(jobs[job_id - 1]), job_id, task_id)
+            running[future] = (job_id, task_id)
+
+    with concurrent.futures.ThreadPoolExecutor(nproc) as executor:
+        try:
+            submit(executor)
+            while len(running) > 0:
+                done, _ = concurrent.futures.wait(
+                    running, timeout=(None if cancel is None else 0.1),
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                if cancel is not None and cancel.is_set():
+                    raise concurrent.futures.CancelledError()
+                for future in done:
+                    (job_id, task_id) = running.pop(future)
+                    yield (job_id, task_id, future.result())
+                submit(executor)
+        finally:
+            # Threads cannot be stopped. Only tasks not started yet are cancelled.
+            for future in running:
+                future.cancel()
+
+def run_threads(target, jobs, n=1, nproc=None, tasks=None, callback=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments, and return a list of results.
+    This function does in parallel with threads in this process.
+    See `imap_threads` for details.
+
+    Examples
+    --------
+    >>> jobs = ((1, 'spam'), (2, 'ham'), (3, 'eggs'))
+    >>> target = lambda args, job_id, task_id: (args[1] * args[0])
+    >>> run_threads(target, jobs, nproc=2)
+    [['spam'], ['hamham'], ['eggseggseggs']]
+
+    See Also
+    --------
+    ecell4.extra.ensemble.imap_threads
+    ecell4.extra.ensemble.run_serial
+    ecell4.extra.ensemble.run_multiprocessing
 
     """
-    def consumer(f, q_in, q_out):
-        while True:
-            val = q_in.get()
-            if val is None:
-                q_in.task_done()
-                break
-            i, x = val
-            res = (i, f(*x))
-            q_in.task_done()
-            q_out.put(res)
-
-    def mulpmap(f, X, nproc):
-        nproc = nproc or multiprocessing.cpu_count()
-
-        q_in = multiprocessing.JoinableQueue()
-        q_out = multiprocessing.Queue()
-        workers = [multiprocessing.Process(target=consumer, args=(f, q_in, q_out), daemon=True) for _ in range(nproc)]
-        sent = [q_in.put((i, x)) for i, x in enumerate(X)]
-        num_tasks = len(sent)
-        [q_in.put(None) for _ in range(nproc)]  #XXX: poison pill
-        [w.start() for w in workers]
-        # [w.join() for w in workers]
-        q_in.join()
-        res = [q_out.get() for _ in range(num_tasks)]
-        return [x for (_, x) in sorted(res)]
-
-    res = mulpmap(
-        target, ((job, i + 1, j + 1) for (i, job), j in itertools.product(enumerate(jobs), range(n))), nproc)
-    return [res[i: i + n] for i in range(0, len(res), n)]
-
-def run_sge(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, environ=None, modules=(), **kwargs):
+    jobs = list(jobs)
+    return _gather(imap_threads(target, jobs, n, nproc, tasks, **kwargs), len(jobs), n, callback)
+
+def _submit_cluster(
+        scheduler, prefix, task_id_env, target, jobs, n=1, nproc=None, path='.', delete=True,
+        environ=None, modules=(), extra_args=None, chunksize=1, flatten=False, tasks=None):
+    """
+    Pack the given jobs and target into an archive, and submit them as array jobs.
+    Each element of an array job evaluates `chunksize` tasks in a row
+    by `ecell4.extra.worker` in the same interpreter, and writes their results into a single file.
+    The target is referred by its name, or pickled with cloudpickle (see `worker.dumps_target`).
+    `modules` are imported only when the target is restored from its source.
+    If `flatten` is True, all the tasks of all the jobs are submitted
+    as a single array job. Otherwise, an array job is submitted for each job.
+    If `tasks` is given, only the tasks are submitted.
+    Return a dict keeping what is required for waiting and cleaning up.
+
+    """
+    logging.basicConfig(level=logging.DEBUG)
+
+    spec = worker.dumps_target(target)
+
+    if not os.path.isdir(path):
+        os.makedirs(path)  #XXX: MYOB
+
+    if environ is None:
+        environ = {}
+        keys = ("LD_LIBRARY_PATH", "PYTHONPATH")
+        for key in keys:
+            if key in os.environ.keys():
+                environ[key] = os.environ[key]
+        if "PYTHONPATH" in environ.keys() and environ["PYTHONPATH"].strip() != "":
+            environ["PYTHONPATH"] = "{}:{}".format(os.getcwd(), environ["PYTHONPATH"])
+        else:
+            environ["PYTHONPATH"] = os.getcwd()
+
+    chunksize = max(1, chunksize or 1)
+    jobs = list(jobs)
+
+    # All the jobs are packed into a single indexed archive with a header after them,
+    # which keeps the target and the list of tasks to be evaluated if given.
+    (fd, bundlefile) = tempfile.mkstemp(suffix='.bundle', prefix=prefix, dir=path)
+    os.close(fd)
+    if tasks is None:
+        indices = None
+    else:
+        indices = [(job_id - 1) * n + (task_id - 1) for job_id, task_id in sorted(tasks)]
+    bundle.write_inputs(bundlefile, jobs + [dict(target=spec, modules=tuple(modules), indices=indices)])
+
+    # Tasks are numbered as (job_id - 1) * n + (task_id - 1) through all the jobs.
+    # Each array job covers a contiguous range of the numbers,
+    # or of the positions in the list of tasks if given,
+    # and its elements append their results into a single store.
+    if indices is None:
+        if flatten:
+            ranges = [(0, len(jobs) * n)]
+        else:
+            ranges = [(i * n, (i + 1) * n) for i in range(len(jobs))]
+    elif flatten:
+        ranges = [(0, len(indices))] if len(indices) > 0 else []
+    else:
+        ranges = []
+        for _, group in itertools.groupby(range(len(indices)), key=lambda k: indices[k] // n):
+            group = list(group)
+            ranges.append((group[0], group[-1] + 1))
+
+    arrays = []
+    for a, (start, stop) in enumerate(ranges):
+        storefile = '{}.{:d}.results'.format(bundlefile, a + 1)
+
+        cmd = '#!/bin/bash\n'
+        for key, value in environ.items():
+            cmd += 'export {:s}={:s}\n'.format(key, value)
+        cmd += 'python3 -m {} bundle {} {} {:d} {:d} {:d} {:d} {:d} {}'.format(
+            worker.__name__, bundlefile, storefile, start, stop, chunksize, n, len(jobs), task_id_env)  #XXX: Use the same executer, python
+
+        num_elements = -(-(stop - start) // chunksize)  # ceil for int
+        arrays.append(dict(
+            start=start, stop=stop, num_elements=num_elements, cmd=cmd, storefile=storefile))
+
+    if nproc is not None and len(arrays) > 1:
+        get_logger().info(
+            "nproc limits the number of running tasks for 'each' job. Give 'flatten=True' to limit the whole.")
+
+    for array in arrays:
+        array['submitted'] = scheduler.singlerun(
+            array['cmd'], array['num_elements'], path, 0, delete, extra_args, nproc)
+    return dict(
+        scheduler=scheduler, n=n, chunksize=chunksize, path=path, delete=delete, arrays=arrays,
+        indices=indices, bundlefile=bundlefile)
+
+def _stderr_tail(scheduler, submitted, element, path, lines=10):
+    """Return the last lines of the standard error of an element to be shown in an error."""
+    (jobid, name, _) = submitted
+    filename = scheduler.logfiles(jobid, name, element, path)[0]
+    try:
+        with open(filename, 'r') as fin:
+            tail = fin.read().rstrip().split('\n')[-lines: ]
+    except IOError:
+        return ''
+    return '\nThe standard error of element {:d} of job {} ends with:\n{}'.format(
+        element, jobid, '\n'.join('    ' + line for line in tail))
+
+def _imap_cluster(handle, interval=10, cancel=None):
+    """
+    Yield results of the jobs submitted by `_submit_cluster` in the order of completion.
+    The completion is detected by watching the results stores in the directory.
+    The scheduler is asked only every `interval` seconds to detect failures.
+    Jobs still running are cancelled when the iteration stops halfway,
+    or `cancel`, a threading.Event, is set.
+
+    """
+    scheduler = handle['scheduler']
+    n, chunksize = handle['n'], handle['chunksize']
+    path, delete = handle['path'], handle['delete']
+    arrays, indices = handle['arrays'], handle['indices']
+    jobids = [array['submitted'][0] for array in arrays]
+
+    readers = [bundle.ResultReader(array['storefile']) for array in arrays]
+    pending = set(
+        (a, k + 1) for a, array in enumerate(arrays) for k in range(array['num_elements']))
+
+    w = watcher.DirectoryWatcher(path, files=[array['storefile'] for array in arrays])
+    last_checked = time.time()
+    finishing = False
+    try:
+        while len(pending) > 0:
+            num_done = 0
+            for a, reader in enumerate(readers):
+                for element, res in reader.read():
+                    if (a, element) not in pending:
+                        continue  # Written twice by a retried task
+                    pending.remove((a, element))
+                    num_done += 1
+                    offset = arrays[a]['start'] + (element - 1) * chunksize
+                    for k, x in enumerate(res, offset):
+                        idx = indices[k] if indices is not None else k
+                        yield (idx // n + 1, idx % n + 1, x)
+
+            if num_done > 0:
+                continue
+            elif finishing:
+                raise RuntimeError(
+                    "Jobs {} finished, but no result was found for elements {}.{}".format(
+                        str(jobids), str(sorted((jobids[a], k) for a, k in pending)),
+                        ''.join(_stderr_tail(scheduler, arrays[a]['submitted'], k, path)
+                                for a, k in sorted(pending)[: 3])))
+
+            if time.time() - last_checked >= interval:
+                alive = scheduler.running(jobids)
+                last_checked = time.time()
+                if len(alive) == 0:
+                    # Read stores once more not to miss tasks finished in the meantime
+                    finishing = True
+                    continue
+                get_logger().info(
+                    "Waiting for {:d} elements in jobids {:s} to finish".format(len(pending), str(jobids)))
+
+            timeout = max(0.0, interval - (time.time() - last_checked))
+            if cancel is None:
+                w.wait(timeout)
+            elif cancel.is_set():
+                raise concurrent.futures.CancelledError()
+            else:
+                w.wait(min(timeout, 0.5))
+    finally:
+        w.close()
+        if len(pending) > 0:
+            alive = scheduler.running(jobids)
+            if len(alive) > 0:
+                scheduler.cancel(alive)
+
+    # All results are already there. Logs of tasks just finished may not be written yet.
+    for array in arrays:
+        (jobid, name, filename) = array['submitted']
+        outputs = scheduler.collect(
+            jobid, name, n=array['num_elements'], path=path, delete=delete, timeout=interval)
+        for output in outputs:
+            print(output, end='')
+
+    if delete:
+        for tmpname in itertools.chain(
+                (handle['bundlefile'], ),
+                *((array['storefile'], array['submitted'][2]) for array in arrays)):
+            os.remove(tmpname)
+
+def _submitted(handle):
+    jobids = [array['submitted'][0] for array in handle['arrays']]
+    get_logger().info("Jobs {} were submitted. Results are left in [{}].".format(str(jobids), handle['path']))
+    return iter(())
+
+def _sync_interval(wait):
+    if isinstance(wait, bool):
+        return 0 if not wait else 10
+    elif isinstance(wait, int):
+        return wait
+    raise ValueError("'wait' must be either 'int' or 'bool'.")
+
+def imap_sge(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, environ=None, modules=(), chunksize=1, flatten=False, tasks=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments,
+    and yield results in the order of completion.
+    This function does in parallel on the Sun Grid Engine einvironment.
+    The completion of each task is detected by watching its result file.
+
+    Arguments are same with `run_sge`.
+    `wait` gives an interval in seconds to ask the scheduler for failed jobs (10 if True).
+    If `wait` is False, jobs are just submitted, and nothing is yielded.
+    `cancel`, a threading.Event, stops waiting and deletes jobs still running when set.
+
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
+
+    See Also
+    --------
+    ecell4.extra.ensemble.run_sge
+    ecell4.extra.ensemble.imap_serial
+    ecell4.extra.ensemble.imap_multiprocessing
+    ecell4.extra.ensemble.imap_slurm
+
+    """
+    sync = _sync_interval(wait)
+    handle = _submit_cluster(
+        sge, 'sge-', 'SGE_TASK_ID', target, jobs, n, nproc, path, delete, environ, modules,
+        kwargs.get('extra_args'), chunksize, flatten, tasks)
+
+    if not (sync > 0):
+        return _submitted(handle)
+
+    return _imap_cluster(handle, sync, kwargs.get('cancel'))
+
+def run_sge(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, environ=None, modules=(), chunksize=1, flatten=False, tasks=None, callback=None, **kwargs):
     """
     Evaluate the given function with each set of arguments, and return a list of results.
     This function does in parallel on the Sun Grid Engine einvironment.
@@ -156,7 +682,9 @@ def run_sge(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, env
     target : function
         A function to be evaluated. The function must accepts three arguments,
         which are a list of arguments given as `jobs`, a job and task id (int).
-        This function can not be a lambda.
+        A function importable by its name is loaded by the name on computing nodes.
+        Otherwise, e.g. a lambda, a closure or a function in `__main__`,
+        it is pickled with cloudpickle if available.
     jobs : list
         A list of arguments passed to the function.
         All the argument must be picklable.
@@ -172,8 +700,11 @@ def run_sge(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, env
     delete : bool, optional
         Whether it removes temporary files after the successful execution.
         True for default.
-    wait : bool, optional
+    wait : bool or int, optional
         Whether it waits until all jobs are finished. If False, it just submits jobs.
+        The completion of tasks is detected from their result files as soon as
+        they are written. If int, it gives an interval in seconds to ask the scheduler
+        for failed jobs (10 if True).
         True for default.
     environ : dict, optional
         An environment variables used when running jobs.
@@ -181,6 +712,26 @@ def run_sge(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, env
     modules : list, optional
         A list of module names imported before evaluating the given function.
         The modules are loaded as: `from [module] import *`.
+        Only used when the function is restored from its source,
+        i.e. it is in `__main__` and cloudpickle is not available.
+    chunksize : int, optional
+        A number of tasks evaluated in a row by each element of an array job.
+        Tasks in the same element share an interpreter and a result file.
+        1 for default.
+    flatten : bool, optional
+        Whether it submits the tasks of all the jobs as a single array job, or not.
+        If True, `nproc` limits the number of running tasks for the whole jobs
+        and submission takes only one call of the scheduler.
+        Otherwise, an array job is submitted for each job,
+        and `nproc` is applied to each of them.
+        False for default.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be evaluated.
+        Results of the other tasks are left None.
+        If nothing is given, all the tasks are evaluated.
+    callback : function, optional
+        A function called with a job and task id (int, 1-origin), and its result,
+        as soon as each task is done.
 
     Returns
     -------
@@ -212,117 +763,53 @@ def run_sge(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, env
     ecell4.extra.ensemble.run_azure
 
     """
-    logging.basicConfig(level=logging.DEBUG)
-
-    if isinstance(target, types.LambdaType) and target.__name__ == "<lambda>":
-        raise RuntimeError("A lambda function is not accepted")
+    jobs = list(jobs)
+    sync = _sync_interval(wait)
+    handle = _submit_cluster(
+        sge, 'sge-', 'SGE_TASK_ID', target, jobs, n, nproc, path, delete, environ, modules,
+        kwargs.get('extra_args'), chunksize, flatten, tasks)
 
-    # src = textwrap.dedent(inspect.getsource(singlerun)).replace(r'"', r'\"')
-    src = textwrap.dedent(inspect.getsource(target)).replace(r'"', r'\"')
-    if re.match('[\s\t]+', src.split('\n')[0]) is not None:
-        raise RuntimeError(
-            "Wrong indentation was found in the source translated")
+    if not (sync > 0):
+        return None
 
-    if not os.path.isdir(path):
-        os.makedirs(path)  #XXX: MYOB
+    return _gather(_imap_cluster(handle, sync), len(jobs), n, callback)
 
-    if environ is None:
-        environ = {}
-        keys = ("LD_LIBRARY_PATH", "PYTHONPATH")
-        for key in keys:
-            if key in os.environ.keys():
-                environ[key] = os.environ[key]
-        if "PYTHONPATH" in environ.keys() and environ["PYTHONPATH"].strip() != "":
-            environ["PYTHONPATH"] = "{}:{}".format(os.getcwd(), environ["PYTHONPATH"])
-        else:
-            environ["PYTHONPATH"] = os.getcwd()
+def imap_slurm(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, environ=None, modules=(), chunksize=1, flatten=False, tasks=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments,
+    and yield results in the order of completion.
+    This function does in parallel with Slurm Workload Manager.
+    The completion of each task is detected by watching its result file.
 
-    cmds = []
-    pickleins = []
-    pickleouts = []
-    scripts = []
-    for i, job in enumerate(jobs):
-        (fd, picklein) = tempfile.mkstemp(suffix='.pickle', prefix='sge-', dir=path)
-        with os.fdopen(fd, 'wb') as fout:
-            pickle.dump(job, fout)
-        pickleins.append(picklein)
-
-        pickleouts.append([])
-        for j in range(n):
-            fd, pickleout = tempfile.mkstemp(suffix='.pickle', prefix='sge-', dir=path)
-            os.close(fd)
-            pickleouts[-1].append(pickleout)
-        # pickleouts.append(
-        #     [tempfile.mkstemp(suffix='.pickle', prefix='sge-', dir=path)[1]
-        #      for j in range(n)])
-
-        code = 'import sys\n'
-        code += 'import os\n'
-        code += 'import pickle\n'
-        code += 'with open(\'{}\', \'rb\') as fin:\n'.format(picklein)
-        code += '    job = pickle.load(fin)\n'
-        code += 'pass\n'
-        for m in modules:
-            code += "from {} import *\n".format(m)
-        code += src
-        code += '\ntid = int(os.environ[\'SGE_TASK_ID\'])'
-        code += '\nretval = {:s}(job, {:d}, tid)'.format(target.__name__, i + 1)
-        code += '\nfilenames = {:s}'.format(str(pickleouts[-1]))
-        code += '\npickle.dump(retval, open(filenames[tid - 1], \'wb\'))\n'
-
-        (fd, script) = tempfile.mkstemp(suffix='.py', prefix='sge-', dir=path, text=True)
-        with os.fdopen(fd, 'w') as fout:
-            fout.write(code)
-        scripts.append(script)
+    Arguments are same with `run_slurm`.
+    `wait` gives an interval in seconds to ask the scheduler for failed jobs (10 if True).
+    If `wait` is False, jobs are just submitted, and nothing is yielded.
+    `cancel`, a threading.Event, stops waiting and deletes jobs still running when set.
 
-        cmd = '#!/bin/bash\n'
-        for key, value in environ.items():
-            cmd += 'export {:s}={:s}\n'.format(key, value)
-        cmd += 'python3 {}'.format(script)  #XXX: Use the same executer, python
-        # cmd += 'python3 -c "\n'
-        # cmd += 'import sys\n'
-        # cmd += 'import os\n'
-        # cmd += 'import pickle\n'
-        # cmd += 'with open(sys.argv[1], \'rb\') as fin:\n'
-        # cmd += '    job = pickle.load(fin)\n'
-        # cmd += 'pass\n'
-        # for m in modules:
-        #     cmd += "from {} import *\n".format(m)
-        # cmd += src
-        # cmd += '\ntid = int(os.environ[\'SGE_TASK_ID\'])'
-        # cmd += '\nretval = {:s}(job, {:d}, tid)'.format(target.__name__, i + 1)
-        # cmd += '\nfilenames = {:s}'.format(str(pickleouts[-1]))
-        # cmd += '\npickle.dump(retval, open(filenames[tid - 1], \'wb\'))'
-        # cmd += '" {:s}\n'.format(picklein)
-        cmds.append(cmd)
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
 
-    if isinstance(wait, bool):
-        sync = 0 if not wait else 10
-    elif isinstance(wait, int):
-        sync = wait
-    else:
-        raise ValueError("'wait' must be either 'int' or 'bool'.")
+    See Also
+    --------
+    ecell4.extra.ensemble.run_slurm
+    ecell4.extra.ensemble.imap_serial
+    ecell4.extra.ensemble.imap_multiprocessing
+    ecell4.extra.ensemble.imap_sge
 
-    jobids = sge.run(cmds, n=n, path=path, delete=delete, sync=sync, max_running_tasks=nproc, **kwargs)
+    """
+    sync = _sync_interval(wait)
+    handle = _submit_cluster(
+        slurm, 'slurm-', 'SLURM_ARRAY_TASK_ID', target, jobs, n, nproc, path, delete, environ, modules,
+        kwargs.get('extra_args'), chunksize, flatten, tasks)
 
     if not (sync > 0):
-        return None
-
-    for jobid, name in jobids:
-        outputs = sge.collect(jobid, name, n=n, path=path, delete=delete)
-        for output in outputs:
-            print(output, end='')
+        return _submitted(handle)
 
-    retval = [[pickle.load(open(pickleout, 'rb')) for pickleout in tasks]
-              for tasks in pickleouts]
+    return _imap_cluster(handle, sync, kwargs.get('cancel'))
 
-    if delete:
-        for tmpname in itertools.chain(pickleins, scripts, *pickleouts):
-            os.remove(tmpname)
-
-    return retval
-
-def run_slurm(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, environ=None, modules=(), **kwargs):
+def run_slurm(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, environ=None, modules=(), chunksize=1, flatten=False, tasks=None, callback=None, **kwargs):
     """
     Evaluate the given function with each set of arguments, and return a list of results.
     This function does in parallel with Slurm Workload Manager.
@@ -332,7 +819,9 @@ def run_slurm(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, e
     target : function
         A function to be evaluated. The function must accepts three arguments,
         which are a list of arguments given as `jobs`, a job and task id (int).
-        This function can not be a lambda.
+        A function importable by its name is loaded by the name on computing nodes.
+        Otherwise, e.g. a lambda, a closure or a function in `__main__`,
+        it is pickled with cloudpickle if available.
     jobs : list
         A list of arguments passed to the function.
         All the argument must be picklable.
@@ -348,8 +837,11 @@ def run_slurm(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, e
     delete : bool, optional
         Whether it removes temporary files after the successful execution.
         True for default.
-    wait : bool, optional
+    wait : bool or int, optional
         Whether it waits until all jobs are finished. If False, it just submits jobs.
+        The completion of tasks is detected from their result files as soon as
+        they are written. If int, it gives an interval in seconds to ask the scheduler
+        for failed jobs (10 if True).
         True for default.
     environ : dict, optional
         An environment variables used when running jobs.
@@ -357,6 +849,26 @@ def run_slurm(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, e
     modules : list, optional
         A list of module names imported before evaluating the given function.
         The modules are loaded as: `from [module] import *`.
+        Only used when the function is restored from its source,
+        i.e. it is in `__main__` and cloudpickle is not available.
+    chunksize : int, optional
+        A number of tasks evaluated in a row by each element of an array job.
+        Tasks in the same element share an interpreter and a result file.
+        1 for default.
+    flatten : bool, optional
+        Whether it submits the tasks of all the jobs as a single array job, or not.
+        If True, `nproc` limits the number of running tasks for the whole jobs
+        and submission takes only one call of the scheduler.
+        Otherwise, an array job is submitted for each job,
+        and `nproc` is applied to each of them.
+        False for default.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be evaluated.
+        Results of the other tasks are left None.
+        If nothing is given, all the tasks are evaluated.
+    callback : function, optional
+        A function called with a job and task id (int, 1-origin), and its result,
+        as soon as each task is done.
 
     Returns
     -------
@@ -388,125 +900,25 @@ def run_slurm(target, jobs, n=1, nproc=None, path='.', delete=True, wait=True, e
     ecell4.extra.ensemble.run_azure
 
     """
-    logging.basicConfig(level=logging.DEBUG)
-
-    if isinstance(target, types.LambdaType) and target.__name__ == "<lambda>":
-        raise RuntimeError("A lambda function is not accepted")
-
-    # src = textwrap.dedent(inspect.getsource(singlerun)).replace(r'"', r'\"')
-    src = textwrap.dedent(inspect.getsource(target)).replace(r'"', r'\"')
-    if re.match('[\s\t]+', src.split('\n')[0]) is not None:
-        raise RuntimeError(
-            "Wrong indentation was found in the source translated")
-
-    if not os.path.isdir(path):
-        os.makedirs(path)  #XXX: MYOB
-
-    if environ is None:
-        environ = {}
-        keys = ("LD_LIBRARY_PATH", "PYTHONPATH")
-        for key in keys:
-            if key in os.environ.keys():
-                environ[key] = os.environ[key]
-        if "PYTHONPATH" in environ.keys() and environ["PYTHONPATH"].strip() != "":
-            environ["PYTHONPATH"] = "{}:{}".format(os.getcwd(), environ["PYTHONPATH"])
-        else:
-            environ["PYTHONPATH"] = os.getcwd()
-
-    cmds = []
-    pickleins = []
-    pickleouts = []
-    scripts = []
-    for i, job in enumerate(jobs):
-        (fd, picklein) = tempfile.mkstemp(suffix='.pickle', prefix='slurm-', dir=path)
-        with os.fdopen(fd, 'wb') as fout:
-            pickle.dump(job, fout)
-        pickleins.append(picklein)
-
-        pickleouts.append([])
-        for j in range(n):
-            fd, pickleout = tempfile.mkstemp(suffix='.pickle', prefix='slurm-', dir=path)
-            os.close(fd)
-            pickleouts[-1].append(pickleout)
-        # pickleouts.append(
-        #     [tempfile.mkstemp(suffix='.pickle', prefix='slurm-', dir=path)[1]
-        #      for j in range(n)])
-
-        code = 'import sys\n'
-        code += 'import os\n'
-        code += 'import pickle\n'
-        code += 'with open(\'{}\', \'rb\') as fin:\n'.format(picklein)
-        code += '    job = pickle.load(fin)\n'
-        code += 'pass\n'
-        for m in modules:
-            code += "from {} import *\n".format(m)
-        code += src
-        code += '\ntid = int(os.environ[\'SLURM_ARRAY_TASK_ID\'])'
-        # code += '\ntid = int(os.environ[\'SGE_TASK_ID\'])'
-        code += '\nretval = {:s}(job, {:d}, tid)'.format(target.__name__, i + 1)
-        code += '\nfilenames = {:s}'.format(str(pickleouts[-1]))
-        code += '\npickle.dump(retval, open(filenames[tid - 1], \'wb\'))\n'
-
-        (fd, script) = tempfile.mkstemp(suffix='.py', prefix='slurm-', dir=path, text=True)
-        with os.fdopen(fd, 'w') as fout:
-            fout.write(code)
-        scripts.append(script)
-
-        cmd = '#!/bin/bash\n'
-        for key, value in environ.items():
-            cmd += 'export {:s}={:s}\n'.format(key, value)
-        cmd += 'python3 {}'.format(script)  #XXX: Use the same executer, python
-        # cmd += 'python3 -c "\n'
-        # cmd += 'import sys\n'
-        # cmd += 'import os\n'
-        # cmd += 'import pickle\n'
-        # cmd += 'with open(sys.argv[1], \'rb\') as fin:\n'
-        # cmd += '    job = pickle.load(fin)\n'
-        # cmd += 'pass\n'
-        # for m in modules:
-        #     cmd += "from {} import *\n".format(m)
-        # cmd += src
-        # cmd += '\ntid = int(os.environ[\'SGE_TASK_ID\'])'
-        # cmd += '\nretval = {:s}(job, {:d}, tid)'.format(target.__name__, i + 1)
-        # cmd += '\nfilenames = {:s}'.format(str(pickleouts[-1]))
-        # cmd += '\npickle.dump(retval, open(filenames[tid - 1], \'wb\'))'
-        # cmd += '" {:s}\n'.format(picklein)
-        cmds.append(cmd)
-
-    if isinstance(wait, bool):
-        sync = 0 if not wait else 10
-    elif isinstance(wait, int):
-        sync = wait
-    else:
-        raise ValueError("'wait' must be either 'int' or 'bool'.")
-
-    #XXX: nproc only limits the maximum count for 'each' job, but not for the whole jobs.
-    jobids = slurm.run(cmds, n=n, path=path, delete=delete, sync=sync, max_running_tasks=nproc, **kwargs)
+    jobs = list(jobs)
+    sync = _sync_interval(wait)
+    handle = _submit_cluster(
+        slurm, 'slurm-', 'SLURM_ARRAY_TASK_ID', target, jobs, n, nproc, path, delete, environ, modules,
+        kwargs.get('extra_args'), chunksize, flatten, tasks)
 
     if not (sync > 0):
         return None
 
-    for jobid, name in jobids:
-        outputs = slurm.collect(jobid, name, n=n, path=path, delete=delete)
-        for output in outputs:
-            print(output, end='')
-
-    retval = [[pickle.load(open(pickleout, 'rb')) for pickleout in tasks]
-              for tasks in pickleouts]
-
-    if delete:
-        for tmpname in itertools.chain(pickleins, scripts, *pickleouts):
-            os.remove(tmpname)
-
-    return retval
+    return _gather(_imap_cluster(handle, sync), len(jobs), n, callback)
 
-def run_azure(target, jobs, n=1, nproc=None, path='.', delete=True, config=None, **kwargs):
+def run_azure(target, jobs, n=1, nproc=None, path='.', delete=True, config=None, tasks=None, **kwargs):
     """
     Evaluate the given function with each set of arguments, and return a list of results.
     This function does in parallel with Microsoft Azure Batch.
 
     This function is the work in progress.
-    The argument `nproc` doesn't work yet.
+    Tasks are packed into a Batch task for each node, and evaluated by
+    a process pool there. At most `nproc` tasks run at once, if given.
     See `ecell4.extra.azure_batch.run_azure` for details.
 
     See Also
@@ -520,7 +932,138 @@ def run_azure(target, jobs, n=1, nproc=None, path='.', delete=True, config=None,
 
     """
     import ecell4.extra.azure_batch as azure_batch
-    return azure_batch.run_azure(target, jobs, n, path, delete, config)
+    return azure_batch.run_azure(target, jobs, n, path, delete, config, tasks, nproc)
+
+def _imap_azure(target, jobs, n=1, nproc=None, tasks=None, **kwargs):
+    jobs = list(jobs)
+    results = run_azure(target, jobs, n, nproc, tasks=tasks, **kwargs)
+    for job_id, task_id in _tasks(len(jobs), n, tasks):
+        yield (job_id, task_id, results[job_id - 1][task_id - 1])
+
+def imap_cached(imap, target, jobs, n=1, root='.ensemble', tasks=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments through `imap`,
+    and yield results with recording them in a persistent run directory.
+    The directory is named by a hash of the target source and jobs (including seeds).
+    Results already recorded are yielded first, and then only the missing tasks are evaluated.
+    Thus, a run stopped halfway is resumed, and an identical request is served
+    from the directory without any evaluation. A request with a larger `n`
+    evaluates only the additional tasks.
+
+    Parameters
+    ----------
+    imap : function
+        One of `imap_serial`, `imap_multiprocessing`, `imap_sge` and `imap_slurm`.
+        It must accept `tasks`.
+    target : function
+        A function to be evaluated.
+    jobs : list
+        A list of arguments passed to the function.
+        All the argument must be picklable.
+    n : int, optional
+        A number of tasks. Repeat the evaluation `n` times for each job.
+        1 for default.
+    root : str, optional
+        A directory where run directories are created.
+        '.ensemble' for default.
+    tasks : list, optional
+        A list of pairs of a job and task id (1-origin) to be yielded.
+        If nothing is given, all the tasks are yielded.
+    **kwargs : dict, optional
+        Optional keyword arguments are passed through to `imap`.
+
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
+
+    Examples
+    --------
+    >>> jobs = ((1, 'spam'), (2, 'ham'))
+    >>> def target(args, job_id, task_id):
+    ...     return (args[1] * args[0])
+    ...
+    >>> list(imap_cached(imap_multiprocessing, target, jobs, n=2, root='.tmp', nproc=2))  # doctest: +SKIP
+
+    See Also
+    --------
+    ecell4.extra.cache.RunCache
+
+    """
+    jobs = list(jobs)
+    c = cache.RunCache(root, target, jobs, n)
+    selected = set(_tasks(len(jobs), n, tasks))
+
+    for job_id, task_id, res in c.items():
+        if (job_id, task_id) in selected:
+            yield (job_id, task_id, res)
+
+    missing = [task for task in c.missing() if task in selected]
+    if len(missing) == 0:
+        return
+    elif len(missing) < len(selected):
+        get_logger().info(
+            "Resume {:d} tasks out of {:d} in [{}].".format(len(missing), len(selected), c.path()))
+
+    for job_id, task_id, res in imap(target, jobs, n, tasks=missing, **kwargs):
+        c.store(job_id, task_id, res)
+        yield (job_id, task_id, res)
+
+def imap_waves(imap, target, jobs, n=1, wave=None, stop=None, **kwargs):
+    """
+    Evaluate the given function with each set of arguments through `imap`
+    in waves of tasks, and stop submitting new waves once `stop` returns True.
+    A wave is a call of `imap` with the next `wave` tasks of each job.
+    `stop` is called after all the results of a wave are consumed,
+    and thus it can see statistics accumulated from the results yielded.
+
+    Parameters
+    ----------
+    imap : function
+        One of `imap_serial`, `imap_multiprocessing`, `imap_sge` and `imap_slurm`.
+        It must accept `tasks`.
+    target : function
+        A function to be evaluated.
+    jobs : list
+        A list of arguments passed to the function.
+    n : int, optional
+        A maximum number of tasks for each job.
+        1 for default.
+    wave : int, optional
+        A number of tasks for each job in a wave.
+        If nothing is given, a tenth of `n`, but at least 10.
+    stop : function, optional
+        A function called with the number of tasks for each job done so far,
+        which returns True when no more wave is needed.
+    **kwargs : dict, optional
+        Optional keyword arguments are passed through to `imap`.
+
+    Yields
+    ------
+    (job_id, task_id, result) : tuple
+        A job and task id (int, 1-origin), and its result.
+
+    Examples
+    --------
+    >>> stats = aggregation.RunningStatistics()  # doctest: +SKIP
+    >>> for _, _, data in imap_waves(
+    ...         imap_multiprocessing, singlerun, jobs, n=1000,
+    ...         stop=lambda count: stats.relative_stderr() < 0.01):  # doctest: +SKIP
+    ...     stats.add(data)
+
+    """
+    jobs = list(jobs)
+    wave = wave or max(10, n // 10)
+
+    done = 0
+    while done < n:
+        upto = min(n, done + wave)
+        tasks = [(i + 1, j + 1) for i in range(len(jobs)) for j in range(done, upto)]
+        for retval in imap(target, jobs, upto, tasks=tasks, **kwargs):
+            yield retval
+        done = upto
+        if stop is not None and stop(done):
+            break
 
 def genseeds(n):
     """
@@ -565,10 +1108,95 @@ def getseed(myseed, i):
 #XXX:
 #XXX:
 
+def _finalize(iterator, func):
+    try:
+        for retval in iterator:
+            yield retval
+    finally:
+        func()
+
+def _imap_shared(imap, model, model_ref, target, jobs, *args, **kwargs):
+    # Replace the model with a reference just before submission. Jobs given
+    # to imap_cached keep the model itself, and so does the fingerprint.
+    jobs = [dict(job, model=model_ref) if job['model'] is model else job for job in jobs]
+    return imap(target, jobs, *args, **kwargs)
+
+def _recorder(metrics, kwargs):
+    # Let the backend measure each task, see ecell4.extra.backends.Submission.
+    if metrics is None:
+        return None
+    recorder = metrics if isinstance(metrics, telemetry.Recorder) else telemetry.Recorder(metrics)
+    kwargs['telemetry'] = recorder
+    return recorder
+
+def _report(recorder):
+    get_logger().info("Telemetry of {:d} runs{}:\n{}".format(
+        len(recorder.records()),
+        '' if recorder.filename() is None else ' [{}]'.format(recorder.filename()),
+        recorder.report()))
+
+def _accumulate(iterator, stats):
+    for retval in iterator:
+        stats.add(retval[2])
+        yield retval
+
+def _converged(stats, rtol, species_list, n):
+    if isinstance(rtol, dict):
+        unknown = [serial for serial in rtol.keys() if serial not in species_list]
+        if len(unknown) > 0:
+            raise ValueError("No species is observed for 'rtol' [{}].".format(', '.join(unknown)))
+
+    def stop(count):
+        if isinstance(rtol, dict):
+            err = stats.relative_stderr(per_species=True)
+            converged = all(err[species_list.index(serial)] <= tol for serial, tol in rtol.items())
+            err = max(err[species_list.index(serial)] for serial in rtol.keys())
+        else:
+            err = stats.relative_stderr()
+            converged = (err <= rtol)
+        if converged:
+            get_logger().info("Converged after {:d} runs (relative standard error {:g}).".format(count, err))
+        elif count >= n:
+            get_logger().warning("Not converged within {:d} runs (relative standard error {:g}).".format(n, err))
+        else:
+            get_logger().info("Not converged yet after {:d} runs (relative standard error {:g}).".format(count, err))
+        return converged
+    return stop
+
+def _num_time_points(t):
+    # The same with run_simulation, which observes 101 points for a number.
+    if isinstance(t, numbers.Real):
+        return 101
+    try:
+        return len(t)
+    except TypeError:
+        return None
+
+def _seed_sequence(rndseed, n, cache=None):
+    if rndseed is None:
+        if cache is not None:
+            get_logger().warning("No 'rndseed' was given. Cached results are never reused.")
+        return SeedSequence()
+    elif isinstance(rndseed, SeedSequence):
+        return rndseed
+    elif isinstance(rndseed, numbers.Integral):
+        return SeedSequence(rndseed)
+    elif (not isinstance(rndseed, bytes) or len(rndseed) != n * 4 * 2):
+        raise ValueError(
+            "A wrong seed for the random number generation was given. Use 'SeedSequence' or 'genseeds'.")
+    return rndseed
+
 def singlerun(job, job_id, task_id):
     import ecell4.util
     import ecell4.extra.ensemble
-    rndseed = ecell4.extra.ensemble.getseed(job.pop('myseed'), task_id)
+    import ecell4.extra.procpool
+    if isinstance(job['model'], ecell4.extra.procpool.Shared):
+        job['model'] = job['model'].get()  # Deserialized once per worker
+    myseed = job.pop('myseed')
+    if isinstance(myseed, ecell4.extra.ensemble.SeedSequence):
+        rndseed = myseed.seed(job_id, task_id)
+    else:
+        rndseed = ecell4.extra.ensemble.getseed(myseed, task_id)
     job.update({'return_type': 'array', 'rndseed': rndseed})
     data = ecell4.util.run_simulation(**job)
     return data
@@ -578,14 +1206,128 @@ import ecell4.util.simulation
 import ecell4.util.viz
 import ecell4.ode
 
+class DummyObserver:
+    """
+    A wrapper of ensemble statistics, which has the almost same interface
+    with NumberObservers.
+
+    """
+
+    def __init__(self, inputs, species_list, errorbar=True, t=None):
+        """
+        Parameters
+        ----------
+        inputs : list, array or RunningStatistics
+            A list of time courses, a float64 array with the shape
+            (n_runs, n_times, n_species), or statistics already accumulated.
+            Time courses are packed into a single array once.
+        species_list : list
+            A list of serials of the observed Species.
+        errorbar : bool, optional
+            Whether it keeps standard errors, or not.
+            True for default.
+        t : array, optional
+            Time points. Required only when `inputs` is an array.
+
+        """
+        import numpy
+        import ecell4.extra.aggregation as aggregation
+
+        self.__block = None
+        self.__stats = None
+
+        if isinstance(inputs, aggregation.RunningStatistics):
+            if inputs.count() == 0:
+                raise ValueError("No input was given.")
+            self.__stats = inputs
+            t, mean, std, count = inputs.t(), inputs.mean(), inputs.std(), inputs.count()
+        else:
+            if isinstance(inputs, numpy.ndarray) and inputs.ndim == 3:
+                if t is None:
+                    raise ValueError("Time points 't' must be given with an array.")
+                block = inputs
+            else:
+                t, block = aggregation.pack(inputs)
+            self.__block = block
+            mean, std, count = block.mean(axis=0), block.std(axis=0), block.shape[0]
+
+        self.__data = numpy.column_stack([t, mean])
+        self.__std = std
+        self.__count = count
+
+        if errorbar:
+            # self.__error = numpy.column_stack([t, std])
+            self.__error = numpy.column_stack([t, std / numpy.sqrt(count)])
+        else:
+            self.__error = None
+
+        self.__species_list = [ecell4.Species(serial) for serial in species_list]
+
+    def targets(self):
+        return self.__species_list
+
+    def data(self):
+        return self.__data
+
+    def t(self):
+        return self.__data.T[0]
+
+    def error(self):
+        return self.__error
+
+    def count(self):
+        """Return the number of runs."""
+        return self.__count
+
+    def std(self):
+        """Return the standard deviation at each time point in the same format with `data`."""
+        import numpy
+        return numpy.column_stack([self.t(), self.__std])
+
+    def percentile(self, q):
+        """
+        Return the q-th percentile at each time point in the same format with `data`.
+        When built from RunningStatistics, this is estimated from its reservoir.
+
+        Parameters
+        ----------
+        q : float
+            A percentile between 0 and 100 inclusive.
+
+        """
+        import numpy
+        if self.__block is not None:
+            value = numpy.percentile(self.__block, q, axis=0)
+        else:
+            value = self.__stats.quantile(q * 0.01)
+        return numpy.column_stack([self.t(), value])
+
+    def save(self, filename):
+        """
+        Save the mean time course.
+        A '.npz' file keeps the standard error and species in binary.
+        Otherwise, it is saved as a CSV text.
+
+        """
+        import numpy
+        if filename.endswith('.npz'):
+            numpy.savez(
+                filename, data=self.data(),
+                error=self.error() if self.error() is not None else numpy.empty((0, 0)),
+                species=numpy.array([sp.serial() for sp in self.__species_list]))
+        else:
+            numpy.savetxt(
+                filename, self.data(), delimiter=',', comments='',
+                header=','.join('"{}"'.format(sp.serial()) for sp in self.__species_list))
+
 ## observers=(), progressbar=0
 def ensemble_simulations(
     t, y0=None, volume=1.0, model=None, solver='ode',
     is_netfree=False, species_list=None, without_reset=False,
     return_type='matplotlib', opt_args=(), opt_kwargs=None,
     structures=None, rndseed=None,
-    n=1, nproc=None, method=None, errorbar=True,
-    **kwargs):
+    n=1, nproc=None, method=None, errorbar=True, cache=None, rtol=None, wave=None,
+    metrics=None, reservoir=100, **kwargs):
     """
     Run simulations multiple times and return its ensemble.
     Arguments are almost same with ``ecell4.util.run_simulation``.
@@ -595,16 +1337,65 @@ def ensemble_simulations(
     ----------
     n : int, optional
         A number of runs. Default is 1.
+        The maximum number of runs when `rtol` is given.
+    rndseed : SeedSequence, int or bytes, optional
+        A seed for the random number generation. The i-th run is seeded with
+        `SeedSequence.seed(1, i)`. An int is taken as the entropy of SeedSequence.
+        A seed given by `genseeds(n)` is also accepted.
+        With the same SeedSequence, the first runs of a larger `n` are same
+        with the runs of a smaller `n`.
+        Default is None, which means a new SeedSequence.
     nproc : int, optional
         A number of processors. Ignored when method='serial'.
         Default is None.
-    method : str, optional
+    method : str or Backend, optional
         The way for running multiple jobs.
-        Choose one from 'serial', 'multiprocessing', 'sge', 'slurm', 'azure'.
+        Choose one from 'serial', 'threads', 'multiprocessing', 'sge', 'slurm', 'azure',
+        or a backend registered in `ecell4.extra.backends`.
         Default is None, which works as 'serial'.
+    cache : str, optional
+        A directory to keep results of each run persistently.
+        Only missing runs are evaluated when called again with the same arguments,
+        and thus a run stopped halfway is resumed. Give `rndseed` too,
+        otherwise a new seed is generated at each call and nothing is reused.
+        With a SeedSequence, increasing `n` evaluates only the additional runs.
+        See `imap_cached` for details.
+        Default is None, which means nothing is kept.
+    rtol : float or dict, optional
+        A target of the relative standard error of the mean.
+        If given, runs are submitted in waves of `wave` runs, and no more wave
+        is submitted once the target is met or `n` runs are done.
+        The relative standard error is the norm of standard errors over
+        the norm of means along time points (see `RunningStatistics.relative_stderr`).
+        A float is the target for all species at once. A dict gives a target
+        for each serial of Species, and all of them must be met.
+        The number of runs actually done is logged, and is the length of the result
+        (or `DummyObserver.count()`).
+        Default is None, which means `n` runs are always done.
+    wave : int, optional
+        A number of runs in a wave. Only used with `rtol`.
+        Default is None, which means a tenth of `n`, but at least 10.
+    metrics : str or Recorder, optional
+        A path to a metrics file, or an `ecell4.extra.telemetry.Recorder`.
+        If given, each run records its submit, start and end time, the peak RSS
+        and the host, which are appended to the file as JSON lines, and a summary
+        (throughput, queue wait and stragglers) is logged at the end.
+        Runs served from `cache` are not recorded.
+        Default is None, which means nothing is measured.
+    reservoir : int, optional
+        A number of trajectories sampled at random to estimate percentiles
+        (see `DummyObserver.percentile`) when `return_type` is 'observer',
+        'matplotlib' or 'nyaplot'. 0 means no percentile is available.
+        Default is 100.
     **kwargs : dict, optional
         Optional keyword arugments are passed through to `run_serial`,
         `run_sge`, or `run_multiprocessing`.
+        e.g.) `pool` and `chunksize` for `run_multiprocessing` let
+        multiple calls share the same worker processes.
+        With 'multiprocessing', trajectories are written into shared memory
+        by workers directly when available, if `return_type` is 'dataframe' or 'xarray'.
+        With 'sge' or 'slurm', `wait=False` just submits jobs, and requires
+        `return_type='none'`.
         See each function for more details.
 
     Returns
@@ -615,6 +1406,12 @@ def ensemble_simulations(
         When ``return_type`` is 'observer', return a DummyObserver.
         DummyObserver is a wrapper, which has the almost same interface
         with NumberObservers.
+        When ``return_type`` is 'dataframe', return a single tidy
+        pandas.DataFrame with columns Run, Time, Species and Value.
+        Give ``opt_kwargs={'wide': True}`` for a frame indexed by Run and Time
+        with a column per Species instead.
+        When ``return_type`` is 'xarray', return a xarray.DataArray
+        with dimensions ('run', 'time', 'species').
         Return nothing if else.
 
     See Also
@@ -625,6 +1422,7 @@ def ensemble_simulations(
     ecell4.extra.ensemble.run_slurm
     ecell4.extra.ensemble.run_multiprocessing
     ecell4.extra.ensemble.run_azure
+    ecell4.extra.ensemble.sweep_simulations
 
     """
     y0 = y0 or {}
@@ -650,118 +1448,366 @@ def ensemble_simulations(
     if species_list is None:
         species_list = ecell4.util.simulation.list_species(model, y0.keys())
 
-    if rndseed is None:
-        myseed = genseeds(n)
-    elif (not isinstance(rndseed, bytes) or len(rndseed) != n * 4 * 2):
-        raise ValueError(
-            "A wrong seed for the random number generation was given. Use 'genseeds'.")
-
+    myseed = _seed_sequence(rndseed, n, cache)
     jobs = [{'t': t, 'y0': y0, 'volume': volume, 'model': model, 'solver': solver, 'species_list': species_list, 'structures': structures, 'myseed': myseed}]
 
-    if method is None or method.lower() == "serial":
-        retval = run_serial(singlerun, jobs, n=n, **kwargs)
-    elif method.lower() == "sge":
-        retval = run_sge(singlerun, jobs, n=n, nproc=nproc, **kwargs)
-    elif method.lower() == "slurm":
-        retval = run_slurm(singlerun, jobs, n=n, nproc=nproc, **kwargs)
-    elif method.lower() == "multiprocessing":
-        retval = run_multiprocessing(singlerun, jobs, n=n, nproc=nproc, **kwargs)
-    elif method.lower() == "azure":
-        retval = run_azure(singlerun, jobs, n=n, nproc=nproc, **kwargs)
-    else:
-        raise ValueError(
-            'Argument "method" must be one of "serial", "multiprocessing", "slurm" and "sge".')
-
-    if return_type is None or return_type in ("none", ):
-        return
-
-    assert len(retval) == len(jobs) == 1
+    backend = backends.get_backend(method)
+    imap = backend.submit
 
-    if return_type in ("array", 'a'):
-        return retval[0]
+    if kwargs.get('wait', True) is False and return_type not in (None, "none"):
+        # 'sge' and 'slurm' just submit jobs, and no result is returned.
+        raise ValueError("Jobs are just submitted with wait=False. Give return_type='none'.")
 
-    import numpy
+    model_ref = None
+    if backend.supports_shared_memory and kwargs.get('share', True):
+        # Workers keep the model by its fingerprint, and tasks carry only references.
+        model_ref = procpool.Shared(model)
+        imap = functools.partial(_imap_shared, imap, model, model_ref)
+        kwargs['share'] = True
 
-    class DummyObserver:
+    shared = None
+    recorder = _recorder(metrics, kwargs)
 
-        def __init__(self, inputs, species_list, errorbar=True):
-            if len(inputs) == 0:
-                raise ValueError("No input was given.")
+    if (backend.supports_shared_memory and cache is None and rtol is None and recorder is None and 'out' not in kwargs
+            and return_type in ('xarray', 'x', 'dataframe', 'd') and procpool.SharedArray.available()):
+        num_times = _num_time_points(t)
+        if num_times is not None:
+            # Workers write trajectories into a single block on shared memory,
+            # and nothing but indices is sent back.
+            shared = procpool.SharedArray((n, num_times, len(species_list) + 1))
+            kwargs['out'] = shared
 
-            t = numpy.array(inputs[0], numpy.float64).T[0]
-            mean = sum([numpy.array(data, numpy.float64).T[1: ] for data in inputs])
-            mean /= len(inputs)
+    import ecell4.extra.aggregation as aggregation
 
-            self.__data = numpy.vstack([t, mean]).T
+    pool = None
+    if rtol is not None and backend.supports_shared_memory and kwargs.get('pool') is None:
+        # Waves share the same worker processes.
+        pool = kwargs['pool'] = procpool.Pool(nproc, target=singlerun)
 
-            if errorbar:
-                var = sum([(numpy.array(data, numpy.float64).T[1: ] - mean) ** 2
-                             for data in inputs]) / len(inputs)
-                stdev = numpy.sqrt(var)
-                stder = stdev / numpy.sqrt(len(inputs))
-                # self.__error = numpy.vstack([t, stdev]).T
-                self.__error = numpy.vstack([t, stder]).T
-            else:
-                self.__error = None
+    if cache is not None:
+        imap = functools.partial(imap_cached, imap, root=cache)
 
-            self.__species_list = [ecell4.Species(serial) for serial in species_list]
+    if rtol is None:
+        retval = imap(singlerun, jobs, n=n, nproc=nproc, **kwargs)
+    else:
+        convergence = aggregation.RunningStatistics()
+        retval = _accumulate(
+            imap_waves(
+                imap, singlerun, jobs, n=n, wave=wave,
+                stop=_converged(convergence, rtol, species_list, n), nproc=nproc, **kwargs),
+            convergence)
 
-        def targets(self):
-            return self.__species_list
+    if pool is not None:
+        cancel = kwargs.get('cancel')
+        retval = _finalize(
+            retval, lambda: pool.terminate() if cancel is not None and cancel.is_set() else pool.close())
 
-        def data(self):
-            return self.__data
+    if model_ref is not None:
+        retval = _finalize(retval, model_ref.remove)
 
-        def t(self):
-            return self.__data.T[0]
+    if recorder is not None:
+        retval = _finalize(retval, lambda: _report(recorder))
 
-        def error(self):
-            return self.__error
+    if return_type is None or return_type in ("none", ):
+        for _ in retval:
+            pass
+        return
 
-        def save(self, filename):
-            with open(filename, 'w') as fout:
-                writer = csv.writer(fout, delimiter=',', lineterminator='\n')
-                writer.writerow(['"{}"'.format(sp.serial()) for sp in self.__species_list])
-                writer.writerows(self.data())
+    if return_type in ("array", 'a'):
+        retval = _gather(retval, len(jobs), n)
+        assert len(retval) == len(jobs) == 1
+        return [data for data in retval[0] if data is not None]
+    elif return_type in ("dataframe", 'd', "xarray", 'x') and shared is not None:
+        for _ in retval:
+            pass
+        # Rows are already in the order of task ids. Just take views.
+        times, block = shared.array()[0, :, 0], shared.array()[:, :, 1: ]
+    elif return_type in ("dataframe", 'd', "xarray", 'x'):
+        import numpy
+
+        # Pack time courses into a single block in the order of task ids.
+        block = None
+        for _, task_id, data in retval:
+            data = numpy.asarray(data, numpy.float64)
+            if block is None:
+                times = data[:, 0].copy()
+                block = numpy.empty((n, ) + data[:, 1: ].shape, numpy.float64)
+            block[task_id - 1] = data[:, 1: ]
+        if rtol is not None:
+            block = block[: convergence.count()]
+    else:
+        # Trajectories are aggregated as they arrive, and never kept all at once.
+        stats = aggregation.RunningStatistics(reservoir=reservoir)
+        for _, _, data in retval:
+            stats.add(data)
 
     if return_type in ("matplotlib", 'm'):
         if isinstance(opt_args, (list, tuple)):
             ecell4.util.viz.plot_number_observer_with_matplotlib(
-                DummyObserver(retval[0], species_list, errorbar), *opt_args, **opt_kwargs)
+                DummyObserver(stats, species_list, errorbar), *opt_args, **opt_kwargs)
         elif isinstance(opt_args, dict):
             # opt_kwargs is ignored
             ecell4.util.viz.plot_number_observer_with_matplotlib(
-                DummyObserver(retval[0], species_list, errorbar), **opt_args)
+                DummyObserver(stats, species_list, errorbar), **opt_args)
         else:
             raise ValueError('opt_args [{}] must be list or dict.'.format(
                 repr(opt_args)))
     elif return_type in ("nyaplot", 'n'):
         if isinstance(opt_args, (list, tuple)):
             ecell4.util.viz.plot_number_observer_with_nya(
-                DummyObserver(retval[0], species_list, errorbar), *opt_args, **opt_kwargs)
+                DummyObserver(stats, species_list, errorbar), *opt_args, **opt_kwargs)
         elif isinstance(opt_args, dict):
             # opt_kwargs is ignored
             ecell4.util.viz.plot_number_observer_with_nya(
-                DummyObserver(retval[0], species_list, errorbar), **opt_args)
+                DummyObserver(stats, species_list, errorbar), **opt_args)
         else:
             raise ValueError('opt_args [{}] must be list or dict.'.format(
                 repr(opt_args)))
     elif return_type in ("observer", 'o'):
-        return DummyObserver(retval[0], species_list, errorbar)
+        return DummyObserver(stats, species_list, errorbar)
     elif return_type in ("dataframe", 'd'):
-        import pandas
-        return [
-            pandas.concat([
-                pandas.DataFrame(dict(Time=numpy.array(data).T[0],
-                                      Value=numpy.array(data).T[i + 1],
-                                      Species=serial))
-                for i, serial in enumerate(species_list)])
-            for data in retval[0]]
+        return aggregation.to_dataframe(times, block, species_list, **opt_kwargs)
+    elif return_type in ("xarray", 'x'):
+        return aggregation.to_xarray(times, block, species_list)
+    else:
+        raise ValueError(
+            'An invald value for "return_type" was given [{}].'.format(str(return_type))
+            + 'Use "none" if you need nothing to be returned.')
+
+def _sweep_points(param_grid, sampling='grid', samples=None, seed=None):
+    import numpy
+
+    names = list(param_grid.keys())
+    if len(names) == 0:
+        raise ValueError("No parameter was given.")
+
+    if sampling == 'grid':
+        levels = [numpy.asarray(param_grid[name], numpy.float64).ravel() for name in names]
+        points = numpy.array(list(itertools.product(*levels)), numpy.float64).reshape(-1, len(names))
+        return (names, points, levels)
+    elif sampling in ('latin', 'lhs'):
+        if samples is None or samples < 1:
+            raise ValueError("A number of 'samples' must be given for Latin hypercube sampling.")
+        bounds = numpy.array([param_grid[name] for name in names], numpy.float64)
+        if bounds.shape != (len(names), 2):
+            raise ValueError("Give a pair of the lower and upper bound for each parameter.")
+        rng = numpy.random.RandomState(seed)
+        # Each parameter takes one value from each of `samples` equal strata in a random order.
+        strata = numpy.argsort(rng.random_sample((samples, len(names))), axis=0)
+        u = (strata + rng.random_sample((samples, len(names)))) / samples
+        return (names, bounds[:, 0] + u * (bounds[:, 1] - bounds[:, 0]), None)
+    raise ValueError('Argument "sampling" must be one of "grid" and "latin" [{}].'.format(sampling))
+
+def _with_rate_constants(model, ks):
+    newmodel = type(model)()
+    for sp in model.species_attributes():
+        newmodel.add_species_attribute(sp)
+    for i, rr in enumerate(model.reaction_rules()):
+        if i in ks:
+            rr.set_k(ks[i])
+        newmodel.add_reaction_rule(rr)
+    return newmodel
+
+def sweep_simulations(
+    param_grid, t, y0=None, volume=1.0, model=None, solver='ode',
+    is_netfree=False, species_list=None, without_reset=False,
+    return_type='xarray', structures=None, rndseed=None,
+    n=1, nproc=None, method=None, sampling='grid', samples=None, cache=None,
+    metrics=None, **kwargs):
+    """
+    Run an ensemble of simulations at each point of a parameter space,
+    and return the result indexed by parameter values, run and time.
+    All the simulations are submitted at once as jobs of a single request,
+    a job for each point.
+    Arguments are almost same with `ensemble_simulations`.
+
+    Parameters
+    ----------
+    param_grid : dict
+        A dict from the name of a parameter to its values.
+        A name is 'volume', a serial of Species for its initial value in `y0`,
+        or 'k' followed by an index of a reaction rule in the model (0-origin)
+        for its rate constant, e.g. 'k0'.
+        When sampling='grid', values are a list of values, and the result
+        covers their product. When sampling='latin', values are
+        a pair of the lower and upper bound.
+    return_type : str, optional
+        'xarray', 'dataframe', 'array' or 'none'. 'xarray' for default.
+    n : int, optional
+        A number of runs at each point. Default is 1.
+    rndseed : SeedSequence or int, optional
+        A seed for the random number generation. The i-th run at the j-th point
+        is seeded with `SeedSequence.seed(j, i)`. Points of Latin hypercube
+        sampling are drawn with `SeedSequence.seed(0)`. Seeds given by `genseeds`
+        are not supported, and raise ValueError.
+        Default is None, which means a new SeedSequence.
+    method : str or Backend, optional
+        The way for running multiple jobs.
+        Choose one from 'serial', 'threads', 'multiprocessing', 'sge', 'slurm', 'azure',
+        or a backend registered in `ecell4.extra.backends`.
+        Default is None, which works as 'serial'.
+    sampling : str, optional
+        'grid' for the product of given values, or 'latin'
+        for Latin hypercube sampling in given bounds. 'grid' for default.
+    samples : int, optional
+        A number of points for Latin hypercube sampling.
+    cache : str, optional
+        A directory to keep results of each run persistently.
+        See `ensemble_simulations`.
+    metrics : str or Recorder, optional
+        A path to a metrics file, or an `ecell4.extra.telemetry.Recorder`.
+        See `ensemble_simulations`.
+    **kwargs : dict, optional
+        Optional keyword arugments are passed through to `run_serial`,
+        `run_sge`, or `run_multiprocessing`.
+        `wait=False` just submits jobs, and requires `return_type='none'`.
+
+    Returns
+    -------
+    value : xarray.DataArray, pandas.DataFrame, list or None
+        When ``return_type`` is 'xarray', return a xarray.DataArray
+        with dimensions (*parameters, 'run', 'time', 'species') for a grid,
+        or ('sample', 'run', 'time', 'species') for Latin hypercube sampling,
+        where each parameter is a coordinate along 'sample'.
+        When ``return_type`` is 'dataframe', return a single tidy
+        pandas.DataFrame with a column for each parameter, Run, Time, Species and Value.
+        When ``return_type`` is 'array', return a list of time courses
+        for each point in the order of points.
+        Return nothing if else.
+
+    Examples
+    --------
+    >>> with reaction_rules():  # doctest: +SKIP
+    ...     A + B == C | (0.01, 0.3)
+    ...
+    >>> arr = sweep_simulations(  # doctest: +SKIP
+    ...     {'k0': [0.01, 0.02, 0.05], 'C': [30, 60]}, 10.0, {'C': 60},
+    ...     solver='gillespie', n=10, method='multiprocessing')
+    >>> arr.sel(k0=0.02, C=60, species='A').mean('run')  # doctest: +SKIP
+
+    See Also
+    --------
+    ecell4.extra.ensemble.ensemble_simulations
+
+    """
+    import numpy
+
+    y0 = y0 or {}
+    structures = structures or {}
+
+    if model is None:
+        model = ecell4.util.decorator.get_model(is_netfree, without_reset)
+
+    if isinstance(model, ecell4.ode.ODENetworkModel):
+        raise ValueError('A model with ratelaws is not supported yet.')
+
+    if species_list is None:
+        species_list = ecell4.util.simulation.list_species(model, y0.keys())
+
+    if isinstance(rndseed, bytes):
+        # Seeds of genseeds are given for task ids only, and would be shared by points.
+        raise ValueError(
+            "'rndseed' must be a SeedSequence or int for a sweep. Seeds given by 'genseeds' are not supported.")
+    myseed = _seed_sequence(rndseed, n, cache)
+    seed = myseed.seed(0)
+    names, points, levels = _sweep_points(param_grid, sampling, samples, seed)
+
+    rates = {}
+    for name in names:
+        if name == 'volume' or name in y0 or name in species_list:
+            continue
+        mobj = re.match(r'^k(\d+)$', name)
+        if mobj is None:
+            raise ValueError(
+                "An unknown parameter [{}] was given. Use 'volume', a serial of Species, or 'k' with an index of a reaction rule.".format(name))
+        rates[name] = int(mobj.group(1))
+        if rates[name] >= len(model.reaction_rules()):
+            raise ValueError("No reaction rule is at [{}].".format(name))
+
+    backend = backends.get_backend(method)
+    imap = backend.submit
+
+    if kwargs.get('wait', True) is False and return_type not in (None, "none"):
+        # 'sge' and 'slurm' just submit jobs, and no result is returned.
+        raise ValueError("Jobs are just submitted with wait=False. Give return_type='none'.")
+
+    model_ref = None
+    if backend.supports_shared_memory and kwargs.get('share', True):
+        if len(rates) == 0:
+            # All the points share the same model.
+            model_ref = procpool.Shared(model)
+            imap = functools.partial(_imap_shared, imap, model, model_ref)
+        kwargs['share'] = True
+
+    jobs = []
+    for values in points:
+        job = {'t': t, 'y0': dict(y0), 'volume': volume, 'model': model, 'solver': solver, 'species_list': species_list, 'structures': structures, 'myseed': myseed}
+        ks = {}
+        for name, value in zip(names, map(float, values)):
+            if name in rates:
+                ks[rates[name]] = value
+            elif name == 'volume':
+                job['volume'] = value
+            else:
+                job['y0'][name] = value
+        if len(ks) > 0:
+            job['model'] = _with_rate_constants(model, ks)
+        jobs.append(job)
+
+    get_logger().info("Sweep {:d} points with {:d} runs each.".format(len(jobs), n))
+
+    recorder = _recorder(metrics, kwargs)
+
+    shared = None
+    if (backend.supports_shared_memory and cache is None and recorder is None and 'out' not in kwargs
+            and return_type in ('xarray', 'x', 'dataframe', 'd') and procpool.SharedArray.available()):
+        num_times = _num_time_points(t)
+        if num_times is not None:
+            shared = procpool.SharedArray((len(jobs) * n, num_times, len(species_list) + 1))
+            kwargs['out'] = shared
+
+    if cache is None:
+        retval = imap(singlerun, jobs, n=n, nproc=nproc, **kwargs)
     else:
+        retval = imap_cached(imap, singlerun, jobs, n=n, root=cache, nproc=nproc, **kwargs)
+
+    if model_ref is not None:
+        retval = _finalize(retval, model_ref.remove)
+
+    if recorder is not None:
+        retval = _finalize(retval, lambda: _report(recorder))
+
+    if return_type is None or return_type in ("none", ):
+        for _ in retval:
+            pass
+        return
+    elif return_type in ("array", 'a'):
+        return _gather(retval, len(jobs), n)
+    elif return_type not in ('xarray', 'x', 'dataframe', 'd'):
         raise ValueError(
             'An invald value for "return_type" was given [{}].'.format(str(return_type))
             + 'Use "none" if you need nothing to be returned.')
 
+    import ecell4.extra.aggregation as aggregation
+
+    if shared is not None:
+        for _ in retval:
+            pass
+        # Rows are in the order of job and task ids.
+        times = shared.array()[0, :, 0]
+        block = shared.array()[:, :, 1: ].reshape((len(jobs), n) + shared.array().shape[1: 2] + (len(species_list), ))
+    else:
+        block = None
+        for job_id, task_id, data in retval:
+            data = numpy.asarray(data, numpy.float64)
+            if block is None:
+                times = data[:, 0].copy()
+                block = numpy.empty((len(jobs), n) + data[:, 1: ].shape, numpy.float64)
+            block[job_id - 1, task_id - 1] = data[:, 1: ]
+
+    if return_type in ("xarray", 'x'):
+        return aggregation.to_sweep_xarray(names, points, times, block, species_list, levels)
+    return aggregation.to_sweep_dataframe(names, points, times, block, species_list)
 
 if __name__ == "__main__":
     # def myrun(job, job_id=0, task_id=0):
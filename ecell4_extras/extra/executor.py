@@ -0,0 +1,352 @@
+"""
+`concurrent.futures.Executor` on Sun Grid Engine and Slurm.
+
+Calls submitted in a short time are packed into an indexed archive and submitted
+as a single array job. Each element evaluates its calls by `python -m` this module,
+and appends the results into a single store. A single watcher thread reads the stores
+of all the array jobs, and resolves futures in bulk as results are written.
+The scheduler is asked once every `interval` seconds for all the array jobs at once
+to detect failures. Functions are shipped by `ecell4.extra.worker.dumps_target`,
+i.e. by the name, or with cloudpickle for lambdas and closures.
+Arguments and results must be picklable.
+
+Examples
+--------
+>>> from ecell4.extra.executor import SGEExecutor
+>>> with SGEExecutor(path='.tmp') as executor:  # doctest: +SKIP
+...     futures = [executor.submit(pow, 2, i) for i in range(10)]
+...     print([f.result() for f in futures])
+...     print(list(executor.map(pow, [2, 3], [4, 5])))
+
+"""
+import os
+import os.path
+import sys
+import time
+import pickle
+import tempfile
+import threading
+import traceback
+import concurrent.futures
+import logging
+
+from . import sge
+from . import slurm
+from . import bundle
+from . import watcher
+from . import worker
+
+
+def get_logger():
+    return logging.getLogger('executor')
+
+class ClusterExecutor(concurrent.futures.Executor):
+    """
+    A base class of executors submitting calls as array jobs.
+    Subclasses give `scheduler`, a module with the same interface with
+    `ecell4.extra.sge`, and `task_id_env`, an environment variable
+    giving the index of an element of an array job.
+
+    """
+
+    scheduler = None
+    task_id_env = None
+    prefix = 'executor-'
+
+    def __init__(self, path='.', max_workers=None, interval=10, delay=0.5, poll=1.0,
+                 delete=True, environ=None, extra_args=None, python='python3'):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            A directory shared with the computing nodes, where scripts,
+            inputs and results are written. '.' for default.
+        max_workers : int, optional
+            A maximum number of tasks running at once for each array job.
+            If nothing is given, no limit.
+        interval : float, optional
+            An interval in seconds to ask the scheduler for failed jobs.
+            10 for default.
+        delay : float, optional
+            Seconds to wait for more calls before submitting an array job.
+            Calls submitted within the delay share an array job. 0.5 for default.
+        poll : float, optional
+            A maximum interval in seconds to check results. 1 for default.
+        delete : bool, optional
+            Whether it removes scripts, inputs, results and outputs, or not.
+            True for default.
+        environ : dict, optional
+            Environment variables exported in jobs. If nothing is given,
+            LD_LIBRARY_PATH and PYTHONPATH (with the current directory) are exported.
+        extra_args : list, optional
+            Arguments passed to the submission command.
+        python : str, optional
+            A Python interpreter on the computing nodes. 'python3' for default.
+
+        """
+        if self.scheduler is None:
+            raise RuntimeError("ClusterExecutor cannot be used directly. Use SGEExecutor or SlurmExecutor.")
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        if environ is None:
+            environ = dict((key, os.environ[key]) for key in ("LD_LIBRARY_PATH", "PYTHONPATH") if key in os.environ)
+            environ["PYTHONPATH"] = ':'.join(x for x in (os.getcwd(), environ.get("PYTHONPATH", "").strip()) if x != "")
+
+        self.__path = path
+        self.__max_workers = max_workers
+        self.__interval = interval
+        self.__delay = delay
+        self.__poll = poll
+        self.__delete = delete
+        self.__environ = environ
+        self.__extra_args = extra_args
+        self.__python = python
+
+        self.__lock = threading.Lock()
+        self.__buffer = []
+        self.__deadline = None
+        self.__batches = []
+        self.__thread = None
+        self.__shutdown = False
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule the call `fn(*args, **kwargs)`, and return a Future.
+        The call is submitted with others given within `delay` seconds.
+
+        """
+        with self.__lock:
+            if self.__shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            future = concurrent.futures.Future()
+            if len(self.__buffer) == 0:
+                self.__deadline = time.time() + self.__delay
+            self.__buffer.append((future, fn, args, kwargs))
+            self.__start()
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        """
+        Return an iterator equivalent to `map(fn, *iterables)`.
+        All the calls are submitted at once as a single array job,
+        whose element evaluates `chunksize` calls in a row.
+
+        """
+        end_time = (time.monotonic() + timeout) if timeout is not None else None
+        calls = [(concurrent.futures.Future(), fn, args, {}) for args in zip(*iterables)]
+        with self.__lock:
+            if self.__shutdown:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            self.__flush()
+            self.__submit_batch(calls, chunksize)
+            self.__start()
+        fs = [future for future, _, _, _ in calls]
+
+        def result_iterator():
+            try:
+                fs.reverse()
+                while fs:
+                    if end_time is None:
+                        yield fs.pop().result()
+                    else:
+                        yield fs.pop().result(end_time - time.monotonic())
+            finally:
+                for future in fs:
+                    future.cancel()
+        return result_iterator()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        Submit calls left in the buffer, and stop accepting new calls.
+        If `wait`, block until all the futures are resolved and
+        the array jobs are cleaned up.
+        If `cancel_futures`, calls not submitted yet are cancelled instead.
+
+        """
+        with self.__lock:
+            self.__shutdown = True
+            if cancel_futures:
+                for future, _, _, _ in self.__buffer:
+                    future.cancel()
+                self.__buffer = []
+            thread = self.__thread
+        if wait and thread is not None:
+            thread.join()
+
+    def __start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__watch, daemon=True)
+            self.__thread.start()
+
+    def __flush(self):
+        if len(self.__buffer) > 0:
+            (calls, self.__buffer) = (self.__buffer, [])
+            self.__submit_batch(calls, 1)
+
+    def __submit_batch(self, calls, chunksize):
+        calls = [call for call in calls if call[0].set_running_or_notify_cancel()]
+        if len(calls) == 0:
+            return
+        futures = [future for future, _, _, _ in calls]
+        chunksize = max(1, chunksize or 1)
+
+        (fd, bundlefile) = tempfile.mkstemp(suffix='.bundle', prefix=self.prefix, dir=self.__path)
+        os.close(fd)
+        storefile = '{}.results'.format(bundlefile)
+        try:
+            specs = {}
+            for _, fn, _, _ in calls:
+                if id(fn) not in specs:
+                    specs[id(fn)] = worker.dumps_target(fn)
+            bundle.write_inputs(bundlefile, [(specs[id(fn)], args, kwargs) for _, fn, args, kwargs in calls])
+
+            cmd = '#!/bin/bash\n'
+            for key, value in self.__environ.items():
+                cmd += 'export {:s}={:s}\n'.format(key, value)
+            cmd += '{} -m {} {} {} {:d} {:d} {}\n'.format(
+                self.__python, __name__, bundlefile, storefile, chunksize, len(calls), self.task_id_env)
+
+            num_elements = -(-len(calls) // chunksize)  # ceil for int
+            submitted = self.scheduler.singlerun(
+                cmd, num_elements, self.__path, 0, self.__delete, self.__extra_args, self.__max_workers)
+        except Exception as err:
+            for future in futures:
+                future.set_exception(err)
+            if os.path.isfile(bundlefile):
+                os.remove(bundlefile)
+            return
+
+        get_logger().info("{:d} calls were submitted as job {}.".format(len(calls), submitted[0]))
+        self.__batches.append(dict(
+            submitted=submitted, num_elements=num_elements, futures=futures,
+            pending=set(range(len(futures))), bundlefile=bundlefile,
+            reader=bundle.ResultReader(storefile)))
+
+    def __read(self, batch):
+        for key, (ok, value) in batch['reader'].read():
+            if key not in batch['pending']:
+                continue  # Written twice by a retried task
+            batch['pending'].remove(key)
+            if ok:
+                batch['futures'][key].set_result(value)
+            else:
+                batch['futures'][key].set_exception(value)
+
+    def __clean(self, batch):
+        (jobid, name, filename) = batch['submitted']
+        try:
+            outputs = self.scheduler.collect(
+                jobid, name, n=batch['num_elements'], path=self.__path, delete=self.__delete)
+        except IOError as err:
+            get_logger().warning("Failed to collect outputs of job {}: {}".format(jobid, str(err)))
+        else:
+            for output in outputs:
+                print(output, end='')
+
+        if self.__delete:
+            for tmpname in (batch['bundlefile'], batch['reader'].filename(), filename):
+                if os.path.isfile(tmpname):
+                    os.remove(tmpname)
+
+    def __watch(self):
+        w = watcher.DirectoryWatcher(self.__path, poll=self.__poll)
+        last_checked = time.time()
+        try:
+            while True:
+                with self.__lock:
+                    if len(self.__buffer) > 0 and (self.__shutdown or time.time() >= self.__deadline):
+                        self.__flush()
+                    batches = list(self.__batches)
+                    if self.__shutdown and len(self.__buffer) == 0 and len(batches) == 0:
+                        break
+
+                for batch in batches:
+                    self.__read(batch)
+
+                if len(batches) > 0 and time.time() - last_checked >= self.__interval:
+                    try:
+                        alive = self.scheduler.running([batch['submitted'][0] for batch in batches])
+                    except Exception as err:
+                        get_logger().error("Failed to ask the scheduler: {}".format(str(err)))
+                        alive = None
+                    last_checked = time.time()
+
+                    for batch in batches:
+                        if alive is None or batch['submitted'][0] in alive:
+                            continue
+                        # Read once more not to miss results written in the meantime
+                        self.__read(batch)
+                        for key in sorted(batch['pending']):
+                            batch['futures'][key].set_exception(RuntimeError(
+                                "Job {} finished, but no result was found for the call.".format(batch['submitted'][0])))
+                        batch['pending'].clear()
+                        self.__clean(batch)
+                        with self.__lock:
+                            self.__batches.remove(batch)
+
+                with self.__lock:
+                    if len(self.__buffer) > 0:
+                        timeout = min(self.__poll, max(0.0, self.__deadline - time.time()))
+                    elif any(len(batch['pending']) > 0 for batch in self.__batches):
+                        timeout = self.__poll
+                    else:
+                        # Only waiting for the scheduler to release jobs
+                        timeout = min(self.__poll, max(0.0, self.__interval - (time.time() - last_checked)))
+                w.wait(timeout)
+        finally:
+            w.close()
+
+class SGEExecutor(ClusterExecutor):
+    """
+    An executor submitting calls to Sun Grid Engine as array jobs.
+
+    See Also
+    --------
+    ecell4.extra.executor.ClusterExecutor
+
+    """
+
+    scheduler = sge
+    task_id_env = 'SGE_TASK_ID'
+    prefix = 'sge-'
+
+class SlurmExecutor(ClusterExecutor):
+    """
+    An executor submitting calls to Slurm as array jobs.
+
+    See Also
+    --------
+    ecell4.extra.executor.ClusterExecutor
+
+    """
+
+    scheduler = slurm
+    task_id_env = 'SLURM_ARRAY_TASK_ID'
+    prefix = 'slurm-'
+
+def main(bundlefile, storefile, chunksize, count, element):
+    """
+    Evaluate calls of an element (1-origin) of an array job,
+    and append their results into the store.
+
+    """
+    for key in range((element - 1) * chunksize, min(element * chunksize, count)):
+        (spec, args, kwargs) = bundle.read_input(bundlefile, key)
+        try:
+            fn = worker.loads_target(spec)
+            record = (True, fn(*args, **kwargs))
+        except Exception as err:
+            traceback.print_exc()
+            record = (False, err)
+        try:
+            bundle.append_result(storefile, key, record)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            bundle.append_result(storefile, key, (False, RuntimeError(
+                "The result of the call is not picklable:\n{}".format(traceback.format_exc()))))
+
+
+if __name__ == "__main__":
+    (bundlefile, storefile, chunksize, count, task_id_env) = sys.argv[1: 6]
+    main(bundlefile, storefile, int(chunksize), int(count), int(os.environ[task_id_env]))
@@ -0,0 +1,379 @@
+"""
+A local stand-in for Sun Grid Engine and Slurm.
+
+Fake `qsub`, `qstat`, `qdel`, `sbatch`, `squeue` and `scancel` commands are
+written into a directory, which is given to `rcParams["PREFIX"]` of
+`ecell4.extra.sge` and `ecell4.extra.slurm`. Array jobs are run by a detached
+process on the local machine with a limited number of slots, with an optional
+queue latency and failure injection.
+This allows to exercise and benchmark `run_sge` and `run_slurm` without a scheduler.
+
+Examples
+--------
+>>> from ecell4.extra.localcluster import LocalCluster
+>>> with LocalCluster(slots=4, latency=1.0, failure=0.05):  # doctest: +SKIP
+...     run_sge(target, jobs, n=10, path='.tmp')
+
+"""
+import os
+import os.path
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import getpass
+import tempfile
+import subprocess
+import logging
+import concurrent.futures
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import sge
+from . import slurm
+
+
+def get_logger():
+    return logging.getLogger('localcluster')
+
+COMMANDS = {
+    'qsub': 'sge', 'qstat': 'sge', 'qdel': 'sge',
+    'sbatch': 'slurm', 'squeue': 'slurm', 'scancel': 'slurm'}
+
+class LocalCluster(object):
+    """
+    A local cluster emulating Sun Grid Engine and Slurm commands.
+    Used as a context manager, `rcParams` of `ecell4.extra.sge` and
+    `ecell4.extra.slurm` point to the fake commands in it.
+
+    """
+
+    def __init__(self, path=None, slots=None, latency=0.0, failure=0.0, seed=None):
+        """
+        Parameters
+        ----------
+        path : str, optional
+            A directory to keep the commands and the state of jobs.
+            If nothing is given, a temporary directory is created and
+            removed when closed.
+        slots : int, optional
+            A number of tasks running at once through all the jobs.
+            If nothing is given, the number of cores is used.
+        latency : float, optional
+            Seconds each job waits in the queue before its tasks start.
+            0 for default.
+        failure : float, optional
+            A probability that a task fails without running its script.
+            0 for default.
+        seed : int, optional
+            A seed to decide which tasks fail.
+
+        """
+        self.__temporary = path is None
+        self.__path = tempfile.mkdtemp(prefix='localcluster-') if path is None else path
+        self.__config = dict(
+            slots=slots or os.cpu_count() or 1, latency=latency, failure=failure, seed=seed)
+        self.__saved = None
+        self.install()
+
+    def __enter__(self):
+        self.__saved = [(m.rcParams, dict(m.rcParams)) for m in (sge, slurm)]
+        for m, names in ((sge, ('qsub', 'qstat', 'qdel')), (slurm, ('sbatch', 'squeue', 'scancel'))):
+            m.rcParams["PREFIX"] = self.prefix()
+            m.rcParams["QSUB"], m.rcParams["QSTAT"], m.rcParams["QDEL"] = names
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        for params, saved in self.__saved:
+            params.clear()
+            params.update(saved)
+        self.close()
+        return False
+
+    def path(self):
+        return self.__path
+
+    def prefix(self):
+        """Return a directory of the fake commands."""
+        return os.path.join(self.__path, 'bin')
+
+    def config(self):
+        return dict(self.__config)
+
+    def install(self):
+        """Write the fake commands and the configuration."""
+        for dirname in ('bin', 'jobs', 'slots'):
+            if not os.path.isdir(os.path.join(self.__path, dirname)):
+                os.makedirs(os.path.join(self.__path, dirname))
+        with open(os.path.join(self.__path, 'config.json'), 'w') as fout:
+            json.dump(self.__config, fout)
+
+        for command in COMMANDS.keys():
+            code = '#!{}\n'.format(sys.executable)
+            code += 'import sys\n'
+            code += 'sys.path[: 0] = {!r}\n'.format([p for p in sys.path if p != ''])
+            code += 'from {} import main\n'.format(__name__)
+            code += 'sys.exit(main({!r}, {!r}, sys.argv[1: ]))\n'.format(
+                os.path.abspath(self.__path), command)
+            filename = os.path.join(self.prefix(), command)
+            with open(filename, 'w') as fout:
+                fout.write(code)
+            os.chmod(filename, 0o755)
+
+    def jobs(self):
+        """Return a list of ids of jobs not finished yet."""
+        return sorted(jobid for jobid in _list_jobs(self.__path) if _is_alive(self.__path, jobid))
+
+    def close(self):
+        """Stop all the jobs, and remove the directory if temporary."""
+        for jobid in self.jobs():
+            _cancel(self.__path, jobid)
+        if self.__temporary:
+            shutil.rmtree(self.__path, ignore_errors=True)
+
+def _jobdir(state, jobid):
+    return os.path.join(state, 'jobs', str(jobid))
+
+def _list_jobs(state):
+    return [int(name) for name in os.listdir(os.path.join(state, 'jobs')) if name.isdigit()]
+
+def _is_alive(state, jobid):
+    jobdir = _jobdir(state, jobid)
+    if os.path.isfile(os.path.join(jobdir, 'done')):
+        return False
+    try:
+        with open(os.path.join(jobdir, 'pid')) as fin:
+            pid = int(fin.read())
+    except (IOError, ValueError):
+        return True  # Being submitted
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False  # The runner died
+    return True
+
+def _lock(filename, blocking=True):
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except (IOError, OSError):
+            os.close(fd)
+            return None
+    return fd
+
+def _next_jobid(state):
+    fd = _lock(os.path.join(state, 'lock'))
+    try:
+        jobid = max(_list_jobs(state) or [0]) + 1
+        os.makedirs(_jobdir(state, jobid))
+    finally:
+        os.close(fd)
+    return jobid
+
+def _task_states(state, jobid, n):
+    """Return a dict of states, 'qw', 'r' or None (finished), of tasks."""
+    names = set(os.listdir(_jobdir(state, jobid)))
+    retval = {}
+    for k in range(1, n + 1):
+        if 'finished.{:d}'.format(k) in names:
+            retval[k] = None
+        elif 'running.{:d}'.format(k) in names:
+            retval[k] = 'r'
+        else:
+            retval[k] = 'qw'
+    return retval
+
+def _submit(state, flavor, args):
+    values = {}
+    i = 0
+    while i < len(args) - 1:
+        if args[i] in ('-e', '-o', '-t', '-tc', '-a', '-N', '-J'):
+            values[args[i]] = args[i + 1]
+            i += 2
+        else:
+            i += 1  # Options not emulated are ignored
+    script = os.path.abspath(args[-1])
+
+    if flavor == 'sge':
+        (lo, hi) = (int(x) for x in values.get('-t', '1-1').split(':')[0].split('-'))
+        tc = int(values['-tc']) if '-tc' in values else None
+        name = values.get('-N', os.path.basename(script))
+    else:
+        array, _, tc = values.get('-a', '1-1').partition('%')
+        (lo, hi) = (int(x) for x in array.split('-'))
+        tc = int(tc) if tc != '' else None
+        name = values.get('-J', os.path.basename(script))
+    if lo != 1:
+        raise ValueError("Only an array starting from 1 is supported [{:d}].".format(lo))
+
+    jobid = _next_jobid(state)
+    spec = dict(
+        flavor=flavor, jobid=jobid, name=name, script=script, n=hi, tc=tc, cwd=os.getcwd(),
+        output=values.get('-o', '.'), error=values.get('-e', '.'), submitted=time.time())
+    with open(os.path.join(_jobdir(state, jobid), 'spec.json'), 'w') as fout:
+        json.dump(spec, fout)
+
+    proc = subprocess.Popen(
+        [sys.executable, sys.argv[0], '--run-array', str(jobid)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+    with open(os.path.join(_jobdir(state, jobid), 'pid'), 'w') as fout:
+        fout.write(str(proc.pid))
+
+    if flavor == 'sge':
+        print('Your job-array {:d}.1-{:d}:1 ("{}") has been submitted'.format(jobid, hi, name))
+    else:
+        print('Submitted batch job {:d}'.format(jobid))
+    return 0
+
+def _output_filename(spec, pattern, kind, k):
+    if spec['flavor'] == 'sge':
+        filename = os.path.join(pattern, '{}.{}{:d}.{:d}'.format(spec['name'], kind, spec['jobid'], k))
+    else:
+        filename = pattern.replace('%A', str(spec['jobid'])).replace('%a', str(k))
+    return os.path.join(spec['cwd'], filename)
+
+def _acquire_slot(state, slots):
+    while True:
+        for i in range(slots):
+            fd = _lock(os.path.join(state, 'slots', str(i)), blocking=False)
+            if fd is not None:
+                return fd
+        time.sleep(0.05)
+
+def _run_array(state, jobid):
+    """Run all the tasks of an array job. This is called in a detached process."""
+    jobdir = _jobdir(state, jobid)
+    with open(os.path.join(state, 'config.json')) as fin:
+        config = json.load(fin)
+    with open(os.path.join(jobdir, 'spec.json')) as fin:
+        spec = json.load(fin)
+
+    n = spec['n']
+    rng = random.Random(None if config['seed'] is None else config['seed'] + jobid)
+    failed = set(k for k in range(1, n + 1) if rng.random() < config['failure'])
+
+    env = dict(os.environ)
+    if spec['flavor'] == 'sge':
+        (task_id_env, env['JOB_ID']) = ('SGE_TASK_ID', str(jobid))
+    else:
+        (task_id_env, env['SLURM_ARRAY_JOB_ID']) = ('SLURM_ARRAY_TASK_ID', str(jobid))
+
+    def run_task(k):
+        fd = _acquire_slot(state, config['slots'])
+        try:
+            open(os.path.join(jobdir, 'running.{:d}'.format(k)), 'w').close()
+            with open(_output_filename(spec, spec['output'], 'o', k), 'w') as fout, \
+                    open(_output_filename(spec, spec['error'], 'e', k), 'w') as ferr:
+                if k in failed:
+                    ferr.write('Task {:d} of job {:d} failed (injected).\n'.format(k, jobid))
+                else:
+                    subprocess.call(
+                        ['bash', spec['script']], cwd=spec['cwd'], stdout=fout, stderr=ferr,
+                        env=dict(env, **{task_id_env: str(k)}))
+        finally:
+            os.rename(
+                os.path.join(jobdir, 'running.{:d}'.format(k)),
+                os.path.join(jobdir, 'finished.{:d}'.format(k)))
+            os.close(fd)  # This also releases the slot
+
+    try:
+        time.sleep(config['latency'])
+        with concurrent.futures.ThreadPoolExecutor(min(spec['tc'] or n, n)) as executor:
+            list(executor.map(run_task, range(1, n + 1)))
+    finally:
+        open(os.path.join(jobdir, 'done'), 'w').close()
+    return 0
+
+def _status(state, flavor):
+    user = getpass.getuser()
+    if flavor == 'sge':
+        print('job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID')
+        print('-' * 128)
+    else:
+        print('             JOBID PARTITION     NAME     USER ST       TIME  NODES NODELIST(REASON)')
+
+    for jobid in sorted(_list_jobs(state)):
+        if not _is_alive(state, jobid):
+            continue
+        try:
+            with open(os.path.join(_jobdir(state, jobid), 'spec.json')) as fin:
+                spec = json.load(fin)
+        except (IOError, ValueError):
+            continue  # Being submitted
+        if spec['flavor'] != flavor:
+            continue
+
+        tasks = _task_states(state, jobid, spec['n'])
+        date = time.strftime('%m/%d/%Y %H:%M:%S', time.localtime(spec['submitted']))
+        for k, st in sorted(tasks.items()):
+            if st is None:
+                continue
+            elif flavor == 'sge':
+                print('{:7d} 0.55500 {:10s} {:12s} {:5s} {} {:30s} {:5d} {:d}'.format(
+                    jobid, spec['name'][: 10], user, st, date,
+                    'all.q@localhost' if st == 'r' else '', 1, k))
+            else:
+                print('{:>18s} {:>9s} {:>8s} {:>8s} {:>2s} {:>10s} {:>6d} {}'.format(
+                    '{:d}_{:d}'.format(jobid, k), 'local', spec['name'][: 8], user[: 8],
+                    'R' if st == 'r' else 'PD', '0:00', 1,
+                    'localhost' if st == 'r' else '(Priority)'))
+    return 0
+
+def _cancel(state, jobid):
+    jobdir = _jobdir(state, jobid)
+    if not os.path.isdir(jobdir):
+        return False
+    elif not _is_alive(state, jobid):
+        return True
+    try:
+        with open(os.path.join(jobdir, 'pid')) as fin:
+            os.killpg(int(fin.read()), signal.SIGTERM)
+    except (IOError, OSError, ValueError):
+        pass  # Already finished
+    open(os.path.join(jobdir, 'done'), 'w').close()
+    return True
+
+def main(state, command, args):
+    """
+    An entry point of the fake commands.
+
+    Parameters
+    ----------
+    state : str
+        A directory of the local cluster.
+    command : str
+        A name of the command, e.g. 'qsub'.
+    args : list
+        Command line arguments.
+
+    Returns
+    -------
+    status : int
+        An exit status.
+
+    """
+    if command not in COMMANDS:
+        raise ValueError("An unknown command [{}] was given.".format(command))
+    flavor = COMMANDS[command]
+
+    if len(args) == 2 and args[0] == '--run-array':
+        return _run_array(state, int(args[1]))
+    elif command in ('qsub', 'sbatch'):
+        return _submit(state, flavor, args)
+    elif command in ('qstat', 'squeue'):
+        return _status(state, flavor)
+
+    for jobid in args:
+        if not _cancel(state, int(jobid)):
+            sys.stderr.write('Job {} does not exist.\n'.format(jobid))
+            return 1
+        elif flavor == 'sge':
+            print('{} has deleted job {}'.format(getpass.getuser(), jobid))
+    return 0
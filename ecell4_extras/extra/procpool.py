@@ -0,0 +1,546 @@
+import os
+import os.path
+import multiprocessing
+import importlib
+import itertools
+import collections
+import traceback
+import logging
+import time
+import ctypes
+import copy
+import pickle
+import hashlib
+import tempfile
+import queue
+import concurrent.futures
+
+from . import worker
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None  # Python < 3.8
+
+
+def get_logger():
+    return logging.getLogger('procpool')
+
+class _TargetSpec(object):
+    """
+    A default target shipped to workers not forked, as a spec of `worker.dumps_target`,
+    i.e. its name, or a blob pickled with cloudpickle (e.g. a lambda).
+
+    """
+
+    def __init__(self, target):
+        self.spec = worker.dumps_target(target)
+
+    def restore(self):
+        return worker.loads_target(self.spec)
+
+def consumer(target, q_in, q_out, modules=(), index=0):
+    """
+    A main loop of each worker process.
+    Load the given modules once, and then evaluate chunks of tasks
+    until a poison pill (None) is received.
+    Each result is sent back with the elapsed time of the task and the worker index.
+    If a chunk comes with a shared array, results are written into it instead.
+    Arguments given as `Shared` are replaced with a shallow copy of the object.
+
+    """
+    for m in modules:
+        try:
+            importlib.import_module(m)
+        except ImportError as err:
+            get_logger().warning("Failed to import [{}]: {}".format(m, str(err)))
+
+    if isinstance(target, _TargetSpec):
+        target = target.restore()
+
+    while True:
+        val = q_in.get()
+        if val is None:
+            break
+        tag, f, chunk, out = val
+        f = f or target
+        res = []
+        shm = None
+        try:
+            if out is not None:
+                (shm, block) = SharedArray.attach(out)
+            for i, x in chunk:
+                start = time.time()
+                retval = f(*(copy.copy(a.get()) if isinstance(a, Shared) else a for a in x))
+                if shm is not None:
+                    block[i] = retval
+                    retval = None
+                res.append((i, retval, time.time() - start))
+        except Exception:
+            q_out.put((tag, index, res, (chunk[len(res)][0], traceback.format_exc())))
+        else:
+            q_out.put((tag, index, res, None))
+        finally:
+            if shm is not None:
+                del block
+                shm.close()
+
+class Pool(object):
+    """
+    A pool of long-lived worker processes.
+    Workers are started once, import the given modules in advance,
+    and can be shared by multiple calls of `run_multiprocessing`
+    or `ensemble_simulations(method='multiprocessing', pool=...)`.
+
+    Examples
+    --------
+    >>> from ecell4.extra.procpool import Pool
+    >>> with Pool(4, chunksize=10) as pool:  # doctest: +SKIP
+    ...     for k in (0.1, 0.2, 0.3):
+    ...         ensemble_simulations(..., method='multiprocessing', pool=pool)
+
+    """
+
+    def __init__(self, processes=None, chunksize=1, modules=('ecell4', ), target=None, context=None):
+        """
+        Start worker processes.
+
+        Parameters
+        ----------
+        processes : int, optional
+            A number of worker processes.
+            If nothing is given, all available cores are used.
+        chunksize : int, optional
+            A number of tasks sent to a worker at once.
+            1 for default.
+        modules : list, optional
+            A list of module names imported in each worker when it starts.
+            ('ecell4', ) for default.
+        target : function, optional
+            A default function evaluated by workers.
+            Forked workers inherit it. Otherwise, it is shipped by its name,
+            or pickled with cloudpickle, e.g. a lambda (see `worker.dumps_target`).
+            Functions given to `imap_unordered` and `map` later must be picklable.
+        context : str or multiprocessing context, optional
+            A start method of workers, e.g. 'spawn', or a context of it.
+            The default start method of `multiprocessing` for default.
+
+        """
+        self.__processes = processes or multiprocessing.cpu_count()
+        self.__chunksize = chunksize
+        self.__target = target
+        self.__counter = itertools.count()
+        self.__usage = None
+
+        if context is None or isinstance(context, str):
+            context = multiprocessing.get_context(context)
+        if target is not None and context.get_start_method() != 'fork':
+            target = _TargetSpec(target)
+        self.__q_in = context.Queue()
+        self.__q_out = context.Queue()
+        self.__workers = [
+            context.Process(
+                target=consumer, args=(target, self.__q_in, self.__q_out, tuple(modules), i), daemon=True)
+            for i in range(self.__processes)]
+        [w.start() for w in self.__workers]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+        return False
+
+    def processes(self):
+        return self.__processes
+
+    def chunksize(self):
+        return self.__chunksize
+
+    def is_alive(self):
+        return len(self.__workers) > 0 and all(w.is_alive() for w in self.__workers)
+
+    def close(self):
+        """Let workers exit after finishing the tasks already sent, and wait for them."""
+        if len(self.__workers) == 0:
+            return
+        [self.__q_in.put(None) for _ in self.__workers]  #XXX: poison pill
+        [w.join() for w in self.__workers]
+        self.__workers = []
+
+    def terminate(self):
+        """Stop workers immediately."""
+        [w.terminate() for w in self.__workers]
+        [w.join() for w in self.__workers]
+        self.__workers = []
+
+    def __get(self, cancel=None):
+        if cancel is None:
+            return self.__q_out.get()
+        while True:
+            if cancel.is_set():
+                raise concurrent.futures.CancelledError()
+            try:
+                return self.__q_out.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def imap_unordered(self, target, iterable, chunksize=None, out=None, cancel=None):
+        """
+        Evaluate the given function with each set of arguments,
+        and yield a pair of the index and result in the order of completion.
+
+        Parameters
+        ----------
+        target : function or None
+            A function to be evaluated. It must be picklable
+            unless it is the default target given at the construction.
+            If None, the default target is used.
+        iterable : iterable or LongestFirst
+            Sets of arguments passed to the function.
+            If a `LongestFirst` is given, chunks are taken from it one by one
+            and the elapsed time of each task is reported back to it.
+        chunksize : int, optional
+            A number of tasks sent to a worker at once.
+            If nothing is given, the pool's default is used.
+            Ignored when a `LongestFirst` is given.
+        out : SharedArray, optional
+            An array on shared memory. If given, workers write the result
+            of the i-th task into `out.array()[i]` directly instead of
+            sending it back, and a view of the row is yielded as the result.
+        cancel : threading.Event, optional
+            An event to stop waiting for results. When it is set,
+            `concurrent.futures.CancelledError` is raised. Tasks already sent
+            to workers are not stopped. Terminate the pool to stop them.
+
+        Yields
+        ------
+        (index, result) : tuple
+            An index of the arguments in `iterable` and its result.
+
+        """
+        if not self.is_alive():
+            raise RuntimeError("The pool is not running.")
+
+        chunksize = chunksize or self.__chunksize
+        f = None if target is None or target is self.__target else target
+        tag = next(self.__counter)
+        spec = out.spec() if out is not None else None
+
+        if isinstance(iterable, LongestFirst):
+            schedule = iterable
+            chunks = iter(schedule.next_chunk, [])
+        else:
+            schedule = None
+            tasks = enumerate(iterable)
+            chunks = iter(lambda: list(itertools.islice(tasks, chunksize)), [])
+
+        usage = [[0, 0.0] for _ in range(self.__processes)]
+        self.__usage = (time.time(), None, usage)
+
+        # Keep only a couple of chunks per worker in flight.
+        # Workers take chunks from a single shared queue as soon as they are idle.
+        num_sent = 0
+        for chunk in itertools.islice(chunks, 2 * self.__processes):
+            self.__q_in.put((tag, f, chunk, spec))
+            num_sent += 1
+
+        try:
+            while num_sent > 0:
+                (tag_, index, res, err) = self.__get(cancel)
+                if tag_ != tag:
+                    continue  # Left by an abandoned call
+                num_sent -= 1
+                usage[index][0] += len(res)
+                for i, x, elapsed in res:
+                    usage[index][1] += elapsed
+                    if schedule is not None:
+                        schedule.report(i, elapsed)
+                    yield (i, x if out is None else out.array()[i])
+                if err is not None:
+                    raise RuntimeError(
+                        "An exception was raised in a worker at the task [{}]:\n{}".format(*err))
+                for chunk in itertools.islice(chunks, 1):
+                    self.__q_in.put((tag, f, chunk, spec))
+                    num_sent += 1
+        finally:
+            if out is not None and self.is_alive() and not (cancel is not None and cancel.is_set()):
+                # Let workers finish with the shared memory before the caller releases it.
+                while num_sent > 0:
+                    if self.__q_out.get()[0] == tag:
+                        num_sent -= 1
+
+        self.__usage = (self.__usage[0], time.time(), usage)
+
+    def usage(self):
+        """
+        Return the usage of each worker in the last call of `imap_unordered`.
+
+        Returns
+        -------
+        usage : list
+            A list of (tasks, busy, utilisation) for each worker, where `tasks` is
+            a number of tasks evaluated, `busy` is seconds spent in evaluating them,
+            and `utilisation` is `busy` divided by the wall time of the call.
+
+        """
+        if self.__usage is None:
+            return []
+        (start, end, usage) = self.__usage
+        wall = (end or time.time()) - start
+        return [(tasks, busy, busy / wall if wall > 0 else 0.0) for tasks, busy in usage]
+
+    def summary(self):
+        """Return a text summarizing the usage of workers in the last call."""
+        usage = self.usage()
+        lines = ['worker {:3d}: {:6d} tasks, {:10.3f} sec busy ({:5.1f}%)'.format(
+            i, tasks, busy, utilisation * 100) for i, (tasks, busy, utilisation) in enumerate(usage)]
+        if len(usage) > 0:
+            lines.append('mean utilisation: {:5.1f}%'.format(
+                sum(u for _, _, u in usage) / len(usage) * 100))
+        return '\n'.join(lines)
+
+    def map(self, target, iterable, chunksize=None):
+        """
+        Evaluate the given function with each set of arguments,
+        and return a list of results in the order of `iterable`.
+
+        See Also
+        --------
+        ecell4.extra.procpool.Pool.imap_unordered
+
+        """
+        res = sorted(self.imap_unordered(target, iterable, chunksize), key=lambda x: x[0])
+        return [x for (_, x) in res]
+
+class Shared(object):
+    """
+    A reference to an object shared by worker processes.
+    The object is pickled only once into a file named by its fingerprint,
+    and only this reference is sent to workers with each task.
+    Each worker loads the object at the first use, and keeps it in its cache.
+    Thus, the object is deserialized once per worker, not once per task.
+
+    Examples
+    --------
+    >>> ref = Shared(model)  # doctest: +SKIP
+    >>> pool.map(target, [(ref, i) for i in range(100)])  # doctest: +SKIP
+    >>> ref.remove()  # doctest: +SKIP
+
+    """
+
+    CACHE_SIZE = 16
+
+    __cache = collections.OrderedDict()
+
+    def __init__(self, obj, path=None):
+        """
+        Parameters
+        ----------
+        obj : object
+            A picklable object.
+        path : str, optional
+            A directory for the file. It must be visible from workers.
+            If nothing is given, the default temporary directory is used.
+
+        """
+        blob = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        self.__key = hashlib.sha1(blob).hexdigest()
+        self.__filename = os.path.join(
+            path or tempfile.gettempdir(), 'procpool-{}.pickle'.format(self.__key))
+
+        if not os.path.isfile(self.__filename):
+            (fd, tmpname) = tempfile.mkstemp(dir=os.path.dirname(self.__filename))
+            with os.fdopen(fd, 'wb') as fout:
+                fout.write(blob)
+            os.rename(tmpname, self.__filename)  # Atomic, not to be read halfway
+        Shared.__store(self.__key, obj)
+
+    def __getstate__(self):
+        return (self.__key, self.__filename)
+
+    def __setstate__(self, state):
+        (self.__key, self.__filename) = state
+
+    @staticmethod
+    def __store(key, obj):
+        Shared.__cache[key] = obj
+        Shared.__cache.move_to_end(key)
+        while len(Shared.__cache) > Shared.CACHE_SIZE:
+            Shared.__cache.popitem(last=False)
+
+    def key(self):
+        """Return the fingerprint of the object."""
+        return self.__key
+
+    def get(self):
+        """Return the object, which is loaded from the file only at the first call in each process."""
+        if self.__key in Shared.__cache:
+            Shared.__cache.move_to_end(self.__key)
+            return Shared.__cache[self.__key]
+        with open(self.__filename, 'rb') as fin:
+            obj = pickle.load(fin)
+        Shared.__store(self.__key, obj)
+        return obj
+
+    def remove(self):
+        """Remove the file. Workers can no longer load the object if not cached yet."""
+        if os.path.isfile(self.__filename):
+            os.remove(self.__filename)
+
+if shared_memory is not None:
+    class _SharedMemory(shared_memory.SharedMemory):
+
+        def __del__(self):
+            try:
+                self.close()
+            except (OSError, BufferError):
+                pass  # Still exported. Unmapped when the last view is gone.
+
+class SharedArray(object):
+    """
+    An array on shared memory, into which workers of `Pool` write results directly.
+    This requires numpy and Python 3.8 or later.
+    Arrays returned by `array` are views of the memory, which is kept
+    mapped as long as any of them is alive, even after this object is gone.
+
+    Examples
+    --------
+    >>> out = SharedArray((10, 101, 3))  # doctest: +SKIP
+    >>> for i, data in pool.imap_unordered(target, X, out=out):  # doctest: +SKIP
+    ...     pass
+    >>> out.unlink()  # doctest: +SKIP
+    >>> block = out.array()  # doctest: +SKIP
+
+    """
+
+    def __init__(self, shape, dtype='float64'):
+        """
+        Parameters
+        ----------
+        shape : tuple
+            A shape of the array. The first axis is indexed by tasks.
+        dtype : str, optional
+            A data type. 'float64' for default.
+
+        """
+        import numpy
+
+        if not SharedArray.available():
+            raise RuntimeError("Shared memory is not available. This requires Python 3.8 or later.")
+
+        self.__shape = tuple(shape)
+        self.__dtype = numpy.dtype(dtype)
+        count = int(numpy.prod(self.__shape))
+        size = max(1, count * self.__dtype.itemsize)
+
+        shm = _SharedMemory(create=True, size=size)
+        buf = (ctypes.c_char * size).from_buffer(shm.buf)
+        buf.shm = shm  #XXX: Views must keep the memory mapped. numpy doesn't hold the buffer
+        self.__name = shm.name
+        self.__shm = shm
+        self.__array = numpy.frombuffer(buf, self.__dtype, count).reshape(self.__shape)
+
+    @staticmethod
+    def available():
+        return shared_memory is not None
+
+    @staticmethod
+    def attach(spec):
+        """Attach to an array in a worker. Return a pair of SharedMemory and the array."""
+        import numpy
+        (name, shape, dtype) = spec
+        shm = shared_memory.SharedMemory(name=name)
+        return (shm, numpy.ndarray(shape, dtype, buffer=shm.buf))
+
+    def spec(self):
+        return (self.__name, self.__shape, self.__dtype.str)
+
+    def name(self):
+        return self.__name
+
+    def array(self):
+        return self.__array
+
+    def unlink(self):
+        """Remove the name of the shared memory. The memory is released when all views are gone."""
+        if self.__shm is not None:
+            self.__shm.unlink()
+            self.__shm = None
+
+class LongestFirst(object):
+    """
+    Hand out tasks grouped by a key (e.g. a job) in chunks,
+    the group with the longest expected runtime first.
+    The runtime of each group is estimated from its tasks finished so far.
+    A group not measured yet is handed out one task at a time until measured.
+    A chunk is sized to take about 1/(2 processes) of the expected remaining work,
+    so chunks of fast tasks are large and chunks shrink to a single task at the tail.
+    Give this to `Pool.imap_unordered` instead of a list of arguments.
+
+    """
+
+    def __init__(self, tasks, key, processes, chunksize=None):
+        """
+        Parameters
+        ----------
+        tasks : iterable
+            Sets of arguments.
+        key : function
+            A function returning a group of the given set of arguments.
+        processes : int
+            A number of workers.
+        chunksize : int, optional
+            The maximum number of tasks in a chunk.
+            If nothing is given, it is not limited.
+
+        """
+        self.__queues = collections.OrderedDict()
+        self.__groups = {}
+        for i, x in enumerate(tasks):
+            k = key(x)
+            self.__queues.setdefault(k, collections.deque()).append((i, x))
+            self.__groups[i] = k
+        self.__processes = processes
+        self.__chunksize = chunksize
+        self.__runtime = dict((k, [0, 0.0]) for k in self.__queues.keys())
+        self.__probing = set()
+
+    def expected(self, k):
+        """Return the mean runtime of tasks in the group, or None if not measured yet."""
+        count, total = self.__runtime[k]
+        return total / count if count > 0 else None
+
+    def report(self, i, elapsed):
+        """Record the elapsed time of the i-th task."""
+        value = self.__runtime[self.__groups[i]]
+        value[0] += 1
+        value[1] += elapsed
+
+    def next_chunk(self):
+        """Return the next chunk, a list of pairs of an index and arguments, or [] if nothing is left."""
+        groups = [k for k, q in self.__queues.items() if len(q) > 0]
+        if len(groups) == 0:
+            return []
+
+        for k in groups:
+            if self.expected(k) is None and k not in self.__probing:
+                self.__probing.add(k)
+                return [self.__queues[k].popleft()]
+
+        measured = [k for k in groups if self.expected(k) is not None]
+        if len(measured) == 0:
+            # Only groups being measured are left. Never hand out them in bulk.
+            return [self.__queues[groups[0]].popleft()]
+
+        k = max(measured, key=self.expected)
+        remaining = sum(len(self.__queues[k_]) * self.expected(k_) for k_ in measured)
+        if self.expected(k) > 0:
+            size = int(remaining / (2 * self.__processes) / self.expected(k))
+        else:
+            size = len(self.__queues[k])
+        size = max(1, min(size, len(self.__queues[k]), self.__chunksize or size))
+        return [self.__queues[k].popleft() for _ in range(size)]
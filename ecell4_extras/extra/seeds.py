@@ -0,0 +1,152 @@
+"""
+Seeds of the random number generation for ensemble runs.
+
+`SeedSequence` is kept in jobs sent to other processes and nodes, and is
+pickled as a plain pair of its entropy and spawn key. This module depends
+on nothing but the standard library (and numpy for `SeedSequence.seeds`),
+so that jobs are restored wherever this package is importable, e.g. on nodes
+of Azure Batch, where the package is shipped with tasks.
+It is also available as `ecell4.extra.ensemble.SeedSequence`.
+
+"""
+import os
+import binascii
+import hashlib
+import numbers
+
+_MASK64 = (1 << 64) - 1
+_GAMMA = 0x9e3779b97f4a7c15
+
+def _mix(z):
+    """The finalizer of SplitMix64 for an int below 2 ** 64."""
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return z ^ (z >> 31)
+
+class SeedSequence(object):
+    """
+    A source of independent seeds for any number of runs.
+    Like `numpy.random.SeedSequence`, a seed is derived from a root entropy
+    and a key, e.g. (job_id, task_id). Thus, any seed can be given
+    on demand without generating the others, and an ensemble can be extended
+    to larger n without changing the seeds of runs already done.
+
+    The seed is counter-based: the root entropy and the key but the last
+    are hashed once into a 64-bit base, and the last integer of the key,
+    e.g. a task id, is a counter mixed with the base by SplitMix64.
+    Thus, seeds for many tasks of a job are computed at once by `seeds`.
+
+    Examples
+    --------
+    >>> seq = SeedSequence(12345)
+    >>> seq.seed(1, 1) == seq.seed(1, 1)
+    True
+    >>> seq.spawn(1).seed(3) == seq.seed(1, 3)
+    True
+    >>> seq.seeds(1, 1000).shape  # doctest: +SKIP
+    (1000,)
+    >>> ensemble_simulations(10.0, {'C': 60}, n=100, rndseed=seq)  # doctest: +SKIP
+
+    """
+
+    def __init__(self, entropy=None, spawn_key=()):
+        """
+        Parameters
+        ----------
+        entropy : int, optional
+            A root entropy. If nothing is given, 128 bits are taken from `os.urandom`.
+            Keep `entropy()` to reproduce runs.
+        spawn_key : tuple, optional
+            A key prepended to keys given to `seed`.
+
+        """
+        if entropy is None:
+            entropy = int(binascii.hexlify(os.urandom(16)), 16)
+        elif not isinstance(entropy, numbers.Integral) or entropy < 0:
+            raise ValueError("The entropy must be a non-negative integer [{}].".format(repr(entropy)))
+        self.__entropy = int(entropy)
+        self.__spawn_key = tuple(int(k) for k in spawn_key)
+
+    def __reduce__(self):
+        return (SeedSequence, (self.__entropy, self.__spawn_key))
+
+    def __repr__(self):
+        return 'SeedSequence(entropy={:d}, spawn_key={})'.format(self.__entropy, repr(self.__spawn_key))
+
+    def __eq__(self, other):
+        return (isinstance(other, SeedSequence)
+                and (self.entropy(), self.spawn_key()) == (other.entropy(), other.spawn_key()))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.__entropy, self.__spawn_key))
+
+    def entropy(self):
+        return self.__entropy
+
+    def spawn_key(self):
+        return self.__spawn_key
+
+    def spawn(self, *key):
+        """Return a child sequence, whose seeds are `seed(*(key + ...))` of this."""
+        return SeedSequence(self.__entropy, self.__spawn_key + key)
+
+    def seed(self, *key):
+        """
+        Return a seed for the given key.
+
+        Parameters
+        ----------
+        key : int
+            Integers identifying a run, e.g. a job and task id.
+
+        Returns
+        -------
+        rndseed : int
+            A seed (less than (2 ** 31))
+
+        """
+        key = self.__spawn_key + tuple(int(k) for k in key)
+        (prefix, counter) = (key[: -1], key[-1]) if len(key) > 0 else ((), 0)
+        return _mix((self.__base(prefix) + (counter + 1) * _GAMMA) & _MASK64) >> 33
+
+    def __base(self, prefix):
+        words = (self.__entropy, ) + prefix
+        digest = hashlib.sha256(':'.join(str(w) for w in words).encode('ascii')).digest()
+        return int(binascii.hexlify(digest[: 8]), 16)
+
+    def seeds(self, job_id, task_ids):
+        """
+        Return seeds for tasks of a job at once. This requires numpy.
+
+        Parameters
+        ----------
+        job_id : int
+            A job id.
+        task_ids : int or list
+            A list of task ids. If int, task ids from 1 to `task_ids` are used.
+
+        Returns
+        -------
+        rndseeds : array
+            An array of seeds with the dtype int64, same with `seed(job_id, task_id)`.
+
+        """
+        import numpy
+        if isinstance(task_ids, numbers.Integral):
+            z = numpy.arange(1, task_ids + 1, dtype=numpy.uint64)
+        else:
+            z = numpy.asarray(task_ids, dtype=numpy.int64).astype(numpy.uint64)
+        # The same arithmetic with seed, modulo 2 ** 64 in place
+        z += numpy.uint64(1)
+        z *= numpy.uint64(_GAMMA)
+        z += numpy.uint64(self.__base(self.__spawn_key + (int(job_id), )))
+        z ^= z >> numpy.uint64(30)
+        z *= numpy.uint64(0xbf58476d1ce4e5b9)
+        z ^= z >> numpy.uint64(27)
+        z *= numpy.uint64(0x94d049bb133111eb)
+        z ^= z >> numpy.uint64(31)
+        z >>= numpy.uint64(33)
+        return z.astype(numpy.int64)
@@ -5,7 +5,11 @@ import tempfile
 import os
 import os.path
 import logging
-import collections
+
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 
 rcParams = {}
 rcParams["PREFIX"] = "/usr/bin"
@@ -20,7 +24,7 @@ def get_logger():
     return logging.getLogger('sge')
 
 def run(jobs, n=1, path='.', sync=10, delete=True, extra_args=None, max_running_tasks=None):
-    if not isinstance(jobs, collections.Iterable):
+    if not isinstance(jobs, Iterable):
         return singlerun(jobs, n, path, sync, delete, extra_args, max_running_tasks)
 
     retval = []
@@ -51,7 +55,23 @@ def singlerun(job, n=1, path='.', sync=10, delete=True, extra_args=None, max_run
 
     return (jobid, name, filename)
 
-def collect(jobid, name, n=1, path='.', delete=True):
+def logfiles(jobid, name, i, path='.'):
+    """Return paths to the standard error and output of the i-th (1-origin) task of a job."""
+    return (os.path.join(path, 'slurm-{}_e{}.out'.format(jobid, i)),
+            os.path.join(path, 'slurm-{}_o{}.out'.format(jobid, i)))
+
+def collect(jobid, name, n=1, path='.', delete=True, timeout=None):
+    """
+    Return the standard outputs of tasks of a job, and log their standard errors.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        Seconds to wait for files not written yet, e.g. on a shared file system.
+        A task whose files are still missing is skipped with a warning.
+        If nothing is given, a missing file raises an error.
+
+    """
     outputs = []
     for i in range(n):
         # err = False
@@ -71,25 +91,38 @@ def collect(jobid, name, n=1, path='.', delete=True):
         # if not err and delete:
         #     os.remove(filename)
 
+        (efile, ofile) = logfiles(jobid, name, i + 1, path)
+        if timeout is not None and not _wait_for_files((efile, ofile), timeout):
+            get_logger().warning(
+                "Outputs of task {:d} of job {} were not found.".format(i + 1, jobid))
+            outputs.append('')
+            continue
+
         err = False
-        filename = os.path.join(path, 'slurm-{}_e{}.out'.format(jobid, i + 1))
-        output = open(filename, 'r').read()
+        output = open(efile, 'r').read()
         if output != "":
             # err = True
             for line in output.split('\n'):
                 get_logger().error(
-                    "A standard error stream [{}] displays: {}".format(filename, line))
+                    "A standard error stream [{}] displays: {}".format(efile, line))
         if not err and delete:
-            os.remove(filename)
+            os.remove(efile)
 
-        filename = os.path.join(path, 'slurm-{}_o{}.out'.format(jobid, i + 1))
-        output = open(filename, 'r').read()
+        output = open(ofile, 'r').read()
         outputs.append(output)
         if not err and delete:
-            os.remove(filename)
+            os.remove(ofile)
 
     return outputs
 
+def _wait_for_files(filenames, timeout, interval=0.5):
+    deadline = time.time() + timeout
+    while not all(os.path.isfile(filename) for filename in filenames):
+        if time.time() >= deadline:
+            return False
+        time.sleep(min(interval, max(0.0, deadline - time.time())))
+    return True
+
 def submit(job, n=1, epath='.', opath='.', extra_args=None, max_running_tasks=None):
     # output = subprocess.check_output(
     #     [os.path.join(rcParams["PREFIX"], rcParams["QSUB"]), '-cwd']
@@ -120,7 +153,8 @@ def submit(job, n=1, epath='.', opath='.', extra_args=None, max_running_tasks=No
     # name = output.split()[3][2: -2]
     return (jobid, name)
 
-def wait(jobids, interval=10):
+def running(jobids):
+    """Return a set of the given job ids, which are still queued, running or being transferred."""
     # """
     # (python3.5) kaizu@lupin:~/src/ecell4-develop/build/test$ squeue -u kaizu
     #              JOBID PARTITION     NAME     USER ST       TIME  NODES NODELIST(REASON)
@@ -137,57 +171,51 @@ def wait(jobids, interval=10):
     #          217_[1-2]      defq sge-cjkq    kaizu PD       0:00      1 (Resources)
     # """
 
-    if isinstance(jobids, collections.Iterable):
+    if isinstance(jobids, Iterable):
+        jobidstrs = [str(jobid) for jobid in jobids]
+    else:
+        jobidstrs = [str(jobids)]
+
+    output = subprocess.check_output([os.path.join(rcParams["PREFIX"], rcParams["QSTAT"])])
+    output = output.decode('utf-8')
+    for line in output.split('\n'):
+        get_logger().debug(line)
+
+    retval = set()
+    for line in output.split('\n'):
+        state = line.split()
+        if len(state) < 8:
+            continue
+
+        jobid = state[0].split('_')[0]
+        if jobid not in jobidstrs:
+            continue
+
+        jobid = int(jobid)
+        if state[4] in ('PD', 'R', 'CF', 'CG', 'CD'):
+            get_logger().info(
+                'Job {:d} must be queued, running or being transferred'.format(jobid))
+            retval.add(jobid)
+        elif state[4] in ('CA', 'F', 'TO', 'NF', 'RV', 'SE'):
+            get_logger().error('Job {:d} in error state'.format(jobid))
+        else:
+            get_logger().error('Unknown state {:s}'.format(state[4]))
+    return retval
+
+def cancel(jobids):
+    if isinstance(jobids, Iterable):
         jobidstrs = [str(jobid) for jobid in jobids]
     else:
         jobidstrs = [str(jobids)]
 
+    output = subprocess.check_output([os.path.join(rcParams["PREFIX"], rcParams["QDEL"])] + jobidstrs)
+    get_logger().debug(output.strip())
+
+def wait(jobids, interval=10):
     dowait = True
     try:
         while dowait:
-            output = subprocess.check_output([os.path.join(rcParams["PREFIX"], rcParams["QSTAT"])])
-            output = output.decode('utf-8')
-            for line in output.split('\n'):
-                get_logger().debug(line)
-
-            dowait = False
-
-            # for line in output.split('\n'):
-            #     state = line.split()
-            #     if len(state) < 5 or state[0] not in jobidstrs:
-            #         continue
-
-            #     #XXX: job-ID prior   name       user         state submit/start at     queue                          slots ja-task-ID
-            #     jobid = int(state[0])
-            #     if re.search(state[4], 'qwrt'):
-            #         get_logger().info(
-            #             'Job {:d} must be queued, running or being transferred'.format(jobid))
-            #         dowait = True
-            #         break
-            #     elif re.search(state[4], 'acuE'):
-            #         get_logger().error('Job {:d} in error state'.format(jobid))
-            #     else:
-            #         get_logger().error('Unknown state {:s}'.format(state[4]))
-
-            for line in output.split('\n'):
-                state = line.split()
-                if len(state) < 8:
-                    continue
-
-                jobid = state[0].split('_')[0]
-                if jobid not in jobidstrs:
-                    continue
-
-                jobid = int(jobid)
-                if state[4] in ('PD', 'R', 'CF', 'CG', 'CD'):
-                    get_logger().info(
-                        'Job {:d} must be queued, running or being transferred'.format(jobid))
-                    dowait = True
-                    break
-                elif state[4] in ('CA', 'F', 'TO', 'NF', 'RV', 'SE'):
-                    get_logger().error('Job {:d} in error state'.format(jobid))
-                else:
-                    get_logger().error('Unknown state {:s}'.format(state[4]))
+            dowait = len(running(jobids)) > 0
 
             if dowait:
                 time.sleep(interval)
@@ -195,8 +223,7 @@ def wait(jobids, interval=10):
                     "Waiting for jobids {:s} to finish".format(str(jobids)))
     finally:
         if dowait:
-            output = subprocess.check_output([os.path.join(rcParams["PREFIX"], rcParams["QDEL"])] + jobidstrs)
-            get_logger().debug(output.strip())
+            cancel(jobids)
 
 
 if __name__ == "__main__":
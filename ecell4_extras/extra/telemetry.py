@@ -0,0 +1,224 @@
+"""
+Per-task timing and resource telemetry for ensemble runs.
+
+A target wrapped by `Measured` returns its result together with a record of
+the host, the process id, the start and end time, and the peak resident set
+size of the process. `ecell4.extra.backends.Submission` unwraps results
+as they arrive, stamps records with the submission time and the time received,
+and adds them to a `Recorder`, which writes them to a metrics file as JSON lines
+and summarizes throughput, queue wait and stragglers.
+
+Times are taken from the clock of each host. The queue wait of tasks
+on other hosts (e.g. 'sge' or 'azure') includes the clock skew between them.
+
+`Measured` is restored by its name on the host evaluating tasks, which imports
+this module. It depends on nothing but the standard library, and is found in
+the package shipped with tasks on nodes of Azure Batch (see `ecell4.extra.azure_batch`).
+
+Examples
+--------
+>>> recorder = Recorder('metrics.jsonl')
+>>> ensemble_simulations(10.0, {'C': 60}, n=100, method='multiprocessing', metrics=recorder)  # doctest: +SKIP
+>>> print(recorder.report())  # doctest: +SKIP
+
+"""
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import logging
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+
+def get_logger():
+    return logging.getLogger('telemetry')
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # KiB on Linux
+
+class TaskResult(object):
+    """A result of a task with its record, returned by `Measured`."""
+
+    __slots__ = ('result', 'record')
+
+    def __init__(self, result, record):
+        self.result = result
+        self.record = record
+
+    def __getstate__(self):
+        return (self.result, self.record)
+
+    def __setstate__(self, state):
+        (self.result, self.record) = state
+
+class Measured(object):
+    """
+    A target wrapped to measure each call. Picklable if the target is.
+    The peak RSS is of the process evaluating the task, so it also covers
+    tasks evaluated before by the same process.
+
+    """
+
+    def __init__(self, target):
+        self.target = target
+
+    def __call__(self, job, job_id, task_id):
+        start = time.time()
+        result = self.target(job, job_id, task_id)
+        record = dict(
+            job_id=job_id, task_id=task_id, host=socket.gethostname(), pid=os.getpid(),
+            start=start, end=time.time(), maxrss=peak_rss())
+        return TaskResult(result, record)
+
+def unwrap(retval, submit=None):
+    """
+    Split a result of `Measured` into the result and its record,
+    which is stamped with the submission time and the time received.
+    Anything else is returned with None for the record, e.g. a cached result.
+
+    """
+    if not isinstance(retval, TaskResult):
+        return (retval, None)
+    record = dict(retval.record, submit=submit, received=time.time())
+    return (retval.result, record)
+
+def _describe(values):
+    values = sorted(values)
+    if len(values) == 0:
+        return dict(mean=None, median=None, max=None)
+    return dict(
+        mean=sum(values) / len(values), median=values[len(values) // 2], max=values[-1])
+
+def summarize(records, factor=2.0, limit=10, minimum=0.1):
+    """
+    Summarize records of tasks.
+
+    Parameters
+    ----------
+    records : list
+        A list of records (dict).
+    factor : float, optional
+        A task taking longer than `factor` times the median runtime is a straggler.
+        2 for default.
+    limit : int, optional
+        The maximum number of stragglers listed, the slowest first. 10 for default.
+    minimum : float, optional
+        A straggler must also take `minimum` seconds longer than the median,
+        not to list short tasks with jitter. 0.1 for default.
+
+    Returns
+    -------
+    summary : dict
+        The number of tasks, the wall time from the first submission to the last
+        result, the throughput (tasks per second), statistics of runtime and
+        queue wait (mean, median and max in seconds), the number of tasks for
+        each host, the maximum peak RSS in bytes, and a list of stragglers.
+
+    """
+    records = list(records)
+    if len(records) == 0:
+        return dict(tasks=0, elapsed=0.0, throughput=0.0, runtime=_describe(()), wait=_describe(()),
+                    hosts={}, maxrss=None, stragglers=[])
+
+    first = min(r['submit'] if r.get('submit') is not None else r['start'] for r in records)
+    last = max(r['received'] if r.get('received') is not None else r['end'] for r in records)
+    elapsed = last - first
+
+    runtime = _describe(r['end'] - r['start'] for r in records)
+    wait = _describe(r['start'] - r['submit'] for r in records if r.get('submit') is not None)
+
+    hosts = {}
+    for r in records:
+        hosts[r['host']] = hosts.get(r['host'], 0) + 1
+
+    rss = [r['maxrss'] for r in records if r.get('maxrss') is not None]
+
+    threshold = max(factor * runtime['median'], runtime['median'] + minimum)
+    stragglers = sorted(
+        (r for r in records if r['end'] - r['start'] > threshold),
+        key=lambda r: r['start'] - r['end'])[: limit]
+
+    return dict(
+        tasks=len(records), elapsed=elapsed,
+        throughput=(len(records) / elapsed if elapsed > 0 else 0.0),
+        runtime=runtime, wait=wait, hosts=hosts,
+        maxrss=(max(rss) if len(rss) > 0 else None), stragglers=stragglers)
+
+def report(records, factor=2.0, limit=10, minimum=0.1):
+    """Return a summary of records as a human-readable text. See `summarize`."""
+    summary = summarize(records, factor, limit, minimum)
+    if summary['tasks'] == 0:
+        return 'No task was measured.'
+
+    def seconds(stats):
+        return 'mean {:.3f}s, median {:.3f}s, max {:.3f}s'.format(stats['mean'], stats['median'], stats['max'])
+
+    lines = [
+        '{:d} tasks in {:.3f}s ({:.3f} tasks/s)'.format(summary['tasks'], summary['elapsed'], summary['throughput']),
+        'runtime:    {}'.format(seconds(summary['runtime']))]
+    if summary['wait']['mean'] is not None:
+        lines.append('queue wait: {}'.format(seconds(summary['wait'])))
+    if summary['maxrss'] is not None:
+        lines.append('peak RSS:   {:.1f} MiB'.format(summary['maxrss'] / 1048576.0))
+    lines.append('hosts:      {}'.format(', '.join(
+        '{} ({:d})'.format(host, count) for host, count in sorted(summary['hosts'].items()))))
+    if len(summary['stragglers']) > 0:
+        lines.append('stragglers (> {:g} x median runtime):'.format(factor))
+        for r in summary['stragglers']:
+            lines.append('  job {:d} task {:d} on {} took {:.3f}s'.format(
+                r['job_id'], r['task_id'], r['host'], r['end'] - r['start']))
+    return '\n'.join(lines)
+
+class Recorder(object):
+    """
+    A collector of records of tasks, shared by submissions.
+    Records are also appended to a metrics file as JSON lines, if given.
+
+    """
+
+    def __init__(self, filename=None):
+        """
+        Parameters
+        ----------
+        filename : str, optional
+            A path to the metrics file. Records are appended to it.
+
+        """
+        self.__filename = filename
+        self.__records = []
+        self.__lock = threading.Lock()
+
+    def filename(self):
+        return self.__filename
+
+    def add(self, record):
+        with self.__lock:
+            self.__records.append(record)
+            if self.__filename is not None:
+                with open(self.__filename, 'a') as fout:
+                    fout.write(json.dumps(record) + '\n')
+
+    def records(self):
+        with self.__lock:
+            return list(self.__records)
+
+    def summary(self, factor=2.0, limit=10, minimum=0.1):
+        return summarize(self.records(), factor, limit, minimum)
+
+    def report(self, factor=2.0, limit=10, minimum=0.1):
+        return report(self.records(), factor, limit, minimum)
+
+def read_metrics(filename):
+    """Return a list of records written in a metrics file."""
+    with open(filename) as fin:
+        return [json.loads(line) for line in fin if line.strip() != '']
@@ -0,0 +1,146 @@
+import os
+import os.path
+import time
+import select
+import errno
+import ctypes
+import ctypes.util
+import logging
+
+
+def get_logger():
+    return logging.getLogger('watcher')
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+def inotify(path, mask=IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+    """
+    Return a file descriptor notified of changes in the given directory,
+    or None if inotify is not available.
+
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        init1, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    fd = init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+    if fd < 0:
+        get_logger().debug("inotify_init1 failed [{}]".format(errno.errorcode.get(ctypes.get_errno())))
+        return None
+    if add_watch(fd, os.fsencode(os.path.abspath(path)), mask) < 0:
+        get_logger().debug("inotify_add_watch failed [{}]".format(errno.errorcode.get(ctypes.get_errno())))
+        os.close(fd)
+        return None
+    return fd
+
+class DirectoryWatcher(object):
+    """
+    Wait for files to be created or modified in a directory.
+    inotify is used where available. Files written by other hosts on a shared
+    file system are not always notified, and thus the modification time of the
+    directory and the given files is also checked every `poll` seconds as a fallback.
+
+    Examples
+    --------
+    >>> with DirectoryWatcher('.tmp') as w:  # doctest: +SKIP
+    ...     while not os.path.isfile('.tmp/done'):
+    ...         w.wait(60)
+
+    """
+
+    def __init__(self, path, poll=1.0, use_inotify=True, files=()):
+        """
+        Parameters
+        ----------
+        path : str
+            A directory to watch.
+        poll : float, optional
+            An interval in seconds to check the modification time of the directory.
+            1 for default.
+        use_inotify : bool, optional
+            Whether it tries inotify, or not. True for default.
+        files : list, optional
+            A list of filenames in the directory, whose modification
+            is also checked in the fallback. Appending to a file
+            doesn't change the modification time of its directory.
+
+        """
+        self.__path = path
+        self.__files = tuple(files)
+        self.__poll = poll
+        self.__fd = inotify(path) if use_inotify else None
+        self.__mtime = self.__stat()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def __stat(self):
+        retval = []
+        for filename in (self.__path, ) + self.__files:
+            try:
+                st = os.stat(filename)
+            except OSError:
+                retval.append(None)
+            else:
+                retval.append((st.st_mtime, st.st_size))
+        return retval
+
+    def __drain(self):
+        try:
+            while os.read(self.__fd, 4096):
+                pass
+        except OSError as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def is_inotify(self):
+        return self.__fd is not None
+
+    def close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def wait(self, timeout):
+        """
+        Block until the directory changes after the last call, or the timeout expires.
+
+        Parameters
+        ----------
+        timeout : float
+            A maximum time to wait in seconds.
+
+        Returns
+        -------
+        changed : bool
+            False if the timeout expired.
+
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            step = min(remaining, self.__poll)
+            changed = False
+            if self.__fd is not None:
+                if len(select.select([self.__fd], [], [], step)[0]) > 0:
+                    self.__drain()
+                    changed = True
+            else:
+                time.sleep(step)
+
+            mtime = self.__stat()
+            if changed or mtime != self.__mtime:
+                self.__mtime = mtime
+                return True
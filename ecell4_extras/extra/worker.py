@@ -0,0 +1,271 @@
+"""
+A bootstrap runner of tasks on computing nodes.
+
+A target function is shipped as a small spec made by `dumps_target`:
+its qualified name when it can be imported by the name, or a blob pickled
+by cloudpickle (e.g. a lambda, a closure or a function defined in `__main__`).
+No script is generated for each job, and tasks are evaluated by this module:
+
+    python -m ecell4.extra.worker bundle BUNDLE STORE START STOP CHUNKSIZE N NUM_JOBS TASK_ID_ENV
+
+reads jobs and the target from an archive written by `ecell4.extra.bundle`, and
+appends results to the store. This file doesn't depend on the other modules
+at the top level, and can also be run as a script on nodes of Azure Batch,
+where a copy of this package shipped with the task is imported in place of
+the one installed (see `ecell4.extra.azure_batch`).
+
+"""
+from __future__ import print_function
+
+import os
+import sys
+import copy
+import pickle
+import zipfile
+import inspect
+import textwrap
+import importlib
+import argparse
+
+try:
+    import cloudpickle
+except ImportError:
+    cloudpickle = None
+
+
+def _resolve(module, qualname):
+    obj = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+def dumps_target(target):
+    """
+    Return a picklable spec to restore the target function in another process.
+
+    The target is referred by its qualified name if it can be imported by the name.
+    Otherwise, it is pickled by value with cloudpickle, which allows lambdas and closures.
+    Without cloudpickle, a callable object is pickled as it is, and the source of the target is used as a last resort,
+    which requires a function defined at the top level.
+
+    Parameters
+    ----------
+    target : function
+        A function to be evaluated.
+
+    Returns
+    -------
+    spec : tuple
+        A spec given to `loads_target`.
+
+    """
+    module = getattr(target, '__module__', None)
+    qualname = getattr(target, '__qualname__', getattr(target, '__name__', None))
+    if module not in (None, '__main__') and qualname is not None and '<' not in qualname:
+        try:
+            if _resolve(module, qualname) is target:
+                return ('name', module, qualname)
+        except (ImportError, AttributeError):
+            pass
+
+    if cloudpickle is not None:
+        return ('cloudpickle', cloudpickle.dumps(target, protocol=2))
+    elif not inspect.isroutine(target):
+        return ('pickle', pickle.dumps(target, protocol=2))  # e.g. a callable object
+
+    name = getattr(target, '__name__', '')
+    if name == '<lambda>' or qualname is None or '<locals>' in qualname:
+        raise RuntimeError(
+            "A lambda function or closure [{}] requires cloudpickle. Install it or define the function at the top level of a module.".format(qualname))
+    src = textwrap.dedent(inspect.getsource(target))
+    return ('source', src, name)
+
+def loads_target(spec, modules=()):
+    """
+    Restore the target function from a spec given by `dumps_target`.
+
+    Parameters
+    ----------
+    spec : tuple
+        A spec given by `dumps_target`.
+    modules : list, optional
+        A list of module names, whose attributes are imported into the namespace
+        of the source. Only used for a spec made from the source.
+
+    Returns
+    -------
+    target : function
+
+    """
+    if spec[0] == 'name':
+        return _resolve(spec[1], spec[2])
+    elif spec[0] in ('cloudpickle', 'pickle'):
+        return pickle.loads(spec[1])
+    elif spec[0] == 'source':
+        namespace = {'__name__': '__worker__'}
+        for m in modules:
+            exec('from {} import *'.format(m), namespace)
+        exec(spec[1], namespace)
+        return namespace[spec[2]]
+    raise ValueError("An unknown spec of a target was given [{}].".format(spec[0]))
+
+def run_bundle(bundlefile, storefile, start, stop, chunksize, n, num_jobs, element):
+    """
+    Evaluate tasks of an element (1-origin) of an array job,
+    and append a list of their results into the store with the element as a key.
+
+    The archive keeps `num_jobs` jobs followed by a header, which is a dict with
+    the spec of the target ('target'), modules for the source ('modules'),
+    and the list of task indices to be evaluated or None for all ('indices').
+    A task (job_id, task_id) is numbered as (job_id - 1) * n + (task_id - 1),
+    and the element evaluates `chunksize` tasks at the positions from
+    `start + (element - 1) * chunksize` below `stop`.
+
+    """
+    from . import bundle
+
+    header = bundle.read_input(bundlefile, num_jobs)
+    target = loads_target(header['target'], header.get('modules', ()))
+
+    positions = range(start + (element - 1) * chunksize, min(start + element * chunksize, stop))
+    indices = header.get('indices')
+    if indices is not None:
+        positions = [indices[k] for k in positions]
+
+    inputs = {}
+    retval = []
+    for idx in positions:
+        if idx // n not in inputs:
+            inputs = {idx // n: bundle.read_input(bundlefile, idx // n)}
+        retval.append(target(copy.copy(inputs[idx // n]), idx // n + 1, idx % n + 1))
+    bundle.append_result(storefile, element, retval)
+
+def use_package(root):
+    """
+    Import the package under the given directory, e.g. `root/ecell4/extra`,
+    in place of the one installed. Installed modules of its parent, e.g. the core
+    of E-Cell4, are still used. Without them, the parent is a namespace package.
+
+    """
+    root = os.path.realpath(root)
+    if root in sys.path:
+        return
+    sys.path.insert(0, root)
+    for dirpath, _, filenames in os.walk(root):
+        if '__init__.py' in filenames:
+            break
+    else:
+        return
+
+    name = os.path.relpath(dirpath, root).replace(os.sep, '.')
+    for key in [key for key in sys.modules if key == name or key.startswith(name + '.')]:
+        del sys.modules[key]
+    (parent, _, child) = name.rpartition('.')
+    if parent == '':
+        return
+    module = importlib.import_module(parent)
+    if os.path.dirname(dirpath) not in list(module.__path__):
+        module.__path__.insert(0, os.path.dirname(dirpath))
+    if hasattr(module, child):
+        delattr(module, child)
+
+def extract_package(archive):
+    """Extract a package archived by `ecell4.extra.azure_batch`, and return the directory."""
+    root = os.path.join(os.path.dirname(os.path.realpath(archive)), 'package')
+    with zipfile.ZipFile(archive) as zin:
+        zin.extractall(root)
+    return root
+
+_TARGET = None  # The target restored once per process of run_azure_task
+
+def _run_azure_load(load):
+    global _TARGET
+    (package, targetfile, inputfile, job_id, task_id) = load
+    if package is not None:
+        use_package(package)  # Again in a process not forked
+    if _TARGET is None or _TARGET[0] != targetfile:
+        with open(targetfile, 'rb') as fin:
+            _TARGET = (targetfile, loads_target(pickle.load(fin)))
+    with open(inputfile, 'rb') as fin:
+        job = pickle.load(fin)
+    return _TARGET[1](job, job_id, task_id)
+
+def run_azure_task(targetfile, inputfiles, outputfile, job_ids, task_ids, account, container, sastoken, processes=1, package=None):
+    """
+    Evaluate tasks on a node of Azure Batch, and upload a list of their results.
+    The target is given as a pickled spec, and each job as a pickle.
+    `inputfiles`, `job_ids` and `task_ids` are lists of the same length,
+    which are evaluated with a pool of `processes` processes.
+    If an archive of the package is given, it is imported in place of
+    the one installed before anything is unpickled.
+
+    """
+    if package is not None:
+        package = extract_package(package)
+        use_package(package)
+    loads = [(package, targetfile, inputfile, job_id, task_id)
+             for inputfile, job_id, task_id in zip(inputfiles, job_ids, task_ids)]
+    if processes > 1 and len(loads) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(processes, len(loads)))
+        try:
+            res = pool.map(_run_azure_load, loads, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        res = [_run_azure_load(load) for load in loads]
+
+    with open(outputfile, 'wb') as fout:
+        pickle.dump(res, fout, protocol=2)
+
+    import azure.storage.blob as azureblob
+
+    # Create the blob client using the container's SAS token.
+    # This allows us to create a client that provides write
+    # access only to the container.
+    blob_client = azureblob.BlockBlobService(account_name=account, sas_token=sastoken)
+    blob_client.create_blob_from_path(container, outputfile, os.path.realpath(outputfile))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ecell4.extra.worker')
+    subparsers = parser.add_subparsers(dest='command')
+
+    p = subparsers.add_parser('bundle', help='Evaluate an element of an array job.')
+    p.add_argument('bundlefile')
+    p.add_argument('storefile')
+    for key in ('start', 'stop', 'chunksize', 'n', 'num_jobs'):
+        p.add_argument(key, type=int)
+    p.add_argument('task_id_env', help='An environment variable giving the element (1-origin).')
+
+    p = subparsers.add_parser('azure', help='Evaluate tasks on Azure Batch.')
+    p.add_argument('--target', required=True, help='A pickled spec of the target.')
+    p.add_argument('--filepath', nargs='+', required=True, help='A pickled job for each task.')
+    p.add_argument('--output', required=True, help='The path to the output.')
+    p.add_argument('--job_id', type=int, nargs='+', required=True)
+    p.add_argument('--task_id', type=int, nargs='+', required=True)
+    p.add_argument('--processes', type=int, default=1, help='A number of tasks evaluated at once.')
+    p.add_argument('--package', default=None, help='A zip archive of the package used on the node.')
+    p.add_argument('--storageaccount', required=True)
+    p.add_argument('--storagecontainer', required=True)
+    p.add_argument('--sastoken', required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == 'bundle':
+        run_bundle(
+            args.bundlefile, args.storefile, args.start, args.stop, args.chunksize,
+            args.n, args.num_jobs, int(os.environ[args.task_id_env]))
+    elif args.command == 'azure':
+        if not len(args.filepath) == len(args.job_id) == len(args.task_id):
+            parser.error('--filepath, --job_id and --task_id must have the same length.')
+        run_azure_task(
+            os.path.realpath(args.target), [os.path.realpath(filename) for filename in args.filepath],
+            args.output, args.job_id, args.task_id, args.storageaccount, args.storagecontainer,
+            args.sastoken, args.processes, args.package and os.path.realpath(args.package))
+    else:
+        parser.print_help()
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -319,11 +319,15 @@ def run_simulation(
     elif return_type in ('dataframe', 'd'):
         import pandas
         import numpy
-        data = numpy.array(obs.data()).T
-        return pandas.concat([
-            pandas.DataFrame(dict(Time=data[0], Value=data[i + 1],
-                                  Species=sp.serial(), **opt_kwargs))
-            for i, sp in enumerate(obs.targets())])
+        data = numpy.asarray(obs.data(), numpy.float64)
+        serials = [sp.serial() for sp in obs.targets()]
+        (n_times, n_species) = (data.shape[0], len(serials))
+        return pandas.DataFrame(dict(
+            Time=numpy.tile(data[:, 0], n_species),
+            Value=data[:, 1: ].T.ravel(),
+            Species=pandas.Categorical.from_codes(
+                numpy.repeat(numpy.arange(n_species), n_times), serials),
+            **opt_kwargs))
     elif return_type in ('world', 'w'):
         return sim.world()
     elif return_type is None or return_type in ('none', ):
@@ -0,0 +1,52 @@
+# coding: utf-8
+"""
+Measure the end-to-end time of ensemble_simulations with method='azure'
+on a local stand-in of Azure Batch and Blob storage, with and without
+a warm pool and concurrent transfers.
+
+    python bench-azure-transfer.py --n 50 --nodes 2 --latency 0.1 --provision 10 --threads 1 8
+"""
+
+import argparse
+import time
+import logging
+
+from ecell4 import reaction_rules, get_model
+from ecell4.extra.ensemble import ensemble_simulations, genseeds
+from ecell4.extra.azurelocal import AzureLocal
+
+
+def bench(emulator, n, nodes, keep, threads, path):
+    with reaction_rules():
+        A + B == C | (0.01, 0.3)
+    model = get_model()
+
+    config = emulator.config(nodecount=nodes, keep=keep, transfer_threads=threads)
+    start = time.time()
+    ensemble_simulations(
+        10.0, {'C': 60}, model=model, solver='gillespie', return_type='none',
+        n=n, method='azure', path=path, config=config, rndseed=genseeds(n))
+    return time.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=50, help='A number of runs.')
+    parser.add_argument('--nodes', type=int, default=2, help='A number of nodes in the pool.')
+    parser.add_argument('--latency', type=float, default=0.1, help='Seconds each storage request takes.')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Bytes per second of each transfer.')
+    parser.add_argument('--provision', type=float, default=10.0, help='Seconds to allocate a new pool.')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--repeat', type=int, default=2, help='A number of calls for each setting.')
+    parser.add_argument('--path', default='.tmp')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print('{:>5s} {:>7s} {:>4s} {:>9s} {:>10s}'.format('keep', 'threads', 'call', 'elapsed', 'runs/sec'))
+    for keep in (False, True):
+        for threads in args.threads:
+            with AzureLocal(latency=args.latency, bandwidth=args.bandwidth, provision=args.provision) as emulator:
+                for call in range(args.repeat):
+                    elapsed = bench(emulator, args.n, args.nodes, keep, threads, args.path)
+                    print('{:>5s} {:7d} {:4d} {:9.2f} {:10.2f}'.format(
+                        str(keep), threads, call + 1, elapsed, args.n / elapsed))
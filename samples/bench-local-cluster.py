@@ -0,0 +1,55 @@
+# coding: utf-8
+"""
+Measure the end-to-end throughput of ensemble_simulations with method='sge' and 'slurm'
+on a local stand-in of the schedulers.
+
+    python bench-local-cluster.py --n 200 --slots 8 --latency 1.0 --chunksize 1 10
+"""
+
+import argparse
+import time
+import logging
+
+from ecell4 import reaction_rules, get_model
+from ecell4.extra.ensemble import ensemble_simulations, genseeds
+from ecell4.extra.localcluster import LocalCluster
+
+
+def bench(method, n, slots, latency, failure, chunksize, flatten, path):
+    with reaction_rules():
+        A + B == C | (0.01, 0.3)
+    model = get_model()
+
+    with LocalCluster(slots=slots, latency=latency, failure=failure, seed=0):
+        start = time.time()
+        try:
+            ensemble_simulations(
+                10.0, {'C': 60}, model=model, solver='gillespie', return_type='none',
+                n=n, method=method, path=path, wait=1, chunksize=chunksize, flatten=flatten,
+                rndseed=genseeds(n))
+        except RuntimeError as err:
+            return (time.time() - start, str(err))
+        return (time.time() - start, None)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=100, help='A number of runs.')
+    parser.add_argument('--slots', type=int, default=None, help='A number of tasks running at once.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds each job waits in the queue.')
+    parser.add_argument('--failure', type=float, default=0.0, help='A probability that a task fails.')
+    parser.add_argument('--chunksize', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--method', nargs='+', default=['sge', 'slurm'])
+    parser.add_argument('--path', default='.tmp')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print('{:>6s} {:>9s} {:>7s} {:>9s} {:>10s}'.format('method', 'chunksize', 'flatten', 'elapsed', 'runs/sec'))
+    for method in args.method:
+        for chunksize in args.chunksize:
+            for flatten in (False, True):
+                elapsed, err = bench(
+                    method, args.n, args.slots, args.latency, args.failure, chunksize, flatten, args.path)
+                print('{:>6s} {:9d} {:>7s} {:9.2f} {:10.2f}{}'.format(
+                    method, chunksize, str(flatten), elapsed, args.n / elapsed,
+                    '' if err is None else '  (failed: {})'.format(err)))
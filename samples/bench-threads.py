@@ -0,0 +1,49 @@
+# coding: utf-8
+"""
+Compare the throughput of ensemble_simulations with method='serial', 'threads'
+and 'multiprocessing' for each solver, to pick the cheapest backend.
+Threads pay nothing for pickling and forking, but run in parallel only
+while the solver releases the GIL.
+
+    python bench-threads.py --n 200 --nproc 4 --solver ode gillespie
+"""
+
+import argparse
+import time
+import logging
+
+from ecell4 import reaction_rules, get_model
+from ecell4.extra.ensemble import ensemble_simulations, genseeds
+
+
+def bench(method, solver, n, nproc, duration):
+    with reaction_rules():
+        A + B == C | (0.01, 0.3)
+    model = get_model()
+
+    start = time.time()
+    ensemble_simulations(
+        duration, {'C': 60}, model=model, solver=solver, return_type='none',
+        n=n, nproc=nproc, method=method, rndseed=genseeds(n))
+    return time.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=100, help='A number of runs.')
+    parser.add_argument('--nproc', type=int, default=None, help='A number of threads or processes.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Simulation time of each run.')
+    parser.add_argument('--solver', nargs='+', default=['ode', 'gillespie'])
+    parser.add_argument('--method', nargs='+', default=['serial', 'threads', 'multiprocessing'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print('{:>10s} {:>15s} {:>9s} {:>10s}'.format('solver', 'method', 'elapsed', 'runs/sec'))
+    for solver in args.solver:
+        best = None
+        for method in args.method:
+            elapsed = bench(method, solver, args.n, args.nproc, args.duration)
+            print('{:>10s} {:>15s} {:9.2f} {:10.2f}'.format(solver, method, elapsed, args.n / elapsed))
+            if best is None or elapsed < best[1]:
+                best = (method, elapsed)
+        print('{:>10s} {:>15s}'.format(solver, '-> ' + best[0]))
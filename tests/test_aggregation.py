@@ -0,0 +1,54 @@
+import pytest
+
+numpy = pytest.importorskip('numpy')
+aggregation = pytest.importorskip('ecell4.extra.aggregation')
+
+
+def trajectories(n=50, seed=0):
+    rng = numpy.random.RandomState(seed)
+    t = numpy.linspace(0.0, 1.0, 11)
+    return [numpy.column_stack([t, rng.poisson(10.0, (11, 2))]) for _ in range(n)]
+
+def test_running_statistics():
+    inputs = trajectories()
+    block = numpy.asarray(inputs)[:, :, 1: ]
+    stats = aggregation.RunningStatistics(minmax=True)
+    for data in inputs:
+        stats.add(data)
+
+    assert stats.count() == len(inputs)
+    assert numpy.allclose(stats.t(), inputs[0][:, 0])
+    assert numpy.allclose(stats.mean(), block.mean(axis=0))
+    assert numpy.allclose(stats.var(), block.var(axis=0))
+    assert numpy.allclose(stats.stderr(), block.std(axis=0) / numpy.sqrt(len(inputs)))
+    assert numpy.array_equal(stats.min(), block.min(axis=0))
+    assert numpy.array_equal(stats.max(), block.max(axis=0))
+
+def test_running_statistics_shape():
+    stats = aggregation.RunningStatistics()
+    stats.add(trajectories(1)[0])
+    with pytest.raises(ValueError):
+        stats.add(trajectories(1)[0][:, : 2])
+    with pytest.raises(RuntimeError):
+        stats.min()
+    with pytest.raises(RuntimeError):
+        stats.quantile(0.5)
+
+def test_reservoir():
+    inputs = trajectories()
+    block = numpy.asarray(inputs)[:, :, 1: ]
+
+    stats = aggregation.RunningStatistics(reservoir=100, seed=1)
+    for data in inputs:
+        stats.add(data)
+    assert numpy.allclose(stats.quantile(0.5), numpy.quantile(block, 0.5, axis=0))  # All kept
+
+    quantiles = []
+    for _ in range(2):
+        stats = aggregation.RunningStatistics(reservoir=10, seed=1)
+        for data in inputs:
+            stats.add(data)
+        quantiles.append(stats.quantile([0.0, 0.5, 1.0]))
+    assert numpy.array_equal(quantiles[0], quantiles[1])
+    (lower, _, upper) = quantiles[0]
+    assert (block.min(axis=0) <= lower).all() and (upper <= block.max(axis=0)).all()
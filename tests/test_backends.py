@@ -0,0 +1,48 @@
+import pytest
+
+backends = pytest.importorskip('ecell4.extra.backends')
+
+
+def imap_reversed(target, jobs, n=1, tasks=None, cancel=None, **kwargs):
+    jobs = list(jobs)
+    for i in reversed(range(len(jobs))):
+        for j in reversed(range(n)):
+            if tasks is None or (i + 1, j + 1) in tasks:
+                yield (i + 1, j + 1, target(jobs[i], i + 1, j + 1))
+
+@pytest.fixture
+def mine():
+    backends.register_backend('Mine', imap_reversed)
+    yield backends.get_backend('mine')
+    backends.unregister_backend('mine')
+
+def test_builtins():
+    assert set(backends.list_backends()) >= set(['serial', 'threads', 'multiprocessing', 'sge', 'slurm', 'azure'])
+    assert backends.get_backend(None) is backends.get_backend('Serial')
+    assert backends.get_backend('multiprocessing').supports_shared_memory
+    assert not backends.get_backend('serial').supports_shared_memory
+
+def test_register(mine):
+    assert isinstance(mine, backends.FunctionBackend)
+    assert mine.name == 'mine' and 'mine' in backends.list_backends()
+    assert backends.get_backend(mine) is mine
+    assert mine.run(lambda job, job_id, task_id: job + task_id, [10, 20], n=2) == [[11, 12], [21, 22]]
+    assert mine.stats()['finished'] == 4
+
+    with pytest.raises(ValueError):
+        backends.register_backend('mine', imap_reversed)
+    with pytest.raises(ValueError):
+        backends.register_backend('serial', imap_reversed)
+
+def test_unknown():
+    with pytest.raises(ValueError):
+        backends.get_backend('nothing')
+    with pytest.raises(TypeError):
+        backends.register_backend('nothing', 1)
+
+def test_submission(mine):
+    recorder = pytest.importorskip('ecell4.extra.telemetry').Recorder()
+    submission = mine.submit(lambda job, job_id, task_id: job, [1, 2], n=3, telemetry=recorder)
+    assert list(submission) == [(i, j, i) for i in (2, 1) for j in (3, 2, 1)]
+    assert submission.stats()['finished'] == 6
+    assert len(recorder.records()) == 6
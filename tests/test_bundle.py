@@ -0,0 +1,30 @@
+import pytest
+
+bundle = pytest.importorskip('ecell4.extra.bundle')
+
+
+def test_inputs(tmp_path):
+    filename = str(tmp_path / 'jobs.bundle')
+    inputs = [{'k': 1}, [2, 3], 'x' * 1000, None]
+    bundle.write_inputs(filename, inputs)
+    assert [bundle.read_input(filename, i) for i in (3, 0, 2, 1)] == [None, {'k': 1}, 'x' * 1000, [2, 3]]
+
+def test_results(tmp_path):
+    filename = str(tmp_path / 'jobs.results')
+    reader = bundle.ResultReader(filename)
+    assert list(reader.read()) == []
+
+    bundle.append_result(filename, 2, [20, 21])
+    bundle.append_result(filename, 1, [10])
+    assert list(reader.read()) == [(2, [20, 21]), (1, [10])]
+    assert list(reader.read()) == []
+
+    with open(filename, 'ab') as fout:
+        fout.write(b'\x00\x01')  # A record being written
+    assert list(reader.read()) == []
+    with open(filename, 'rb') as fin:
+        whole = fin.read()[: -2]
+    with open(filename, 'wb') as fout:
+        fout.write(whole)
+    bundle.append_result(filename, 3, [30])
+    assert list(reader.read()) == [(3, [30])]
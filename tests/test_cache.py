@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+cache = pytest.importorskip('ecell4.extra.cache')
+ensemble = pytest.importorskip('ecell4.extra.ensemble')
+
+
+def square(job, job_id, task_id):
+    return job * job + task_id
+
+def counted(calls):
+    def imap(target, jobs, n=1, tasks=None, **kwargs):
+        for job_id, task_id, res in ensemble.imap_serial(target, jobs, n, tasks=tasks, **kwargs):
+            calls.append((job_id, task_id))
+            yield (job_id, task_id, res)
+    return imap
+
+def test_fingerprint():
+    assert cache.fingerprint(square, [1, 2]) == cache.fingerprint(square, [1, 2])
+    assert cache.fingerprint(square, [1, 2]) != cache.fingerprint(square, [1, 3])
+    assert cache.fingerprint(square, [1, 2]) != cache.fingerprint(counted, [1, 2])
+
+def test_run_cache(tmp_path):
+    c = cache.RunCache(str(tmp_path), square, [1, 2], n=2)
+    assert c.missing() == [(1, 1), (1, 2), (2, 1), (2, 2)]
+    c.store(2, 1, 'x')
+
+    c = cache.RunCache(str(tmp_path), square, [1, 2], n=2)
+    assert c.items() == [(2, 1, 'x')]
+    assert c.missing() == [(1, 1), (1, 2), (2, 2)]
+    assert os.listdir(str(tmp_path)) == [c.key()]
+
+def test_imap_cached(tmp_path):
+    calls = []
+    expected = sorted(ensemble.imap_serial(square, [1, 2], n=2))
+    assert sorted(ensemble.imap_cached(counted(calls), square, [1, 2], n=2, root=str(tmp_path))) == expected
+    assert len(calls) == 4
+
+    # Hit: nothing is evaluated again
+    assert sorted(ensemble.imap_cached(counted(calls), square, [1, 2], n=2, root=str(tmp_path))) == expected
+    assert len(calls) == 4
+
+    # A larger n evaluates only the additional tasks
+    res = list(ensemble.imap_cached(counted(calls), square, [1, 2], n=3, root=str(tmp_path)))
+    assert len(res) == 6 and sorted(calls[4: ]) == [(1, 3), (2, 3)]
+
+    # Miss: other jobs
+    list(ensemble.imap_cached(counted(calls), square, [1, 3], n=2, root=str(tmp_path)))
+    assert len(calls) == 10
+    assert len(os.listdir(str(tmp_path))) == 2
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+ecell4 = pytest.importorskip('ecell4')
+pytest.importorskip('ecell4.gillespie')
+ensemble = pytest.importorskip('ecell4.extra.ensemble')
+
+
+@pytest.fixture
+def model():
+    m = ecell4.NetworkModel()
+    m.add_reaction_rule(ecell4.create_degradation_reaction_rule(ecell4.Species('A'), 1.0))
+    return m
+
+def test_observer_percentile(model):
+    obs = ensemble.ensemble_simulations(
+        [0.0, 0.5, 1.0], {'A': 30}, model=model, solver='gillespie', species_list=['A'],
+        n=20, rndseed=1, return_type='observer')
+    (lower, median, upper) = (obs.percentile(q) for q in (5, 50, 95))
+    assert median.shape == obs.data().shape
+    assert (lower[:, 0] == obs.t()).all()
+    assert (lower[:, 1] <= median[:, 1]).all() and (median[:, 1] <= upper[:, 1]).all()
+    assert median[0, 1] == 30
+
+def test_observer_without_reservoir(model):
+    obs = ensemble.ensemble_simulations(
+        [0.0, 1.0], {'A': 30}, model=model, solver='gillespie', species_list=['A'],
+        n=5, rndseed=1, return_type='observer', reservoir=0)
+    with pytest.raises(RuntimeError):
+        obs.percentile(50)
+
+def test_cache_across_methods(model, tmp_path):
+    res = [ensemble.ensemble_simulations(
+               [0.0, 1.0], {'A': 30}, model=model, solver='gillespie', species_list=['A'],
+               n=4, rndseed=1, return_type='array', method=method, cache=str(tmp_path))
+           for method in ('serial', 'multiprocessing')]
+    assert len(os.listdir(str(tmp_path))) == 1
+    assert res[0] == res[1]
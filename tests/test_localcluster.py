@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+localcluster = pytest.importorskip('ecell4.extra.localcluster')
+ensemble = pytest.importorskip('ecell4.extra.ensemble')
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    with localcluster.LocalCluster(path=str(tmp_path / 'cluster'), slots=2) as cluster:
+        yield cluster
+
+def test_run_sge(cluster, tmp_path):
+    res = ensemble.run_sge(lambda job, job_id, task_id: job * task_id, [1, 10], n=2, path=str(tmp_path), wait=1)
+    assert res == [[1, 2], [10, 20]]
+
+def test_imap_sge_without_wait(cluster, tmp_path):
+    assert list(ensemble.imap_sge(lambda job, job_id, task_id: job, [1], n=2, path=str(tmp_path), wait=False)) == []
+    assert any(filename.endswith('.bundle') for filename in os.listdir(str(tmp_path)))
+
+def test_run_sge_failing_task(cluster, tmp_path):
+    with pytest.raises(RuntimeError, match='ZeroDivisionError'):
+        ensemble.run_sge(lambda job, job_id, task_id: job / (task_id - 2), [1], n=2, path=str(tmp_path), wait=1)
@@ -0,0 +1,56 @@
+import pytest
+
+procpool = pytest.importorskip('ecell4.extra.procpool')
+
+
+def square(x):
+    return x * x
+
+@pytest.mark.parametrize('context', [None, 'spawn'])
+def test_pool_default_target(context):
+    k = 3
+    with procpool.Pool(2, modules=(), target=lambda x: x + k, context=context) as pool:
+        assert sorted(res for _, res in pool.imap_unordered(None, [(1, ), (2, ), (3, )])) == [4, 5, 6]
+
+def test_pool_target(context='spawn'):
+    with procpool.Pool(2, modules=(), context=context) as pool:
+        assert sorted(pool.imap_unordered(square, [(1, ), (2, ), (3, )])) == [(0, 1), (1, 4), (2, 9)]
+
+def drain(schedule):
+    chunks = []
+    while True:
+        chunk = schedule.next_chunk()
+        if len(chunk) == 0:
+            return chunks
+        chunks.append(chunk)
+
+def test_longest_first():
+    tasks = [('fast', i) for i in range(40)] + [('slow', i) for i in range(4)]
+    schedule = procpool.LongestFirst(tasks, key=lambda x: x[0], processes=2)
+
+    # A group not measured yet is probed with a single task
+    probes = [schedule.next_chunk(), schedule.next_chunk()]
+    assert [[x for _, x in chunk] for chunk in probes] == [[('fast', 0)], [('slow', 0)]]
+    for (i, x), elapsed in zip((probes[0][0], probes[1][0]), (0.1, 10.0)):
+        schedule.report(i, elapsed)
+    assert schedule.expected('fast') == 0.1 and schedule.expected('slow') == 10.0
+
+    # The slow group goes first, and chunks shrink to a single task at the tail
+    chunks = drain(schedule)
+    assert [x[0] for _, x in chunks[0]] == ['slow']
+    assert len(chunks[-1]) == 1
+    indices = [i for chunk in probes + chunks for i, _ in chunk]
+    assert sorted(indices) == list(range(len(tasks)))
+
+def test_longest_first_chunksize():
+    schedule = procpool.LongestFirst(range(100), key=lambda x: 0, processes=1, chunksize=5)
+    (i, _), = schedule.next_chunk()
+    schedule.report(i, 1.0)
+    chunks = drain(schedule)
+    assert max(len(chunk) for chunk in chunks) == 5
+    assert sum(len(chunk) for chunk in chunks) == 99
+
+def test_pool_longest_first():
+    schedule = procpool.LongestFirst([(x, ) for x in range(10)], key=lambda args: args[0] % 2, processes=2)
+    with procpool.Pool(2, modules=()) as pool:
+        assert sorted(pool.imap_unordered(square, schedule)) == [(x, x * x) for x in range(10)]
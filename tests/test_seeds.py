@@ -0,0 +1,35 @@
+import pickle
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+seeds = pytest.importorskip('ecell4.extra.seeds')
+
+
+def test_seed():
+    seq = seeds.SeedSequence(12345)
+    assert seq.seed(1, 1) == seeds.SeedSequence(12345).seed(1, 1)
+    assert seq.seed(1, 1) != seq.seed(1, 2)
+    assert seq.seed(1, 1) != seq.seed(2, 1)
+    assert seq.seed(1, 1) != seeds.SeedSequence(12346).seed(1, 1)
+    assert all(0 <= seq.seed(1, i) < 2 ** 31 for i in range(1, 100))
+
+def test_spawn():
+    seq = seeds.SeedSequence(12345)
+    assert seq.spawn(1).seed(3) == seq.seed(1, 3)
+    assert seq.spawn(1, 3).seed() == seq.seed(1, 3)
+    assert pickle.loads(pickle.dumps(seq.spawn(2))) == seq.spawn(2)
+
+def test_seeds():
+    seq = seeds.SeedSequence(12345)
+    values = seq.seeds(2, 1000)
+    assert values.dtype == numpy.int64
+    assert values.tolist() == [seq.seed(2, i) for i in range(1, 1001)]
+    assert seq.seeds(2, [7, 3]).tolist() == [seq.seed(2, 7), seq.seed(2, 3)]
+    assert seq.seeds(2, 10).tolist() == values[: 10].tolist()  # Extending n keeps seeds
+    assert len(set(values.tolist())) == len(values)
+
+def test_entropy():
+    assert seeds.SeedSequence().entropy() != seeds.SeedSequence().entropy()
+    with pytest.raises(ValueError):
+        seeds.SeedSequence(-1)